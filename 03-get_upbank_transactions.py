@@ -4,11 +4,11 @@ import datetime
 from dateutil.relativedelta import relativedelta
 from dotenv import load_dotenv
 from datetime import datetime
+from up_api import DEFAULT_MAX_CONCURRENCY, create_session, get_accounts, get_all_account_transactions
 
 """
-This currently fetches transaction from one account, identified in .env
-- Note, actually it currently fetches transactions from all accounts, not limited to a particular account
-It should ultimately get transactions from all accounts sequentially and sync them with YNAB
+This fetches transactions from every Up account (TRANSACTIONAL and all SAVERs)
+Accounts are fetched concurrently over one pooled, keep-alive session; UP_MAX_CONCURRENCY in .env caps how many at once
 """
 
 # Load environment variables
@@ -16,18 +16,15 @@ load_dotenv()
 
 # Get API key from environment variables
 UP_API_KEY = os.getenv("UP_API_KEY")
+UP_MAX_CONCURRENCY = int(os.getenv("UP_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
 
 # Check if API key exists
 if not UP_API_KEY:
     print("Error: UP_API_KEY not found in environment variables.")
     exit(1)
 
-# Set up API endpoint and headers
-UP_API_URL = "https://api.up.com.au/api/v1"
-headers = {
-    "Authorization": f"Bearer {UP_API_KEY}",
-    "Content-Type": "application/json"
-}
+# Set up a shared session for the Up API
+session = create_session(UP_API_KEY, UP_MAX_CONCURRENCY)
 
 # Calculate date 30 days ago
 thirty_days_ago = datetime.now() - relativedelta(days=30)
@@ -35,51 +32,27 @@ print(f"Thirty days ago was {thirty_days_ago}")
 since_date = thirty_days_ago.isoformat()
 
 
-# Function to get transactions
 """
 TODO: Probably want this to be from the day before the last sync? Assuming transactions have individual IDs to remove 
 duplicates
 """
 
-from datetime import datetime
-
-
-def get_transactions(since_date):
-    # Format the date properly for RFC 3339
-    # Convert to UTC and add the 'Z' suffix or proper timezone offset
-    if isinstance(since_date, datetime):
-        formatted_date = since_date.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-    else:
-        # If it's already a string, make sure it has timezone info
-        formatted_date = since_date if 'Z' in since_date or '+' in since_date else f"{since_date}Z"
-
-    transactions = []
-    page_url = f"{UP_API_URL}/transactions?filter[since]={formatted_date}"
-
-    while page_url:
-        try:
-            print(f"Fetching transactions from: {page_url}")
-            response = requests.get(page_url, headers=headers)
-            response.raise_for_status()
+# Get transactions for every account
+try:
+    accounts = get_accounts(session)
+    transactions_by_account = get_all_account_transactions(
+        session, since_date, [account["id"] for account in accounts], UP_MAX_CONCURRENCY)
 
-            data = response.json()
-            transactions.extend(data["data"])
-
-            # Check if there's a next page
-            if "links" in data and "next" in data["links"] and data["links"]["next"]:
-                page_url = data["links"]["next"]
-            else:
-                page_url = None
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching transactions: {e}")
-            return []
-
-    return transactions
+except requests.exceptions.RequestException as e:
+    print(f"Error fetching transactions: {e}")
+    exit(1)
 
+for account in accounts:
+    account_transactions = transactions_by_account[account["id"]]
+    print(f"- {account['attributes']['displayName']} ({account['attributes']['accountType']}): "
+          f"{len(account_transactions)} transactions")
 
-# Get transactions
-transactions = get_transactions(since_date)
+transactions = [tx for account_transactions in transactions_by_account.values() for tx in account_transactions]
 
 # Print transaction information
 print(f"Found {len(transactions)} transactions in the last 30 days:")
@@ -1,6 +1,9 @@
 import os
 import requests
 from dotenv import load_dotenv
+from sync_state import DEFAULT_STATE_PATH, SyncState
+from ynab_api import create_session
+from ynab_metadata import YnabMetadata
 
 """
 I'll need to match each Up Bank account to its corresponding YNAB account, roughly like this:
@@ -31,28 +34,20 @@ if not YNAB_BUDGET_ID:
     print("Please run 02-test_ynab_api.py and add your budget ID to the .env file.")
     exit(1)
 
-# Set up API endpoint and headers
-YNAB_API_URL = "https://api.ynab.com/v1"
-headers = {
-    "Authorization": f"Bearer {YNAB_API_KEY}",
-    "Content-Type": "application/json"
-}
+# Accounts are kept in the sync state's metadata cache; each run only asks YNAB for what changed since the last
+ynab_session = create_session(YNAB_API_KEY)
+sync_state = SyncState(os.getenv("SYNC_STATE_PATH", DEFAULT_STATE_PATH))
+ynab_metadata = YnabMetadata(YNAB_BUDGET_ID, ynab_session, sync_state)
 
 # Try to get account information
 try:
-    # Make a request to the accounts endpoint
-    response = requests.get(f"{YNAB_API_URL}/budgets/{YNAB_BUDGET_ID}/accounts", headers=headers)
-
-    # Check if request was successful
-    response.raise_for_status()
-
-    # Print the response
-    data = response.json()
-    print("Successfully retrieved accounts from YNAB!")
-    print(f"Found {len(data['data']['accounts'])} accounts:")
+    changed = ynab_metadata.refresh(["accounts"])
+    accounts = ynab_metadata.all("accounts")
+    print(f"Successfully retrieved accounts from YNAB! ({changed} new or changed since the last run)")
+    print(f"Found {len(accounts)} accounts:")
 
     # Print account information
-    for account in data['data']['accounts']:
+    for account in accounts:
         print(f"- {account['name']}")
         print(f"  Account ID: {account['id']}")
         print(f"  Type: {account['type']}")
@@ -62,4 +57,6 @@ try:
     print("Add your Up Bank account ID from YNAB to the .env file as YNAB_ACCOUNT_ID")
 
 except requests.exceptions.RequestException as e:
-    print(f"Error retrieving YNAB accounts: {e}")
\ No newline at end of file
+    print(f"Error retrieving YNAB accounts: {e}")
+
+sync_state.close()
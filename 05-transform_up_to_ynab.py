@@ -1,9 +1,9 @@
 import os
 import requests
 from datetime import datetime
-from dateutil import parser
 from dateutil.relativedelta import relativedelta
 from dotenv import load_dotenv
+from transform import transform_to_ynab_format
 
 # Load environment variables
 load_dotenv()
@@ -69,51 +69,12 @@ def get_transactions(since_date):
     return transactions
 
 
-# Function to transform transactions to YNAB format
-def transform_to_ynab_format(up_transactions):
-    ynab_transactions = []
-
-    for tx in up_transactions:
-        # Skip transactions that aren't SETTLED
-        if tx["attributes"]["status"] != "SETTLED":
-            continue
-
-        # Get transaction date
-        date = parser.parse(tx["attributes"]["createdAt"]).strftime("%Y-%m-%d")
-
-        # Get transaction amount (convert from dollars to milliunits)
-        amount_in_dollars = float(tx["attributes"]["amount"]["value"])
-        # YNAB uses milliunits (1/1000 of currency unit)
-        amount_in_milliunits = int(amount_in_dollars * 1000)
-
-        # Get transaction description/payee
-        description = tx["attributes"]["description"]
-
-        # Get transaction ID (important for avoiding duplicates)
-        import_id = tx["id"][:36]  # YNAB import_id must be <= 36 chars
-
-        ynab_transaction = {
-            "account_id": YNAB_ACCOUNT_ID,
-            "date": date,
-            "amount": amount_in_milliunits,
-            "payee_name": description,
-            "memo": f"Up Bank: {tx['attributes'].get('rawText', '')}",
-            "cleared": "cleared",
-            "approved": False,
-            "import_id": import_id
-        }
-
-        ynab_transactions.append(ynab_transaction)
-
-    return ynab_transactions
-
-
 # Get transactions
 up_transactions = get_transactions(since_date)
 print(f"Found {len(up_transactions)} transactions from Up Bank.")
 
 # Transform to YNAB format
-ynab_transactions = transform_to_ynab_format(up_transactions)
+ynab_transactions = transform_to_ynab_format(up_transactions, YNAB_ACCOUNT_ID)
 print(f"Transformed {len(ynab_transactions)} transactions to YNAB format.")
 
 # Print a few sample transformations
@@ -126,7 +87,7 @@ for i, (up_tx, ynab_tx) in enumerate(zip(up_transactions[:3], ynab_transactions[
     print(f"  Date: {up_tx['attributes']['createdAt']}")
 
     print("YNAB format:")
-    print(f"  Payee: {ynab_tx['payee_name']}")
-    print(f"  Amount: {ynab_tx['amount']} milliunits ({float(ynab_tx['amount']) / 1000:.2f})")
-    print(f"  Date: {ynab_tx['date']}")
-    print(f"  Import ID: {ynab_tx['import_id']}")
\ No newline at end of file
+    print(f"  Payee: {ynab_tx.payee_name}")
+    print(f"  Amount: {ynab_tx.amount} milliunits ({ynab_tx.amount / 1000:.2f})")
+    print(f"  Date: {ynab_tx.date}")
+    print(f"  Import ID: {ynab_tx.import_id}")
\ No newline at end of file
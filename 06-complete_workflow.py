@@ -1,14 +1,32 @@
 import os
+import argparse
 import requests
-import yaml
 from dotenv import load_dotenv
-from datetime import datetime
+from transform import transform_to_ynab_format
+from ynab_api import (DEFAULT_BATCH_SIZE, create_session as create_ynab_session, post_transactions_in_batches,
+                      refresh_account_transactions)
+from ynab_metadata import YnabMetadata
+from up_api import create_session as create_up_session, get_accounts, get_account_transactions
+from account_map import DEFAULT_RESOURCES_PATH, AccountMap
+from sync_state import (DEFAULT_RECONCILIATION_LOOKBACK_DAYS, DEFAULT_STATE_PATH, SyncState, next_sync_cursor,
+                        reconciliation_start)
+from replay_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DEFAULT_TTL, ReplayCache
+from transfers import plan_transfers
+from rules import DEFAULT_RULES_PATH, RuleSet
 
 """
 A function to find the most recent YNAB account reconciliation date, given an Up Bank account ID
-# TODO: Store the last known reconciliation date in order to limit transaction history download (if last known exists)
+The last known reconciliation date is kept in the sync state, and falls back to a lookback window if there isn't one
 """
 
+# Command line options; the replay cache lets transform changes be tried out without hitting either API
+arg_parser = argparse.ArgumentParser(description="Sync an Up account to YNAB")
+arg_parser.add_argument("--cache", action="store_true",
+                        help="record API responses to the replay cache, reusing recent ones if a request fails")
+arg_parser.add_argument("--offline", action="store_true",
+                        help="answer every request from the replay cache; nothing is uploaded")
+args = arg_parser.parse_args()
+
 # Load environment variables
 load_dotenv()
 
@@ -21,6 +39,37 @@ YNAB_ACCOUNT_ID = os.getenv("YNAB_ACCOUNT_ID")
 UP_API_KEY = os.getenv("UP_API_KEY")
 UP_DEBITS_ACCOUNT_ID = os.getenv("UP_DEBITS_ACCOUNT_ID")
 
+# Uploading is opt-in while the workflow is still being developed; set SUBMIT_TO_YNAB=true in .env to post
+SUBMIT_TO_YNAB = os.getenv("SUBMIT_TO_YNAB", "false").lower() == "true"
+YNAB_BATCH_SIZE = int(os.getenv("YNAB_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+
+# Where the last sync got up to for each account is kept on disk, so repeat runs only fetch new transactions
+SYNC_STATE_PATH = os.getenv("SYNC_STATE_PATH", DEFAULT_STATE_PATH)
+
+# How many days back to start from if the YNAB account has never been reconciled
+RECONCILIATION_LOOKBACK_DAYS = float(os.getenv("RECONCILIATION_LOOKBACK_DAYS", DEFAULT_RECONCILIATION_LOOKBACK_DAYS))
+
+# Static Up <-> YNAB account links; see account_map.py for the expected layout
+RESOURCES_PATH = os.getenv("RESOURCES_PATH", DEFAULT_RESOURCES_PATH)
+account_map = AccountMap.from_yaml(RESOURCES_PATH) if os.path.exists(RESOURCES_PATH) else AccountMap([])
+
+# Optional payee clean-up and categorisation rules; see rules.py for the expected layout
+RULES_PATH = os.getenv("RULES_PATH", DEFAULT_RULES_PATH)
+rules = RuleSet.from_yaml(RULES_PATH) if os.path.exists(RULES_PATH) else None
+
+# Raw API responses are cached on disk when --cache or --offline is given
+replay_cache = None
+if args.cache or args.offline:
+    replay_cache = ReplayCache(
+        os.getenv("REPLAY_CACHE_DIR", DEFAULT_CACHE_DIR),
+        ttl=float(os.getenv("REPLAY_CACHE_TTL", DEFAULT_TTL)),
+        max_bytes=int(os.getenv("REPLAY_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+        offline=args.offline)
+
+if args.offline and SUBMIT_TO_YNAB:
+    print("Running offline; transactions will not be uploaded to YNAB")
+    SUBMIT_TO_YNAB = False
+
 
 # Temporarily store specific Up account id here; later will pass from function call to generalise; ie loop over accounts
 UP_ACCOUNT_ID = UP_DEBITS_ACCOUNT_ID
@@ -41,12 +90,14 @@ if not YNAB_ACCOUNT_ID:
     exit(1)
 
 
-# Set up YNAB API endpoint and headers
-YNAB_API_URL = "https://api.ynab.com/v1"
-headers = {
-    "Authorization": f"Bearer {YNAB_API_KEY}",
-    "Content-Type": "application/json"
-}
+# Set up a rate-limited, retrying session for the YNAB API
+ynab_session = create_ynab_session(YNAB_API_KEY, cache=replay_cache)
+
+sync_state = SyncState(SYNC_STATE_PATH)
+
+# YNAB accounts, payees and categories are cached in the sync state; YNAB is only asked on a first run, or for an
+# account that isn't cached yet
+ynab_metadata = YnabMetadata(YNAB_BUDGET_ID, ynab_session, sync_state)
 
 
 def find_ynab_account_name_from_id(ynab_account_id):
@@ -59,80 +110,44 @@ def find_ynab_account_name_from_id(ynab_account_id):
     Returns:
         str: YNAB account name corresponding to YNAB account ID
     """
-    # Make a request to the accounts endpoint
-    response = requests.get(
-        f"{YNAB_API_URL}/budgets/{YNAB_BUDGET_ID}/accounts/{ynab_account_id}",
-        headers=headers)
-
-    # Check if request was successful
-    response.raise_for_status()
-
-    # Parse the response to obtain account name
-    data = response.json()  # Obviously this returns a json
-
-    return data['data']['account']['name']
+    return ynab_metadata.account_name(ynab_account_id)
 
 
 current_ynab_account_name = find_ynab_account_name_from_id(YNAB_ACCOUNT_ID)
 print(f"Current YNAB account name is: \n  - {current_ynab_account_name}")
 
-
-# Get transaction info for given account and determine reconciliation date
-# TODO: Remove hard-coded date; this was for testing and development only
-def determine_ynab_account_reconciliation_date(ynab_account_id):
-    try:
-        # Make a request to the transactions endpoint
-        response = requests.get(f"{YNAB_API_URL}/budgets/{YNAB_BUDGET_ID}/accounts/{ynab_account_id}/transactions?since_date=2025-03-15", headers=headers)
-
-        # Check if request was successful
-        response.raise_for_status()
-        # print(response.raise_for_status()) # 'None', if successful
-
-        # Print the response
-        data = response.json() # Obviously this returns a json
-        # print("Successfully connected to YNAB API")
-        # print(data)
-        # print(data['data'])
-        # print(data['data']['transactions']) # Individual transactions contained within {}
-        # print(type(data['data']['transactions'])) # list
-
-        # # Look at the first transaction
-        # print(data['data']['transactions'][0]) # Print the first transaction
-        # print(type(data['data']['transactions'][0])) # dict
-
-        # # Look at elements of this dictionary
-        # print(data['data']['transactions'][0]['date'])
-        # print(type(data['data']['transactions'][0]['date'])) # str - note that this is not a date
-
-        # transaction_date = data['data']['transactions'][0]['date']
-        # print(f"Date of current transaction is: {transaction_date}")
-
-        # transaction_datetime = datetime.strptime(transaction_date, '%Y-%m-%d')
-        # print(f"datetime representation of current transaction is: {transaction_datetime}")
+last_synced_at = sync_state.get_last_synced_at(UP_ACCOUNT_ID)
 
 
-        # Print dates of reconciled transactions
-        reconciled_dates = []
+# Determine reconciliation date for the given account
+# The date is kept in the sync state; YNAB is only asked (for the transactions changed since the last run) when
+# there isn't one yet
+def determine_ynab_account_reconciliation_date(ynab_account_id):
+    last_reconciled_date = sync_state.get_last_reconciled_date(ynab_account_id)
 
-        for transaction in data['data']['transactions']:
-            if transaction['cleared'] == "reconciled":
-                transaction_date = datetime.strptime(transaction['date'], '%Y-%m-%d')
-                # print(f"Date of current transaction is: {transaction_date}")
-                # TODO: Should the next line use reconciled_dates.extend()? What does that do?
-                reconciled_dates.append(transaction_date)
+    if last_reconciled_date is None:
+        try:
+            changed = refresh_account_transactions(sync_state, YNAB_BUDGET_ID, ynab_account_id, ynab_session)
+            print(f"Fetched {changed} new or changed transactions for {current_ynab_account_name} from YNAB")
+            last_reconciled_date = sync_state.get_last_reconciled_date(ynab_account_id)
 
-        # print(reconciled_dates)
+        except requests.exceptions.RequestException as e:
+            print(f"Error connecting to YNAB API: {e}")
 
-        last_reconciled_date = max(reconciled_dates)
+    if last_reconciled_date is None:
+        print(f"{current_ynab_account_name} has no reconciled transactions; "
+              f"starting from {RECONCILIATION_LOOKBACK_DAYS:g} days ago")
+    else:
         print(f"{current_ynab_account_name} was last reconciled on: {last_reconciled_date}")
-        # TODOx Add account name to final print statement
-
-        return last_reconciled_date
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error connecting to YNAB API: {e}")
+    return reconciliation_start(last_reconciled_date, RECONCILIATION_LOOKBACK_DAYS)
 
-reconciliation_date = determine_ynab_account_reconciliation_date(YNAB_ACCOUNT_ID)
+# Only fall back to the reconciliation date when this account has never been synced
+if last_synced_at:
+    print(f"{current_ynab_account_name} was last synced up to: {last_synced_at}")
+    since_date = last_synced_at
+else:
+    since_date = determine_ynab_account_reconciliation_date(YNAB_ACCOUNT_ID)
 # print(test)
 
 
@@ -141,52 +156,32 @@ reconciliation_date = determine_ynab_account_reconciliation_date(YNAB_ACCOUNT_ID
 Retrieve all Up transactions from the YNAB reconciliation date to present
 """
 
-# Set up 'Up Bank' API endpoint and headers
-UP_API_URL = "https://api.up.com.au/api/v1"
-headers = {
-    "Authorization": f"Bearer {UP_API_KEY}",
-    "Content-Type": "application/json"
-}
-
-def get_up_account_transactions(up_account_id, since_date):
-    # Format the date properly for RFC 3339
-    # Convert to UTC and add the 'Z' suffix or proper timezone offset
-    if isinstance(since_date, datetime):
-        formatted_date = since_date.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-    else:
-        # If it's already a string, make sure it has timezone info
-        formatted_date = since_date if 'Z' in since_date or '+' in since_date else f"{since_date}Z"
-
-    transactions = []
-    page_url = f"{UP_API_URL}/accounts/{up_account_id}/transactions?filter[since]={formatted_date}"
-
-    while page_url:
-        try:
-            print(f"Fetching transactions from: {page_url}")
-            response = requests.get(page_url, headers=headers)
-            response.raise_for_status()
+# Set up a shared, keep-alive session for the Up API
+up_session = create_up_session(UP_API_KEY, cache=replay_cache)
 
-            data = response.json()
-            transactions.extend(data["data"])
 
-            # Check if there's a next page
-            if "links" in data and "next" in data["links"] and data["links"]["next"]:
-                page_url = data["links"]["next"]
-            else:
-                page_url = None
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching transactions: {e}")
-            return []
+def get_up_account_transactions(up_account_id, since_date):
+    try:
+        return get_account_transactions(up_session, up_account_id, since_date)
 
-    return transactions
+    except requests.exceptions.RequestException:
+        # Don't carry on with a partial history; the sync cursor is unchanged, so the next run starts from the same place
+        print("Up transactions could not be fetched; nothing was uploaded")
+        sync_state.close()
+        exit(1)
 
 
 # Get Up account transactions
-transactions = get_up_account_transactions(UP_ACCOUNT_ID, reconciliation_date)
+transactions = get_up_account_transactions(UP_ACCOUNT_ID, since_date)
+
+# Each Up account's type, so an unlisted TRANSACTIONAL account (eg. 2Up) isn't mistaken for a saver
+try:
+    account_map.set_up_accounts(get_accounts(up_session))
+except requests.exceptions.RequestException as e:
+    print(f"Up account types could not be fetched; unlisted accounts will map to the default saver: {e}")
 
 # Print Up transaction information
-print(f"Found {len(transactions)} Up Bank transactions in the last 30 days:")
+print(f"Found {len(transactions)} Up Bank transactions since {since_date}:")
 for i, tx in enumerate(transactions[:5], 1):  # Print first 5 transactions
     print(f"\nTransaction {i}:")
     print(f"ID: {tx['id']}")
@@ -199,9 +194,10 @@ for i, tx in enumerate(transactions[:5], 1):  # Print first 5 transactions
     if tx['relationships']['transferAccount']['data'] is None:
         print("Transfer account: None")
     else:
-        print(f"Transfer account: {tx['relationships']['transferAccount']['data']['id']}")
-        # Note that different saver accounts have different account IDs
-        # TODO: Match transfer account id to known transaction account (from yaml) otherwise call it saver
+        transfer_account_id = tx['relationships']['transferAccount']['data']['id']
+        print(f"Transfer account: {transfer_account_id}")
+        # Note that different saver accounts have different account IDs; unlisted ones map to the default saver
+        print(f"Transfer YNAB account: {account_map.ynab_id_for_up(transfer_account_id)}")
 
     print(f"Account id: {tx['relationships']['account']['data']['id']}") # Current account id
 
@@ -210,42 +206,45 @@ if len(transactions) > 5:
 
 
 """
-Convert Up Bank transactions to YNAB format
+Pair transfer legs, so each inter-account transfer reaches YNAB once, as a YNAB transfer
 """
 
-ynab_transactions = []
-
-for i, tx in enumerate(transactions):
-    # Date
-    # date = tx['attributes']['date']
-    # Dollar amount
-    currency_amount = tx['attributes']['amount']['value']
-    # Milliunit amount
-    millunit_amount = currency_amount * 1000
-    # import id = up bank transaction id
-    import_id = tx['id']
-    # Set a flag colour; static
-    flag_colour = "purple"
-    # Payee
-    payee_name = tx['attributes']['description'] # eg. 'Transfer from 2Up Spending'
-    # Approved; not sure if I'll use this
-    approved = False
-    # Category name: if this is not set, will YNAB try to auto-categorise?
-    # Payee id for transfers only, otherwise payee is payee_name = tx['attributes']['description']
-    if "Transfer from" in payee_name:
-        payee_id = tx['relationships']['transferAccount']['data']['id'] # Need to look up the YNAB equivalent account from yaml
-        print(payee_id)
-    # Do these two Up Bank payee ids match for transfers? No, one is human readable text, the other is a hash of some sort
-    # How does this transfer look from the other Up Bank account? Can I join them by the transaction id? Ie, not overwrite them
-
-
-# TODO: Identify transfers to 2up / savers accounts, and assign correctly
-"""
-"account_name": "Up Dally",
-"payee_id": "3de496b6
+try:
+    transfer_payee_ids = ynab_metadata.transfer_payee_ids(account_map.by_ynab_id)
+except requests.exceptions.RequestException as e:
+    print(f"Error fetching YNAB transfer payees, transfers will be sent as ordinary transactions: {e}")
+    transfer_payee_ids = {}
+
+# Every linked Up account is synced to YNAB at some point, so incoming legs from those are left to their outgoing leg
+transfer_plan = plan_transfers(transactions, account_map, transfer_payee_ids,
+                               synced_up_account_ids=set(account_map.by_up_id) | {UP_ACCOUNT_ID})
+print(f"Paired {len(transfer_plan.pairs)} transfers; "
+      f"{len(transfer_plan.payee_ids)} will be sent as YNAB transfers, {len(transfer_plan.suppressed)} left out")
 
-Note that transfer_account_id DOES match the ynab account id
-payee_id for transfers does NOT match the ynab account id
 
-transactions[0]['relationships']['transferAccount']
 """
+Submit the transformed transactions to YNAB in bulk, one request per batch
+"""
+
+# The same account map the transfer plan was built from, so transfers and Round Ups are routed as SyncService does
+ynab_transactions = transform_to_ynab_format(transactions, YNAB_ACCOUNT_ID,
+                                             account_map=account_map if account_map.accounts else None,
+                                             transfer_plan=transfer_plan, rules=rules)
+print(f"Transformed {len(ynab_transactions)} transactions to YNAB format.")
+
+if SUBMIT_TO_YNAB:
+    results = post_transactions_in_batches(
+        ynab_transactions, YNAB_BUDGET_ID, ynab_session, YNAB_BATCH_SIZE, sync_state)
+    print(f"Created {len(results['created'])} transactions in {current_ynab_account_name}")
+    print(f"Skipped {len(results['skipped']) + len(results['duplicates'])} transactions already imported")
+    if results["failed"]:
+        print(f"Failed to post {len(results['failed'])} transactions; they will be retried on the next run")
+    else:
+        # Only move the cursor forward once everything up to it is safely in YNAB
+        cursor = next_sync_cursor(transactions, last_synced_at)
+        if cursor is not None:
+            sync_state.record_sync(UP_ACCOUNT_ID, last_synced_at=cursor)
+else:
+    print("SUBMIT_TO_YNAB is not set; skipping upload to YNAB")
+
+sync_state.close()
@@ -0,0 +1,63 @@
+import os
+import requests
+from dotenv import load_dotenv
+from pipeline import stream_account_to_ynab
+from sync_state import DEFAULT_STATE_PATH, SyncState
+from up_api import create_session as create_up_session
+from ynab_api import DEFAULT_BATCH_SIZE, create_session as create_ynab_session
+
+"""
+Syncs one Up account into YNAB as a stream: each Up page is transformed and uploaded in batches as it arrives
+Unlike 06-complete_workflow.py, nothing holds the whole history in memory, which matters for the first backfill
+Starts from the stored sync cursor; on a first run, set SYNC_SINCE_DATE in .env (eg. 2025-03-15T00:00:00)
+"""
+
+# Load environment variables
+load_dotenv()
+
+YNAB_API_KEY = os.getenv("YNAB_API_KEY")
+YNAB_BUDGET_ID = os.getenv("YNAB_BUDGET_ID")
+YNAB_ACCOUNT_ID = os.getenv("YNAB_ACCOUNT_ID")
+UP_API_KEY = os.getenv("UP_API_KEY")
+UP_ACCOUNT_ID = os.getenv("UP_DEBITS_ACCOUNT_ID")
+SYNC_SINCE_DATE = os.getenv("SYNC_SINCE_DATE")
+
+YNAB_BATCH_SIZE = int(os.getenv("YNAB_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+SYNC_STATE_PATH = os.getenv("SYNC_STATE_PATH", DEFAULT_STATE_PATH)
+
+# Check that the required variables exist
+for name, value in [("YNAB_API_KEY", YNAB_API_KEY), ("YNAB_BUDGET_ID", YNAB_BUDGET_ID),
+                    ("YNAB_ACCOUNT_ID", YNAB_ACCOUNT_ID), ("UP_API_KEY", UP_API_KEY),
+                    ("UP_DEBITS_ACCOUNT_ID", UP_ACCOUNT_ID)]:
+    if not value:
+        print(f"Error: {name} not found in environment variables")
+        exit(1)
+
+sync_state = SyncState(SYNC_STATE_PATH)
+since_date = sync_state.get_last_synced_at(UP_ACCOUNT_ID) or SYNC_SINCE_DATE
+
+if not since_date:
+    print("Error: this account has not been synced before; set SYNC_SINCE_DATE in the .env file")
+    exit(1)
+
+print(f"Streaming Up transactions since {since_date} to YNAB")
+
+try:
+    results, cursor = stream_account_to_ynab(
+        create_up_session(UP_API_KEY), UP_ACCOUNT_ID, since_date,
+        YNAB_ACCOUNT_ID, YNAB_BUDGET_ID, create_ynab_session(YNAB_API_KEY), YNAB_BATCH_SIZE,
+        sync_state=sync_state)
+
+    print(f"Created {len(results['created'])} transactions")
+    print(f"Skipped {len(results['skipped']) + len(results['duplicates'])} transactions already imported")
+
+    if results["failed"]:
+        print(f"Failed to post {len(results['failed'])} transactions; they will be retried on the next run")
+    else:
+        sync_state.record_sync(UP_ACCOUNT_ID, last_synced_at=cursor)
+        print(f"Next sync will start from {cursor}")
+
+except requests.exceptions.RequestException as e:
+    print(f"Error fetching transactions from Up: {e}")
+
+sync_state.close()
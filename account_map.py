@@ -0,0 +1,123 @@
+import yaml
+
+"""
+Links Up accounts to their YNAB equivalents, using the static account information in resources.yaml:
+
+accounts:
+  - name: Spending
+    up:
+      id: <Up account id>
+    ynab:
+      id: <YNAB account id>
+default_saver:        # optional; Up accounts not listed above (ie. savers) all sync to this YNAB account
+  ynab:
+    id: <YNAB account id>
+round_up_saver:       # optional; where Round Ups go in YNAB, if not the default saver
+  ynab:
+    id: <YNAB account id>
+
+The file is parsed once and indexed by Up id, YNAB id and name, so each lookup is a dict access
+rather than a scan of the account list
+Up accounts that aren't listed fall back to the default saver only if they're savers; the accountType of each Up
+account is recorded with set_up_accounts(), so an unlisted TRANSACTIONAL account (eg. 2Up) isn't synced at all
+"""
+
+DEFAULT_RESOURCES_PATH = "resources.yaml"
+
+
+class AccountMap:
+    """
+    Up <-> YNAB account lookups
+
+    Args:
+        accounts (list): account entries as found under 'accounts' in resources.yaml
+        default_saver_ynab_id (str): YNAB account used for Up accounts that aren't listed, if any
+        round_up_ynab_id (str): YNAB account Round Ups are transferred to; defaults to the default saver
+    """
+
+    def __init__(self, accounts, default_saver_ynab_id=None, round_up_ynab_id=None):
+        self.accounts = accounts
+        self.default_saver_ynab_id = default_saver_ynab_id
+        self.round_up_ynab_id = round_up_ynab_id or default_saver_ynab_id
+
+        self.by_up_id = {account['up']['id']: account for account in accounts}
+        self.by_name = {account['name']: account for account in accounts}
+
+        # Several Up accounts may share a YNAB account, so this index holds lists
+        self.by_ynab_id = {}
+        for account in accounts:
+            self.by_ynab_id.setdefault(account['ynab']['id'], []).append(account)
+
+        # Up account id -> accountType (SAVER or TRANSACTIONAL), for accounts seen by set_up_accounts()
+        self.up_account_types = {}
+
+    @classmethod
+    def from_yaml(cls, path=DEFAULT_RESOURCES_PATH):
+        """
+        Args:
+            path (str): location of resources.yaml
+
+        Returns:
+            AccountMap
+        """
+        with open(path, "r") as file:
+            return cls.from_dict(yaml.safe_load(file) or {})
+
+    @classmethod
+    def from_dict(cls, resources):
+        """
+        Args:
+            resources (dict): parsed resources.yaml layout, ie. 'accounts' and optionally 'default_saver' and
+                'round_up_saver'
+
+        Returns:
+            AccountMap
+        """
+        default_saver = resources.get('default_saver') or {}
+        round_up_saver = resources.get('round_up_saver') or {}
+        return cls(resources.get('accounts') or [], default_saver.get('ynab', {}).get('id'),
+                   round_up_saver.get('ynab', {}).get('id'))
+
+    def set_up_accounts(self, up_accounts):
+        """
+        Records the accountType of each Up account, which decides whether an unlisted one falls back to the
+        default saver
+
+        Args:
+            up_accounts (list): Up accounts, as returned by up_api.get_accounts()
+        """
+        self.up_account_types.update(
+            {account['id']: account['attributes']['accountType'] for account in up_accounts})
+
+    def ynab_id_for_up(self, up_account_id, account_type=None):
+        """
+        Finds the YNAB account an Up account syncs to
+
+        Args:
+            up_account_id (str)
+            account_type (str): Up accountType; defaults to the one recorded by set_up_accounts(). Unlisted
+                TRANSACTIONAL accounts never fall back to savers
+
+        Returns:
+            str: YNAB account id, or None if the Up account isn't mapped
+        """
+        account = self.by_up_id.get(up_account_id)
+        if account is not None:
+            return account['ynab']['id']
+        if (account_type or self.up_account_types.get(up_account_id)) == "TRANSACTIONAL":
+            return None
+        return self.default_saver_ynab_id
+
+    def up_ids_for_ynab(self, ynab_account_id):
+        """
+        Args:
+            ynab_account_id (str)
+
+        Returns:
+            list: Up account ids listed against the YNAB account
+        """
+        return [account['up']['id'] for account in self.by_ynab_id.get(ynab_account_id, [])]
+
+    def name_for_up(self, up_account_id):
+        account = self.by_up_id.get(up_account_id)
+        return account['name'] if account is not None else None
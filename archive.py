@@ -0,0 +1,301 @@
+import json
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from models import UP_TIMEZONE, UpTransaction
+from sync_state import to_utc_timestamp
+
+"""
+A local archive of settled Up transactions, so history can be analysed without paging through the API again
+Every page a sync, backfill or export fetches is appended to it. It's partitioned by Up account and month (in
+Melbourne time, as for backfill.py), one directory per partition:
+
+archive/<Up account id>/<YYYY-MM>/
+  created_at.<n>.q     createdAt, seconds since the epoch (int64)
+  date.<n>.i           local calendar date, as a proleptic Gregorian ordinal (int32)
+  amount_cents.<n>.q   amount in cents (int64)
+  category.<n>.H       Up category, as an index into the partition's categories (uint16; 0 is no category)
+  raw.<n>.jsonl        each transaction's raw JSON, one per line, in the same order
+  index.json           the generation <n> of the files above, row count, the categories, and the transaction ids
+                       (so re-fetched transactions aren't added twice)
+
+An append writes the next generation's files alongside the current ones, then replaces index.json to point at them;
+the rename is atomic, so an append that's interrupted leaves the partition as it was
+
+The column files are plain arrays in native byte order, kept sorted by createdAt, so a date-range query bisects
+each partition's createdAt column and copies one slice per column out of a memory map. A year of history is a
+dozen partitions per account, read in milliseconds. HELD transactions aren't archived; the sync fetches them again
+once they've settled
+
+Parquet or Arrow would do the same job, but need pyarrow; these are read with nothing beyond the standard library
+"""
+
+DEFAULT_ARCHIVE_DIR = "archive"
+
+# Column name -> array typecode
+COLUMNS = {
+    "created_at": "q",
+    "date": "i",
+    "amount_cents": "q",
+    "category": "H",
+}
+
+
+def _timestamp(value):
+    return int(datetime.fromisoformat(to_utc_timestamp(value).replace("Z", "+00:00")).timestamp())
+
+
+def _partition_key(timestamp):
+    return datetime.fromtimestamp(timestamp, UP_TIMEZONE).strftime("%Y-%m")
+
+
+class ArchiveColumns:
+    """
+    Columns of the transactions matching a query, one row per transaction, ordered by account then createdAt
+
+    Attributes:
+        created_at (array): createdAt, seconds since the epoch
+        date (array): local date ordinals; date.fromordinal() gives the date
+        amount_cents (array)
+        category (array): indexes into categories
+        account (array): indexes into accounts
+        categories (list): Up category ids; the first is None, for transactions without one
+        accounts (list): Up account ids
+    """
+
+    def __init__(self):
+        for name, typecode in COLUMNS.items():
+            setattr(self, name, array(typecode))
+        self.account = array("H")
+        self.categories = [None]
+        self.accounts = []
+
+    def __len__(self):
+        return len(self.created_at)
+
+
+class Partition:
+    """
+    One account's month of transactions
+
+    Args:
+        path (str): the partition's directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.join(path, "index.json")
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as file:
+                self.index = json.load(file)
+        else:
+            self.index = {"generation": 0, "rows": 0, "categories": [None], "ids": []}
+
+    def column_path(self, name, generation=None):
+        generation = self.index["generation"] if generation is None else generation
+        return os.path.join(self.path, f"{name}.{generation}.{COLUMNS[name]}")
+
+    def raw_path(self, generation=None):
+        generation = self.index["generation"] if generation is None else generation
+        return os.path.join(self.path, f"raw.{generation}.jsonl")
+
+    def read_columns(self, start=0, stop=None):
+        """
+        Copies rows start:stop of every column out of their memory maps
+
+        Returns:
+            dict: column name -> array
+        """
+        stop = self.index["rows"] if stop is None else stop
+        columns = {}
+        for name, typecode in COLUMNS.items():
+            columns[name] = array(typecode)
+            if stop > start:
+                with open(self.column_path(name), "rb") as file, \
+                        mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    size = columns[name].itemsize
+                    columns[name].frombytes(mapped[start * size:stop * size])
+        return columns
+
+    def row_range(self, since=None, until=None):
+        """
+        Args:
+            since (int): first createdAt to include, in seconds since the epoch
+            until (int): createdAt to stop before
+
+        Returns:
+            tuple: (start, stop) rows, found by bisecting the memory-mapped createdAt column
+        """
+        rows = self.index["rows"]
+        if rows == 0 or (since is None and until is None):
+            return 0, rows
+        with open(self.column_path("created_at"), "rb") as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            created_at = memoryview(mapped).cast("q")
+            try:
+                start = bisect_left(created_at, since) if since is not None else 0
+                stop = bisect_left(created_at, until) if until is not None else rows
+            finally:
+                created_at.release()
+        return start, stop
+
+    def append(self, up_transactions):
+        """
+        Adds settled transactions not already in the partition, keeping the columns sorted by createdAt
+        A partition is a month of one account, so it's simply rewritten
+
+        Args:
+            up_transactions (list): (raw Up JSON, UpTransaction) pairs belonging to this partition
+
+        Returns:
+            int: number of transactions added
+        """
+        known = set(self.index["ids"])
+        new = [(raw, tx) for raw, tx in up_transactions if tx.is_settled and tx.id not in known]
+        if not new:
+            return 0
+
+        columns = self.read_columns()
+        raw_lines = []
+        if self.index["rows"]:
+            with open(self.raw_path()) as file:
+                raw_lines = file.read().splitlines()
+
+        categories = self.index["categories"]
+        category_codes = {category: code for code, category in enumerate(categories)}
+        rows = list(zip(columns["created_at"], columns["date"], columns["amount_cents"], columns["category"],
+                        self.index["ids"], raw_lines))
+        for raw, tx in new:
+            if tx.category_id not in category_codes:
+                category_codes[tx.category_id] = len(categories)
+                categories.append(tx.category_id)
+            rows.append((int(tx.created_at.timestamp()), tx.local_date.toordinal(), tx.amount_cents,
+                         category_codes[tx.category_id], tx.id, json.dumps(raw)))
+        rows.sort(key=lambda row: row[0])
+
+        generation = self.index["generation"] + 1
+        index = {"generation": generation, "rows": len(rows), "categories": categories,
+                 "ids": [row[4] for row in rows]}
+        files = {self.column_path(name, generation): array(COLUMNS[name], (row[position] for row in rows)).tobytes()
+                 for position, name in enumerate(COLUMNS)}
+        files[self.raw_path(generation)] = "".join(f"{row[5]}\n" for row in rows).encode()
+        files[f"{self.index_path}.tmp"] = json.dumps(index).encode()
+
+        # The new generation is written in full under names no reader uses, then index.json is replaced in a single
+        # rename; until then readers, and an append that's interrupted, see the previous generation
+        os.makedirs(self.path, exist_ok=True)
+        for path, data in files.items():
+            with open(path, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+        self.index = index
+
+        # The previous generation, and anything left by an interrupted append
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if path != self.index_path and path not in files:
+                os.remove(path)
+        return len(new)
+
+
+class UpArchive:
+    """
+    Args:
+        path (str): the archive's directory
+    """
+
+    def __init__(self, path=DEFAULT_ARCHIVE_DIR):
+        self.path = path
+
+    def append(self, page):
+        """
+        Archives a page of Up transactions, from any accounts; safe to call with transactions already archived
+
+        Args:
+            page (list): the 'data' field of an Up transactions response
+
+        Returns:
+            int: number of transactions added
+        """
+        partitions = {}
+        for raw in page:
+            tx = UpTransaction.from_json(raw)
+            key = (tx.account_id, _partition_key(tx.created_at.timestamp()))
+            partitions.setdefault(key, []).append((raw, tx))
+
+        return sum(Partition(os.path.join(self.path, up_account_id, month)).append(transactions)
+                   for (up_account_id, month), transactions in partitions.items())
+
+    def account_ids(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, name)))
+
+    def query(self, since_date=None, until_date=None, up_account_ids=None):
+        """
+        Reads the archived transactions created in [since_date, until_date)
+
+        Args:
+            since_date (str | datetime): defaults to the start of the archive; UTC unless it has an offset
+            until_date (str | datetime): defaults to the end of the archive
+            up_account_ids (list): accounts to read; defaults to every archived account
+
+        Returns:
+            ArchiveColumns
+        """
+        since = _timestamp(since_date) if since_date is not None else None
+        until = _timestamp(until_date) if until_date is not None else None
+        first_month = _partition_key(since) if since is not None else None
+        last_month = _partition_key(until) if until is not None else None
+
+        result = ArchiveColumns()
+        category_codes = {None: 0}
+        for up_account_id in up_account_ids or self.account_ids():
+            account_path = os.path.join(self.path, up_account_id)
+            if not os.path.isdir(account_path):
+                continue
+            account_code = len(result.accounts)
+            result.accounts.append(up_account_id)
+
+            for month in sorted(os.listdir(account_path)):
+                if (first_month and month < first_month) or (last_month and month > last_month):
+                    continue
+                partition = Partition(os.path.join(account_path, month))
+                start, stop = partition.row_range(since, until)
+                if stop <= start:
+                    continue
+                columns = partition.read_columns(start, stop)
+
+                # Category indexes are per partition; map them onto the result's
+                remap = []
+                for category in partition.index["categories"]:
+                    if category not in category_codes:
+                        category_codes[category] = len(result.categories)
+                        result.categories.append(category)
+                    remap.append(category_codes[category])
+
+                result.created_at.extend(columns["created_at"])
+                result.date.extend(columns["date"])
+                result.amount_cents.extend(columns["amount_cents"])
+                if remap == list(range(len(remap))):
+                    result.category.extend(columns["category"])
+                else:
+                    result.category.extend(remap[code] for code in columns["category"])
+                result.account.extend([account_code] * (stop - start))
+
+        return result
+
+    def iter_raw(self, up_account_id, month):
+        """
+        Yields:
+            dict: the raw Up JSON of each transaction in a partition, in createdAt order
+        """
+        partition = Partition(os.path.join(self.path, up_account_id, month))
+        if partition.index["rows"]:
+            with open(partition.raw_path()) as file:
+                for line in file:
+                    yield json.loads(line)
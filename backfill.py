@@ -0,0 +1,166 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from models import UP_TIMEZONE, parse_page
+from sync_state import CursorTracker, to_utc_timestamp
+from transfers import plan_transfers
+from transform import iter_ynab_transactions
+from up_api import DEFAULT_MAX_CONCURRENCY, DEFAULT_PAGE_SIZE, iter_transaction_pages
+from ynab_api import DEFAULT_BATCH_SIZE, post_transactions_in_batches
+
+"""
+Sharded backfill of a long Up history
+Following links.next from the start date is one round trip per page, one after another, so a multi-year first
+sync takes (pages x latency). Instead the range is split into calendar months (in Up's Melbourne time), each fetched
+separately with filter[since]/filter[until] and several months in flight at once
+
+Months are uploaded strictly in order, oldest first, as soon as each one and everything before it has arrived, and
+a checkpoint is saved in the sync state after each; an interrupted backfill resumes at the first month that wasn't
+fully uploaded. At most max_workers months are fetched ahead of the one being uploaded, which bounds memory use
+"""
+
+
+def _as_datetime(value):
+    return datetime.fromisoformat(to_utc_timestamp(value).replace("Z", "+00:00"))
+
+
+def month_shards(since_date, until_date):
+    """
+    Splits a date range at the start of each calendar month, in Melbourne time
+
+    Args:
+        since_date (str | datetime)
+        until_date (str | datetime)
+
+    Returns:
+        list: (since, until) UTC timestamps, oldest first; each shard's until is the next one's since
+    """
+    since = _as_datetime(since_date)
+    until = _as_datetime(until_date)
+
+    boundaries = [since]
+    month = since.astimezone(UP_TIMEZONE).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while True:
+        year, month_number = divmod(month.month, 12)
+        month = month.replace(year=month.year + year, month=month_number + 1)
+        if month >= until:
+            break
+        boundaries.append(month)
+    boundaries.append(until)
+
+    return [(to_utc_timestamp(start), to_utc_timestamp(end)) for start, end in zip(boundaries, boundaries[1:])
+            if start < end]
+
+
+def fetch_shard(session, up_account_id, shard, page_size=DEFAULT_PAGE_SIZE, archive=None):
+    """
+    Args:
+        archive (UpArchive): if given, every page is archived too; each shard is one month, and so writes to its
+            own archive partition, whatever else is being fetched at the same time
+
+    Returns:
+        list: the shard's UpTransactions, oldest first
+    """
+    since, until = shard
+    up_transactions = []
+    for page in iter_transaction_pages(session, up_account_id, since, page_size, until_date=until):
+        if archive is not None:
+            archive.append(page)
+        up_transactions.extend(parse_page(page))
+    # Up sends newest first
+    up_transactions.reverse()
+    return up_transactions
+
+
+def iter_shards_in_order(session, up_account_id, shards, max_workers=DEFAULT_MAX_CONCURRENCY,
+                         page_size=DEFAULT_PAGE_SIZE, archive=None):
+    """
+    Fetches shards concurrently, yielding them in the order given as each one (and those before it) completes
+
+    Yields:
+        tuple: (shard, list of UpTransactions)
+
+    Raises:
+        IncompleteFetchError: from the first shard, in order, that couldn't be fetched
+    """
+    shards = iter(shards)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        pending = deque((shard, executor.submit(fetch_shard, session, up_account_id, shard, page_size, archive))
+                        for shard in islice(shards, max_workers))
+        while pending:
+            shard, future = pending.popleft()
+            next_shard = next(shards, None)
+            if next_shard is not None:
+                pending.append(
+                    (next_shard, executor.submit(fetch_shard, session, up_account_id, next_shard, page_size, archive)))
+            yield shard, future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def backfill_account(up_session, up_account_id, since_date, ynab_account_id, budget_id, ynab_session, sync_state,
+                     until_date=None, max_workers=DEFAULT_MAX_CONCURRENCY, batch_size=DEFAULT_BATCH_SIZE,
+                     account_map=None, transfer_payee_ids=None, rules=None, archive=None):
+    """
+    Backfills an Up account into YNAB a month at a time, resuming from the checkpoint of an earlier, interrupted
+    backfill from the same since_date
+
+    Args:
+        up_session (requests.Session): from up_api.create_session(), pooled for at least max_workers connections
+        up_account_id (str)
+        since_date (str | datetime): start of the history to backfill
+        ynab_account_id (str)
+        budget_id (str)
+        ynab_session (requests.Session): from ynab_api.create_session()
+        sync_state (SyncState): holds the checkpoint, and the index of what's already in YNAB
+        until_date (str | datetime): end of the history to backfill; defaults to now
+        max_workers (int): months fetched at the same time
+        batch_size (int): maximum number of transactions per YNAB request
+        account_map (AccountMap): optional Up -> YNAB account links, shared with the transform
+        transfer_payee_ids (dict): with an account_map, send transfers as YNAB transfers (see pipeline.py)
+        rules (RuleSet): optional payee and category rules, applied by the transform
+        archive (UpArchive): if given, every page fetched is archived too
+
+    Returns:
+        tuple: (upload results as from post_transactions_in_batches(), CursorTracker over everything fetched,
+            True if the whole range was uploaded)
+
+    Raises:
+        IncompleteFetchError: if a month couldn't be fetched; months before it are uploaded and checkpointed
+    """
+    until_date = until_date or datetime.now(timezone.utc)
+    checkpoint = sync_state.get_backfill_checkpoint(up_account_id, since_date)
+    if checkpoint is not None:
+        print(f"Resuming backfill from {checkpoint}")
+
+    shards = month_shards(checkpoint or since_date, until_date)
+    synced_up_account_ids = set(account_map.by_up_id) | {up_account_id} if account_map is not None else None
+    results = {"created": [], "duplicates": [], "skipped": [], "failed": [], "server_knowledge": None}
+    tracker = CursorTracker()
+
+    for shard, up_transactions in iter_shards_in_order(up_session, up_account_id, shards, max_workers,
+                                                       archive=archive):
+        print(f"Uploading {len(up_transactions)} transactions from {shard[0]} to {shard[1]}")
+        for tx in up_transactions:
+            tracker.observe(tx)
+
+        transfer_plan = None
+        if transfer_payee_ids is not None and account_map is not None:
+            transfer_plan = plan_transfers(up_transactions, account_map, transfer_payee_ids, synced_up_account_ids)
+        ynab_transactions = iter_ynab_transactions(up_transactions, ynab_account_id, account_map, transfer_plan,
+                                                   rules=rules)
+        shard_results = post_transactions_in_batches(ynab_transactions, budget_id, ynab_session, batch_size,
+                                                     sync_state)
+
+        for result in ("created", "duplicates", "skipped", "failed"):
+            results[result].extend(shard_results[result])
+        results["server_knowledge"] = shard_results["server_knowledge"] or results["server_knowledge"]
+
+        if shard_results["failed"]:
+            print(f"Backfill stopped at {shard[0]}; run it again to resume from there")
+            return results, tracker, False
+        sync_state.record_backfill_checkpoint(up_account_id, since_date, shard[1])
+
+    return results, tracker, True
@@ -0,0 +1,121 @@
+import argparse
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from mock_server import MockServer, MockState
+
+"""
+End-to-end sync benchmark against the local mock APIs in mock_server.py
+For each history size it measures:
+ - full backfill: streaming every Up transaction into an empty YNAB account
+ - incremental sync: starting from the backfill's cursor after a few new Up transactions arrive
+reporting transactions/sec, peak RSS of the syncing process and the requests made to each API
+
+Each sync runs in a fresh process, so peak RSS belongs to that sync alone
+
+Usage: python bench_sync.py [--sizes 100,10000,100000] [--latency 0.02] [--rate-limit-probability 0.01]
+"""
+
+UP_ACCOUNT_ID = "up-account-0"
+YNAB_ACCOUNT_ID = "ynab-up-account-0"
+
+
+def peak_rss_mb():
+    # VmHWM is the peak for this process image; ru_maxrss on Linux carries over the parent's peak through exec
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+
+    import resource
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_sync(up_url, ynab_url, budget_id, since_date, batch_size):
+    """
+    Runs one streaming sync in this process; called in a child process per scenario
+
+    Returns:
+        dict: created/duplicate counts, the new cursor, elapsed seconds and peak RSS in MB
+    """
+    os.environ["UP_API_URL"] = up_url
+    os.environ["YNAB_API_URL"] = ynab_url
+
+    # Imported here so the API base URLs above are picked up
+    from http_client import TokenBucket
+    from pipeline import stream_account_to_ynab
+    from up_api import create_session as create_up_session
+    from ynab_api import create_session as create_ynab_session
+
+    up_session = create_up_session("mock-up-token")
+    # The mock has no hourly budget to protect, so don't throttle the benchmark to YNAB's real limit
+    ynab_session = create_ynab_session("mock-ynab-token", limiter=TokenBucket(10 ** 9, 1))
+    for session in (up_session, ynab_session):
+        session.backoff_base = 0
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results, cursor = stream_account_to_ynab(
+            up_session, UP_ACCOUNT_ID, since_date, YNAB_ACCOUNT_ID, budget_id, ynab_session, batch_size)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "created": len(results["created"]),
+        "duplicates": len(results["duplicates"]),
+        "failed": len(results["failed"]),
+        "cursor": cursor,
+        "seconds": elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def report(name, size, result, request_counts):
+    synced = result["created"] + result["duplicates"]
+    rate = synced / result["seconds"] if result["seconds"] else float("inf")
+    requests_made = ", ".join(f"{endpoint}={count}" for endpoint, count in sorted(request_counts.items()))
+    print(f"{name:<12} {size:>9} {synced:>9} {result['seconds']:>8.2f} {rate:>10.0f} "
+          f"{result['peak_rss_mb']:>8.1f}  {requests_made}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark full and incremental syncs against mock APIs")
+    arg_parser.add_argument("--sizes", default="100,10000,100000",
+                            help="comma separated Up history sizes, eg. 100,10000,1000000")
+    arg_parser.add_argument("--incremental", type=int, default=50, help="new transactions for the incremental sync")
+    arg_parser.add_argument("--batch-size", type=int, default=500, help="transactions per YNAB POST")
+    arg_parser.add_argument("--latency", type=float, default=0, help="seconds added to each mock response")
+    arg_parser.add_argument("--rate-limit-probability", type=float, default=0, help="chance of a 429 per request")
+    args = arg_parser.parse_args()
+
+    print(f"{'scenario':<12} {'history':>9} {'synced':>9} {'seconds':>8} {'tx/sec':>10} {'rss MB':>8}  requests")
+
+    for size in (int(size) for size in args.sizes.split(",")):
+        state = MockState(size, 1, args.latency, args.rate_limit_probability)
+
+        with MockServer(state) as server, \
+                ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            sync_args = (server.up_url, server.ynab_url, state.budget_id)
+
+            backfill = executor.submit(run_sync, *sync_args, "2000-01-01T00:00:00Z", args.batch_size).result()
+            report("backfill", size, backfill, state.request_counts)
+
+        state.request_counts = {}
+        state.add_up_transactions(args.incremental)
+
+        with MockServer(state) as server, \
+                ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            sync_args = (server.up_url, server.ynab_url, state.budget_id)
+
+            incremental = executor.submit(run_sync, *sync_args, backfill["cursor"], args.batch_size).result()
+            report("incremental", size, incremental, state.request_counts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from dateutil import parser
+from models import UP_TIMEZONE, amount_in_cents
+from transform import transform_to_ynab_format
+
+"""
+Micro-benchmark of the Up -> YNAB transform hot path
+Builds a synthetic fixture of Up transactions and times the original conversion (dateutil parsing and
+int(float(value) * 1000)) against transform_to_ynab_format, reporting the per-transaction cost of each
+Both are checked against the exact amounts (valueInBaseUnits * 10, in integers); the speedup is only reported if
+transform_to_ynab_format gets every one right, since a faster transform that changes amounts isn't a speedup
+
+Usage: python bench_transform.py [--count 100000]
+"""
+
+
+def make_fixture(count, seed=0):
+    """
+    Args:
+        count (int): number of transactions to generate
+        seed (int): random seed, so runs are comparable
+
+    Returns:
+        list: Up transactions shaped like the 'data' field of an Up transactions response
+    """
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    transactions = []
+    for _ in range(count):
+        cents = -rng.randint(1, 50000)
+        created_at = (start + timedelta(seconds=rng.randint(0, 5 * 365 * 24 * 3600))).astimezone(UP_TIMEZONE)
+        transactions.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "attributes": {
+                "status": "SETTLED",
+                "rawText": "SQ *CAFE MELBOURNE",
+                "description": "Cafe",
+                "amount": {
+                    "currencyCode": "AUD",
+                    "value": f"{cents / 100:.2f}",
+                    "valueInBaseUnits": cents,
+                },
+                "createdAt": created_at.isoformat(),
+            },
+            "relationships": {
+                "account": {"data": {"type": "accounts", "id": "up-spending"}},
+                "transferAccount": {"data": None},
+                "category": {"data": None},
+            },
+        })
+    return transactions
+
+
+def legacy_transform(up_transactions, ynab_account_id):
+    # The conversion transform_to_ynab_format originally used, kept here for comparison
+    ynab_transactions = []
+    for tx in up_transactions:
+        if tx["attributes"]["status"] != "SETTLED":
+            continue
+        ynab_transactions.append({
+            "account_id": ynab_account_id,
+            "date": parser.parse(tx["attributes"]["createdAt"]).strftime("%Y-%m-%d"),
+            "amount": int(float(tx["attributes"]["amount"]["value"]) * 1000),
+            "payee_name": tx["attributes"]["description"],
+            "memo": f"Up Bank: {tx['attributes'].get('rawText', '')}",
+            "cleared": "cleared",
+            "approved": False,
+            "import_id": tx["id"][:36],
+        })
+    return ynab_transactions
+
+
+def time_it(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the Up -> YNAB transform")
+    arg_parser.add_argument("--count", type=int, default=100000, help="number of synthetic transactions")
+    args = arg_parser.parse_args()
+
+    fixture = make_fixture(args.count)
+    print(f"Transforming {len(fixture)} synthetic Up transactions")
+
+    legacy, legacy_seconds = time_it(legacy_transform, fixture, "ynab-account")
+    current, current_seconds = time_it(transform_to_ynab_format, fixture, "ynab-account")
+
+    exact = [tx["attributes"]["amount"]["valueInBaseUnits"] * 10 for tx in fixture]
+    legacy_wrong = sum(1 for tx, amount in zip(legacy, exact) if tx["amount"] != amount)
+    current_wrong = sum(1 for tx, amount in zip(current, exact) if tx.amount != amount)
+    wrong_dates = sum(1 for old, new in zip(legacy, current) if old["date"] != new.date.isoformat())
+    # The conversion used when valueInBaseUnits is missing, from the value string
+    fallback_wrong = sum(1 for tx in fixture if amount_in_cents({"value": tx["attributes"]["amount"]["value"]})
+                         != tx["attributes"]["amount"]["valueInBaseUnits"])
+
+    print(f"  legacy (dateutil + float): {legacy_seconds:.2f}s, {legacy_seconds / len(fixture) * 1e6:.1f} us/tx, "
+          f"{legacy_wrong} amounts wrong")
+    print(f"  current (fromisoformat + base units): {current_seconds:.2f}s, "
+          f"{current_seconds / len(fixture) * 1e6:.1f} us/tx, {current_wrong} amounts wrong")
+    print(f"  dates that differ: {wrong_dates}")
+    print(f"  amounts wrong when read from the value string: {fallback_wrong}")
+    if current_wrong or wrong_dates or fallback_wrong:
+        print("  no speedup reported: the current transform doesn't match the exact results")
+        exit(1)
+    print(f"  speedup: {legacy_seconds / current_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta, timezone
+
+"""
+pytest configuration: test_yaml_resource_access.py is an exploratory script that reads a private resources.yaml,
+so it isn't collected as a test
+Also holds the Up transaction JSON builder shared by the tests; import it with 'from conftest import ...'
+"""
+
+collect_ignore = ["test_yaml_resource_access.py"]
+
+CREATED_AT = datetime(2025, 3, 1, 2, 0, tzinfo=timezone.utc)
+
+
+def up_money(cents):
+    return {"currencyCode": "AUD", "value": f"{cents / 100:.2f}", "valueInBaseUnits": cents}
+
+
+def up_transaction(id, account_id="up-spending", cents=-1000, transfer_account_id=None, round_up_cents=None,
+                   category_id=None, status="SETTLED", days=0, seconds=0):
+    """
+    Builds an Up transaction as the Up API returns it, created days and seconds after CREATED_AT
+    """
+    return {
+        "id": id,
+        "attributes": {
+            "status": status,
+            "rawText": None,
+            "description": f"Transaction {id}",
+            "amount": up_money(cents),
+            "roundUp": {"amount": up_money(round_up_cents)} if round_up_cents else None,
+            "createdAt": (CREATED_AT + timedelta(days=days, seconds=seconds)).isoformat(),
+        },
+        "relationships": {
+            "account": {"data": {"type": "accounts", "id": account_id}},
+            "transferAccount": {"data": {"type": "accounts", "id": transfer_account_id} if transfer_account_id
+                                else None},
+            "category": {"data": {"type": "categories", "id": category_id} if category_id else None},
+        },
+    }
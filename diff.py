@@ -0,0 +1,104 @@
+from ynab_api import DEFAULT_BATCH_SIZE, chunked, patch_transactions_in_batches
+
+"""
+Bringing YNAB up to date with transactions Up has changed after they were imported, eg. a foreign currency amount
+settling differently, or a corrected description
+Freshly transformed transactions are compared, by import_id, with the locally cached copy of the YNAB account (see
+sync_state.py, kept current with delta requests), and only the fields that differ are sent, through YNAB's bulk
+PATCH endpoint in batches
+
+Only these fields are ever changed, and reconciled transactions are left alone entirely:
+ - amount and date are set to Up's, except the amount of a split (eg. a purchase with a Round Up), on either side
+ - cleared, only ever from uncleared to cleared
+ - payee_name, only where Up's name now differs from the one it was imported under (import_payee_name), so a
+   payee renamed in YNAB is left alone unless Up renames it too
+ - category_id, only where YNAB has none
+The memo is never changed, since YNAB doesn't record which memo was imported, and a person may have edited it
+"""
+
+# Fields compared directly with the cached YNAB transaction
+DIFF_FIELDS = ("amount", "date")
+
+
+def transaction_changes(tx, cached):
+    """
+    Args:
+        tx (YnabTransaction): freshly transformed transaction
+        cached (dict): the same transaction as held by YNAB
+
+    Returns:
+        dict: the fields to PATCH, with their new values; empty if nothing needs changing
+    """
+    if cached.get("cleared") == "reconciled":
+        return {}
+
+    fresh = tx.to_json()
+    changes = {field: fresh[field] for field in DIFF_FIELDS if field in fresh and fresh[field] != cached.get(field)}
+    # YNAB can't change an existing split's lines, and its amount must stay their total. Nor can it turn a
+    # transaction imported before Round Ups and cashback were split out into a split, so its amount is left as
+    # imported rather than taking the split's total
+    if cached.get("subtransactions") or tx.subtransactions:
+        changes.pop("amount", None)
+
+    if fresh.get("cleared") == "cleared" and cached.get("cleared") == "uncleared":
+        changes["cleared"] = "cleared"
+    # Transfers are identified by payee_id, which YNAB keeps; only imported payee names are compared
+    if tx.payee_id is None and tx.payee_name and cached.get("import_payee_name") not in (None, tx.payee_name):
+        changes["payee_name"] = tx.payee_name
+    if tx.category_id and cached.get("category_id") is None:
+        changes["category_id"] = tx.category_id
+
+    return changes
+
+
+def iter_transaction_updates(ynab_transactions, sync_state, lookup_size=DEFAULT_BATCH_SIZE):
+    """
+    Compares transactions with the cached YNAB copies, a chunk at a time
+
+    Args:
+        ynab_transactions (iterable): YnabTransactions
+        sync_state (SyncState): holds the cached YNAB transactions
+        lookup_size (int): transactions looked up per query
+
+    Yields:
+        dict: a PATCH for each transaction that differs: its YNAB 'id' plus the changed fields
+    """
+    for chunk in chunked(ynab_transactions, lookup_size):
+        import_ids_by_account = {}
+        for tx in chunk:
+            if tx.import_id:
+                import_ids_by_account.setdefault(tx.account_id, []).append(tx.import_id)
+
+        cached = {
+            account_id: sync_state.find_cached_transactions(account_id, import_ids)
+            for account_id, import_ids in import_ids_by_account.items()
+        }
+
+        for tx in chunk:
+            cached_tx = cached.get(tx.account_id, {}).get(tx.import_id)
+            if cached_tx is None:
+                continue
+            changes = transaction_changes(tx, cached_tx)
+            if changes:
+                yield {"id": cached_tx["id"], **changes}
+
+
+def patch_changed_transactions(ynab_transactions, budget_id, session, sync_state, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Sends the changes between freshly transformed transactions and their cached YNAB copies, batch_size at a time
+    Transactions YNAB doesn't have yet are ignored; they're for post_transactions_in_batches()
+
+    Args:
+        ynab_transactions (iterable): YnabTransactions, eg. from iter_ynab_transactions()
+        budget_id (str)
+        session (requests.Session): from ynab_api.create_session()
+        sync_state (SyncState): holds the cached YNAB transactions; updated with the PATCHed ones
+        batch_size (int): maximum number of transactions per request
+
+    Returns:
+        dict: as from patch_transactions_in_batches()
+    """
+    results = patch_transactions_in_batches(
+        iter_transaction_updates(ynab_transactions, sync_state), budget_id, session, batch_size)
+    sync_state.update_cached_transactions(results["updated"])
+    return results
@@ -0,0 +1,231 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+from metrics import METRICS
+from replay_cache import OfflineCacheMiss
+
+"""
+A shared HTTP layer for both the Up and YNAB APIs
+ - transient failures (connection errors, timeouts, 429 and 5xx responses) are retried with exponential backoff
+   and full jitter, waiting for Retry-After instead whenever the server sends one. A request that isn't idempotent
+   (eg. POST) may already have been acted on, so it's only retried after a 429 or a failure to connect
+ - an optional token bucket spaces requests out to stay inside a rate limit; YNAB allows 200 requests per hour
+ - YNAB's X-Rate-Limit header ('used/limit') is used to keep the bucket in step with what YNAB has counted
+Retries repeat only the failing request, so a transient 502 on page 40 doesn't throw away pages 1-39
+GET responses can optionally be recorded to a ReplayCache (see replay_cache.py), which answers every request in
+offline mode; online, it's only replayed when a request still fails after retrying
+Every attempt's latency, status and size is recorded in metrics.METRICS, labelled with the session's name; a
+request's metric_labels (eg. the Up account a page belongs to) are added to its bytes and retries
+"""
+
+YNAB_REQUESTS_PER_HOUR = 200
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Repeating these has the same effect as making them once, so any transient failure can be retried
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 1
+DEFAULT_BACKOFF_CAP = 60
+DEFAULT_TIMEOUT = 30
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket; acquire() blocks until a request may be made
+
+    Args:
+        capacity (int): maximum burst of requests
+        period (float): seconds over which a full bucket's worth of tokens is refilled
+    """
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def limit_remaining(self, remaining):
+        """
+        Never allows more requests than the server says are left in the current window
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, max(remaining, 0))
+
+
+def ynab_rate_limiter():
+    return TokenBucket(YNAB_REQUESTS_PER_HOUR, 3600)
+
+
+def retry_after_seconds(response):
+    """
+    Args:
+        response (requests.Response)
+
+    Returns:
+        float: seconds to wait according to the Retry-After header (seconds or HTTP-date), or None if absent
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+def backoff_delay(attempt, base=DEFAULT_BACKOFF_BASE, cap=DEFAULT_BACKOFF_CAP):
+    # Full jitter: a random delay up to the exponential backoff, so concurrent workers don't retry in lockstep
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def request_not_sent(error):
+    """
+    Args:
+        error (requests.exceptions.RequestException): raised by an attempt
+
+    Returns:
+        bool: whether the attempt failed to connect, so the server can't have seen the request
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, ConnectTimeoutError)
+
+
+class RetryingSession(requests.Session):
+    """
+    A requests.Session whose requests are rate limited and retried on transient failures
+    A response that is still failing after max_retries is returned as-is, so raise_for_status() behaves as usual
+
+    Args:
+        limiter (TokenBucket): optional rate limiter shared by every request made through this session
+        max_retries (int): retries after the first attempt
+        backoff_base (float): seconds; the backoff ceiling doubles with each retry
+        backoff_cap (float): seconds; upper limit on any single backoff
+        timeout (float): default timeout in seconds for requests that don't set one
+        cache (ReplayCache): optional cache of GET responses, used online when a request fails; in offline mode
+            nothing reaches the network
+        name (str): the API this session talks to, as labelled in metrics
+    """
+
+    def __init__(self, limiter=None, max_retries=DEFAULT_MAX_RETRIES, backoff_base=DEFAULT_BACKOFF_BASE,
+                 backoff_cap=DEFAULT_BACKOFF_CAP, timeout=DEFAULT_TIMEOUT, cache=None, name="http"):
+        super().__init__()
+        self.name = name
+        self.limiter = limiter
+        self.cache = cache
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+
+    def request(self, method, url, *args, metric_labels=None, **kwargs):
+        cacheable = self.cache is not None and method.upper() == "GET"
+        if self.cache is not None and self.cache.offline:
+            cached = self.cache.get(method, url, kwargs.get("params")) if cacheable else None
+            if cached is None:
+                raise OfflineCacheMiss(f"Offline: no cached response for {method} {url}")
+            return cached
+
+        # Online, the cache only stands in for a request that still fails after retrying, so a repeated run never
+        # replays stale accounts or pages
+        try:
+            response = self._request_with_retries(method, url, *args, metric_labels=metric_labels, **kwargs)
+        except requests.exceptions.RequestException:
+            cached = self.cache.get(method, url, kwargs.get("params")) if cacheable else None
+            if cached is None:
+                raise
+            print(f"{method} {url} failed; using the cached response")
+            return cached
+
+        if cacheable:
+            if response.status_code in RETRY_STATUSES:
+                cached = self.cache.get(method, url, kwargs.get("params"))
+                if cached is not None:
+                    print(f"{method} {url} returned {response.status_code}; using the cached response")
+                    return cached
+            self.cache.put(method, url, response, kwargs.get("params"))
+        return response
+
+    def _request_with_retries(self, method, url, *args, metric_labels=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        metric_labels = metric_labels or {}
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_statuses = RETRY_STATUSES if idempotent else {429}
+
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire()
+
+            started = time.perf_counter()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                METRICS.inc("http_requests_total", api=self.name, method=method.upper(), status=0)
+                if attempt == self.max_retries or not (idempotent or request_not_sent(e)):
+                    raise
+                METRICS.inc("http_retries_total", api=self.name, **metric_labels)
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+                print(f"{method} {url} failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            METRICS.observe("http_request_seconds", time.perf_counter() - started, api=self.name)
+            METRICS.inc("http_requests_total", api=self.name, method=method.upper(), status=response.status_code)
+            METRICS.inc("http_response_bytes_total", len(response.content), api=self.name, **metric_labels)
+            self._observe_rate_limit(response)
+
+            if response.status_code not in retry_statuses or attempt == self.max_retries:
+                return response
+
+            METRICS.inc("http_retries_total", api=self.name, **metric_labels)
+
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+            print(f"{method} {url} returned {response.status_code}; retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _observe_rate_limit(self, response):
+        # YNAB reports usage of the current window as eg. 'X-Rate-Limit: 36/200'
+        header = response.headers.get("X-Rate-Limit")
+        if not header:
+            return
+
+        try:
+            used, limit = (int(part) for part in header.split("/"))
+        except ValueError:
+            return
+        METRICS.set("ynab_rate_limit_remaining", limit - used)
+        if self.limiter is not None:
+            self.limiter.limit_remaining(limit - used)
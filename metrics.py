@@ -0,0 +1,210 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Counters, gauges and latency histograms for each stage of a sync, so a slow sync can be pinned on Up pagination,
+YNAB throttling or the transform
+ - http: requests, latency, bytes received, retries and 429s per API (recorded by RetryingSession)
+ - fetch: Up pages and transactions fetched
+ - transform: transactions transformed and the time spent doing it
+ - upload: YNAB results (created, duplicate, skipped, failed) and the remaining X-Rate-Limit headroom
+ - patch: changed transactions updated in YNAB by the update command (see diff.py)
+ - sync: time per account sync and when each account last synced
+
+Everything is recorded into the module-level METRICS registry. It can be rendered in the Prometheus text format
+(written to a file for node_exporter's textfile collector, or served over HTTP in daemon mode), and log_event()
+writes one-line JSON summaries of each sync to the configured log
+"""
+
+# Seconds; suits everything from a local mock (milliseconds) to a throttled YNAB request (tens of seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PREFIX = "up_to_ynab_"
+
+HELP = {
+    "http_requests_total": ("counter", "HTTP requests made, by API, method and status (0 for connection errors)"),
+    "http_request_seconds": ("histogram", "Latency of each HTTP request attempt, by API"),
+    "http_response_bytes_total": ("counter", "Response body bytes received, by API (and Up account, for pages)"),
+    "http_retries_total": ("counter", "Requests retried after a transient failure, by API (and Up account, for pages)"),
+    "ynab_rate_limit_remaining": ("gauge", "Requests left in YNAB's current rate limit window (X-Rate-Limit)"),
+    "up_pages_total": ("counter", "Pages of Up transactions fetched, by Up account"),
+    "up_transactions_total": ("counter", "Up transactions fetched, by Up account"),
+    "transform_transactions_total": ("counter", "Up transactions parsed and transformed"),
+    "transform_seconds_total": ("counter", "Time spent parsing and transforming Up transactions"),
+    "upload_transactions_total": ("counter", "Transactions by YNAB upload result"),
+    "patch_transactions_total": ("counter", "Changed transactions PATCHed in YNAB, by result"),
+    "sync_seconds": ("histogram", "Time taken by each account sync"),
+    "last_sync_timestamp_seconds": ("gauge", "When each account last synced successfully"),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metrics:
+    """
+    A thread-safe registry of counters, gauges and histograms, each identified by a name and a set of labels
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.log_file = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0}
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+                    break
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    def get(self, name, **labels):
+        """
+        Returns:
+            float: a counter or gauge's current value (0 if never recorded)
+        """
+        key = (name, _label_key(labels))
+        with self.lock:
+            return self.counters.get(key, self.gauges.get(key, 0))
+
+    def total(self, name, **labels):
+        # A counter summed over all its labels, or over only the series carrying every one of the given labels
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(value for (counter, key), value in self.counters.items()
+                       if counter == name and wanted <= set(key))
+
+    def to_prometheus(self):
+        """
+        Returns:
+            str: every metric in the Prometheus text exposition format
+        """
+        with self.lock:
+            series = {}
+            for (name, labels), value in sorted(list(self.counters.items()) + list(self.gauges.items())):
+                series.setdefault(name, []).append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                lines = series.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram['count']}")
+
+        output = []
+        for name in sorted(series):
+            metric_type, description = HELP.get(name, ("untyped", name))
+            output.append(f"# HELP {PREFIX}{name} {description}")
+            output.append(f"# TYPE {PREFIX}{name} {metric_type}")
+            output.extend(series[name])
+        return "\n".join(output) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Writes the metrics to a file, replacing it atomically so a collector never reads a half-written file
+        """
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as file:
+            file.write(self.to_prometheus())
+        os.replace(temporary_path, path)
+
+    def log_event(self, event, **fields):
+        """
+        Writes a one-line JSON record to the log file, if one is set (see configure_log())
+        """
+        if self.log_file is None:
+            return
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "event": event, **fields}
+        with self.lock:
+            self.log_file.write(json.dumps(record, default=str) + "\n")
+            self.log_file.flush()
+
+    def configure_log(self, path):
+        """
+        Args:
+            path (str): file to append JSON log lines to, or '-' for standard output
+        """
+        self.log_file = sys.stdout if path == "-" else open(path, "a")
+
+
+METRICS = Metrics()
+
+
+class MetricsServer:
+    """
+    Serves the registry's Prometheus text at /metrics on a background thread
+
+    Args:
+        metrics (Metrics)
+        host (str)
+        port (int): 0 picks a free port
+    """
+
+    def __init__(self, metrics=METRICS, host="127.0.0.1", port=0):
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
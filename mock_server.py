@@ -0,0 +1,565 @@
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+import requests
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+from zoneinfo import ZoneInfo
+
+"""
+A local stand-in for the Up and YNAB APIs, so syncs can be run and measured without live credentials
+
+Up:   GET /up/api/v1/accounts
+      GET /up/api/v1/accounts/{id}/transactions    (filter[since], filter[until], page[size], links.next)
+      GET /up/api/v1/transactions/{id}    (transactions raised through MockWebhookSource only)
+YNAB: GET /ynab/v1/budgets/{budget}/accounts[/{id}]
+      GET /ynab/v1/budgets/{budget}/accounts/{id}/transactions    (last_knowledge_of_server deltas)
+      POST /ynab/v1/budgets/{budget}/transactions    (bulk create, import_id duplicates reported)
+      PATCH /ynab/v1/budgets/{budget}/transactions    (bulk update by id or import_id)
+      DELETE /ynab/v1/budgets/{budget}/transactions/{id}
+
+Up histories are synthetic and generated on demand from each transaction's position, so an account with a million
+transactions costs no more memory than one with a hundred. Latency and 429 responses can be injected.
+MockWebhookSource simulates Up's webhooks: it creates, settles and deletes transactions and sends the signed events.
+
+Point the sync at it with UP_API_URL=http://host:port/up/api/v1 and YNAB_API_URL=http://host:port/ynab/v1
+Usage: python mock_server.py [--port 8765] [--transactions 10000] [--accounts 2] [--latency 0.05]
+"""
+
+MOCK_TIMEZONE = ZoneInfo("Australia/Melbourne")
+MOCK_NAMESPACE = uuid.UUID("6f1c2f9e-5a8e-4f43-9a7d-1b9d3c3c8a10")
+
+# Oldest synthetic transaction, and the gap between consecutive ones
+HISTORY_START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+HISTORY_INTERVAL = timedelta(minutes=37)
+
+MAX_UP_PAGE_SIZE = 100
+
+
+class MockUpAccount:
+    """
+    A synthetic Up account holding `count` transactions, numbered from 0 (oldest)
+    """
+
+    def __init__(self, account_id, display_name, account_type, count):
+        self.id = account_id
+        self.display_name = display_name
+        self.account_type = account_type
+        self.count = count
+
+    def amount_cents(self, index):
+        return -((index * 7919) % 50000 + 1)
+
+    def created_at(self, index):
+        return HISTORY_START + index * HISTORY_INTERVAL
+
+    def transaction(self, index):
+        cents = self.amount_cents(index)
+        return {
+            "type": "transactions",
+            "id": str(uuid.uuid5(MOCK_NAMESPACE, f"{self.id}/{index}")),
+            "attributes": {
+                "status": "SETTLED",
+                "rawText": f"MOCK MERCHANT {index % 97}",
+                "description": f"Merchant {index % 97}",
+                "message": None,
+                "roundUp": None,
+                "cashback": None,
+                "amount": {"currencyCode": "AUD", "value": f"{cents / 100:.2f}", "valueInBaseUnits": cents},
+                "settledAt": self.created_at(index).astimezone(MOCK_TIMEZONE).isoformat(),
+                "createdAt": self.created_at(index).astimezone(MOCK_TIMEZONE).isoformat(),
+            },
+            "relationships": {
+                "account": {"data": {"type": "accounts", "id": self.id}},
+                "transferAccount": {"data": None},
+                "category": {"data": None},
+                "parentCategory": {"data": None},
+                "tags": {"data": []},
+            },
+        }
+
+    def first_index_since(self, since):
+        # Smallest index created at or after `since`
+        if since <= HISTORY_START:
+            return 0
+        steps = (since - HISTORY_START) / HISTORY_INTERVAL
+        return min(int(steps) + (steps != int(steps)), self.count)
+
+    def balance_cents(self):
+        return sum(self.amount_cents(index) for index in range(self.count))
+
+    def to_json(self):
+        cents = self.balance_cents()
+        return {
+            "type": "accounts",
+            "id": self.id,
+            "attributes": {
+                "displayName": self.display_name,
+                "accountType": self.account_type,
+                "balance": {"currencyCode": "AUD", "value": f"{cents / 100:.2f}", "valueInBaseUnits": cents},
+            },
+        }
+
+
+class MockState:
+    """
+    Everything the mock server knows, plus request counters
+
+    Args:
+        transactions (int): synthetic history size for each Up account
+        accounts (int): number of Up accounts; the first is TRANSACTIONAL, the rest SAVER
+        latency (float): seconds added to every response
+        rate_limit_probability (float): chance of answering any request with a 429
+        budget_id (str): the single YNAB budget served
+    """
+
+    def __init__(self, transactions=1000, accounts=1, latency=0, rate_limit_probability=0, budget_id="mock-budget",
+                 seed=0):
+        self.latency = latency
+        self.rate_limit_probability = rate_limit_probability
+        self.budget_id = budget_id
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.up_accounts = {}
+        for number in range(accounts):
+            account_type = "TRANSACTIONAL" if number == 0 else "SAVER"
+            display_name = "Spending" if number == 0 else f"Saver {number}"
+            account = MockUpAccount(f"up-account-{number}", display_name, account_type, transactions)
+            self.up_accounts[account.id] = account
+
+        # One YNAB account per Up account
+        self.ynab_accounts = {
+            f"ynab-{up_id}": {
+                "id": f"ynab-{up_id}",
+                "name": account.display_name,
+                "type": "checking",
+                "on_budget": True,
+                "closed": False,
+                "balance": 0,
+                "cleared_balance": 0,
+                "uncleared_balance": 0,
+                "transfer_payee_id": f"payee-transfer-{up_id}",
+                "deleted": False,
+            }
+            for up_id, account in self.up_accounts.items()
+        }
+
+        # A transfer payee per account, and one category group
+        self.ynab_payees = [
+            {"id": account["transfer_payee_id"], "name": f"Transfer : {account['name']}",
+             "transfer_account_id": account["id"], "deleted": False}
+            for account in self.ynab_accounts.values()
+        ]
+        self.ynab_category_groups = [
+            {"id": "group-everyday", "name": "Everyday", "hidden": False, "deleted": False,
+             "categories": [{"id": f"category-{name.lower()}", "category_group_id": "group-everyday", "name": name,
+                             "hidden": False, "deleted": False} for name in ("Groceries", "Transport", "Eating Out")]},
+        ]
+
+        # YNAB transactions by id, and the knowledge at which each last changed
+        self.ynab_transactions = {}
+        self.ynab_import_ids = {}
+        self.ynab_changes = []
+        self.server_knowledge = 0
+
+        # Up transactions raised by MockWebhookSource, by id
+        self.up_transactions = {}
+
+        self.request_counts = {}
+
+    def count_request(self, name):
+        with self.lock:
+            self.request_counts[name] = self.request_counts.get(name, 0) + 1
+
+    def add_up_transactions(self, count, up_account_id=None):
+        """
+        Appends `count` new transactions to an Up account (the first by default), eg. between incremental syncs
+        """
+        account = self.up_accounts[up_account_id] if up_account_id else next(iter(self.up_accounts.values()))
+        with self.lock:
+            account.count += count
+
+    def create_ynab_transactions(self, transactions):
+        created = []
+        duplicates = []
+        with self.lock:
+            self.server_knowledge += 1
+            for tx in transactions:
+                import_id = tx.get("import_id")
+                if import_id and import_id in self.ynab_import_ids:
+                    duplicates.append(import_id)
+                    continue
+
+                stored = dict(tx, id=str(uuid.uuid4()), deleted=False)
+                stored.setdefault("cleared", "uncleared")
+                self.ynab_transactions[stored["id"]] = stored
+                if import_id:
+                    self.ynab_import_ids[import_id] = stored["id"]
+                self.ynab_changes.append((self.server_knowledge, stored["id"]))
+
+                account = self.ynab_accounts.get(stored["account_id"])
+                if account is not None:
+                    account["balance"] += stored["amount"]
+                created.append(stored)
+        return created, duplicates, self.server_knowledge
+
+    def update_ynab_transactions(self, updates):
+        updated = []
+        with self.lock:
+            self.server_knowledge += 1
+            for update in updates:
+                tx_id = update.get("id") or self.ynab_import_ids.get(update.get("import_id"))
+                stored = self.ynab_transactions.get(tx_id)
+                if stored is None or stored["deleted"]:
+                    continue
+
+                account = self.ynab_accounts.get(stored["account_id"])
+                if account is not None:
+                    account["balance"] += update.get("amount", stored["amount"]) - stored["amount"]
+                stored.update((key, value) for key, value in update.items() if key not in ("id", "import_id"))
+                self.ynab_changes.append((self.server_knowledge, tx_id))
+                updated.append(stored)
+        return updated, self.server_knowledge
+
+    def delete_ynab_transaction(self, tx_id):
+        with self.lock:
+            stored = self.ynab_transactions.get(tx_id)
+            if stored is None or stored["deleted"]:
+                return None
+
+            self.server_knowledge += 1
+            stored["deleted"] = True
+            account = self.ynab_accounts.get(stored["account_id"])
+            if account is not None:
+                account["balance"] -= stored["amount"]
+            self.ynab_changes.append((self.server_knowledge, tx_id))
+            return stored
+
+    def changed_ynab_transactions(self, account_id, last_knowledge):
+        with self.lock:
+            if last_knowledge is None:
+                ids = self.ynab_transactions.keys()
+            else:
+                ids = dict.fromkeys(tx_id for knowledge, tx_id in self.ynab_changes if knowledge > last_knowledge)
+            transactions = [self.ynab_transactions[tx_id] for tx_id in ids]
+            return [tx for tx in transactions if tx["account_id"] == account_id], self.server_knowledge
+
+
+def make_handler(state):
+    """
+    Builds a request handler class bound to a MockState
+    """
+
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # Headers and body go out as separate writes; without this, delayed ACKs add ~40ms to every response
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body, headers=None):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def handle_request(self, method):
+            if state.latency:
+                time.sleep(state.latency)
+
+            parts = urlsplit(self.path)
+            query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+
+            for route_method, pattern, name, handler in ROUTES:
+                match = re.fullmatch(pattern, parts.path)
+                if route_method == method and match:
+                    break
+            else:
+                state.count_request("not_found")
+                self.send_json(404, {"errors": [{"detail": f"No route for {method} {parts.path}"}]})
+                return
+
+            state.count_request(name)
+            if state.rate_limit_probability and state.random.random() < state.rate_limit_probability:
+                state.count_request("rate_limited")
+                self.send_json(429, {"errors": [{"detail": "Too many requests"}]}, {"Retry-After": "0"})
+                return
+
+            status, body = handler(self, query, *match.groups())
+            self.send_json(status, body)
+
+        def do_GET(self):
+            self.handle_request("GET")
+
+        def do_POST(self):
+            self.handle_request("POST")
+
+        def do_PATCH(self):
+            self.handle_request("PATCH")
+
+        def do_DELETE(self):
+            self.handle_request("DELETE")
+
+        def base_url(self):
+            return f"http://{self.headers.get('Host')}"
+
+        # Up
+        def up_accounts(self, query):
+            return 200, {"data": [account.to_json() for account in state.up_accounts.values()],
+                         "links": {"prev": None, "next": None}}
+
+        def up_account_transactions(self, query, account_id):
+            account = state.up_accounts.get(account_id)
+            if account is None:
+                return 404, {"errors": [{"detail": "Account not found"}]}
+
+            page_size = min(int(query.get("page[size]", 10)), MAX_UP_PAGE_SIZE)
+            since = query.get("filter[since]")
+            lowest = account.first_index_since(datetime.fromisoformat(since)) if since else 0
+            until = query.get("filter[until]")
+            highest = account.first_index_since(datetime.fromisoformat(until)) if until else account.count
+            # Newest first; page[after] is the index the previous page stopped before
+            start = min(int(query.get("page[after]", highest)), highest)
+            indexes = range(start - 1, max(lowest, start - page_size) - 1, -1)
+
+            next_url = None
+            if indexes and indexes[-1] > lowest:
+                next_query = dict(query, **{"page[after]": indexes[-1]})
+                next_url = f"{self.base_url()}{urlsplit(self.path).path}?{urlencode(next_query)}"
+
+            return 200, {"data": [account.transaction(index) for index in indexes],
+                         "links": {"prev": None, "next": next_url}}
+
+        def up_transaction(self, query, transaction_id):
+            tx = state.up_transactions.get(transaction_id)
+            if tx is None:
+                return 404, {"errors": [{"detail": "Transaction not found"}]}
+            return 200, {"data": tx}
+
+        # YNAB
+        def ynab_accounts(self, query, budget_id):
+            return 200, {"data": {"accounts": list(state.ynab_accounts.values()),
+                                  "server_knowledge": state.server_knowledge}}
+
+        # Metadata never changes in the mock, so a delta is always empty
+        def ynab_payees(self, query, budget_id):
+            payees = [] if query.get("last_knowledge_of_server") is not None else state.ynab_payees
+            return 200, {"data": {"payees": payees, "server_knowledge": state.server_knowledge}}
+
+        def ynab_categories(self, query, budget_id):
+            groups = [] if query.get("last_knowledge_of_server") is not None else state.ynab_category_groups
+            return 200, {"data": {"category_groups": groups, "server_knowledge": state.server_knowledge}}
+
+        def ynab_account(self, query, budget_id, account_id):
+            account = state.ynab_accounts.get(account_id)
+            if account is None:
+                return 404, {"error": {"id": "404.2", "name": "resource_not_found", "detail": "Account not found"}}
+            return 200, {"data": {"account": account}}
+
+        def ynab_account_transactions(self, query, budget_id, account_id):
+            last_knowledge = query.get("last_knowledge_of_server")
+            transactions, knowledge = state.changed_ynab_transactions(
+                account_id, int(last_knowledge) if last_knowledge is not None else None)
+            return 200, {"data": {"transactions": transactions, "server_knowledge": knowledge}}
+
+        def ynab_create_transactions(self, query, budget_id):
+            created, duplicates, knowledge = state.create_ynab_transactions(self.read_json()["transactions"])
+            return 201, {"data": {"transaction_ids": [tx["id"] for tx in created], "transactions": created,
+                                  "duplicate_import_ids": duplicates, "server_knowledge": knowledge}}
+
+        def ynab_update_transactions(self, query, budget_id):
+            updated, knowledge = state.update_ynab_transactions(self.read_json()["transactions"])
+            return 200, {"data": {"transaction_ids": [tx["id"] for tx in updated], "transactions": updated,
+                                  "server_knowledge": knowledge}}
+
+        def ynab_delete_transaction(self, query, budget_id, transaction_id):
+            deleted = state.delete_ynab_transaction(transaction_id)
+            if deleted is None:
+                return 404, {"error": {"id": "404.2", "name": "resource_not_found", "detail": "Not found"}}
+            return 200, {"data": {"transaction": deleted, "server_knowledge": state.server_knowledge}}
+
+    ROUTES = [
+        ("GET", r"/up/api/v1/accounts", "up_accounts", MockHandler.up_accounts),
+        ("GET", r"/up/api/v1/accounts/([^/]+)/transactions", "up_transactions", MockHandler.up_account_transactions),
+        ("GET", r"/up/api/v1/transactions/([^/]+)", "up_transaction", MockHandler.up_transaction),
+        ("GET", r"/ynab/v1/budgets/([^/]+)/accounts", "ynab_accounts", MockHandler.ynab_accounts),
+        ("GET", r"/ynab/v1/budgets/([^/]+)/accounts/([^/]+)", "ynab_account", MockHandler.ynab_account),
+        ("GET", r"/ynab/v1/budgets/([^/]+)/payees", "ynab_payees", MockHandler.ynab_payees),
+        ("GET", r"/ynab/v1/budgets/([^/]+)/categories", "ynab_categories", MockHandler.ynab_categories),
+        ("GET", r"/ynab/v1/budgets/([^/]+)/accounts/([^/]+)/transactions", "ynab_transactions",
+         MockHandler.ynab_account_transactions),
+        ("POST", r"/ynab/v1/budgets/([^/]+)/transactions", "ynab_post_transactions",
+         MockHandler.ynab_create_transactions),
+        ("PATCH", r"/ynab/v1/budgets/([^/]+)/transactions", "ynab_patch_transactions",
+         MockHandler.ynab_update_transactions),
+        ("DELETE", r"/ynab/v1/budgets/([^/]+)/transactions/([^/]+)", "ynab_delete_transaction",
+         MockHandler.ynab_delete_transaction),
+    ]
+
+    return MockHandler
+
+
+class MockServer:
+    """
+    Runs the mock APIs on a background thread
+
+    Args:
+        state (MockState)
+        host (str)
+        port (int): 0 picks a free port
+    """
+
+    def __init__(self, state, host="127.0.0.1", port=0):
+        self.state = state
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(state))
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def up_url(self):
+        return f"{self.base_url}/up/api/v1"
+
+    @property
+    def ynab_url(self):
+        return f"{self.base_url}/ynab/v1"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class MockWebhookSource:
+    """
+    Plays the part of Up's webhooks: changes a transaction in the mock state, then POSTs the signed event to a
+    receiver (eg. webhooks.WebhookServer), which can fetch the transaction back from the mock Up API
+
+    Args:
+        state (MockState)
+        url (str): where events are sent
+        secret_key (str): signs each event, as Up does with the webhook's secretKey
+    """
+
+    def __init__(self, state, url, secret_key):
+        self.state = state
+        self.url = url
+        self.secret_key = secret_key
+
+    def send(self, event_type, transaction_id):
+        body = json.dumps({"data": {
+            "type": "webhook-events",
+            "id": str(uuid.uuid4()),
+            "attributes": {"eventType": event_type, "createdAt": datetime.now(MOCK_TIMEZONE).isoformat()},
+            "relationships": {"transaction": {"data": {"type": "transactions", "id": transaction_id}}},
+        }}).encode()
+        signature = hmac.new(self.secret_key.encode(), body, hashlib.sha256).hexdigest()
+        response = requests.post(self.url, data=body, headers={
+            "Content-Type": "application/json", "X-Up-Authenticity-Signature": signature})
+        return response.status_code
+
+    def create(self, up_account_id, cents, description="Mock Merchant", status="HELD", created_at=None):
+        """
+        Raises a new transaction and sends TRANSACTION_CREATED
+
+        Returns:
+            str: the new transaction's id
+        """
+        created_at = (created_at or datetime.now(timezone.utc)).astimezone(MOCK_TIMEZONE)
+        tx_id = str(uuid.uuid4())
+        self.state.up_transactions[tx_id] = {
+            "type": "transactions",
+            "id": tx_id,
+            "attributes": {
+                "status": status,
+                "rawText": description.upper(),
+                "description": description,
+                "amount": {"currencyCode": "AUD", "value": f"{cents / 100:.2f}", "valueInBaseUnits": cents},
+                "settledAt": created_at.isoformat() if status == "SETTLED" else None,
+                "createdAt": created_at.isoformat(),
+            },
+            "relationships": {
+                "account": {"data": {"type": "accounts", "id": up_account_id}},
+                "transferAccount": {"data": None},
+                "category": {"data": None},
+            },
+        }
+        self.send("TRANSACTION_CREATED", tx_id)
+        return tx_id
+
+    def settle(self, tx_id, cents=None):
+        """
+        Settles a held transaction, optionally at a different amount (eg. a foreign currency conversion), and sends
+        TRANSACTION_SETTLED
+        """
+        attributes = self.state.up_transactions[tx_id]["attributes"]
+        attributes["status"] = "SETTLED"
+        attributes["settledAt"] = datetime.now(MOCK_TIMEZONE).isoformat()
+        if cents is not None:
+            attributes["amount"] = {"currencyCode": "AUD", "value": f"{cents / 100:.2f}", "valueInBaseUnits": cents}
+        return self.send("TRANSACTION_SETTLED", tx_id)
+
+    def delete(self, tx_id):
+        """
+        Removes a transaction (as Up does with some held transactions) and sends TRANSACTION_DELETED
+        """
+        del self.state.up_transactions[tx_id]
+        return self.send("TRANSACTION_DELETED", tx_id)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Serve mock Up and YNAB APIs")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--transactions", type=int, default=1000, help="history size per Up account")
+    arg_parser.add_argument("--accounts", type=int, default=1, help="number of Up accounts")
+    arg_parser.add_argument("--latency", type=float, default=0, help="seconds added to each response")
+    arg_parser.add_argument("--rate-limit-probability", type=float, default=0, help="chance of a 429 per request")
+    args = arg_parser.parse_args()
+
+    state = MockState(args.transactions, args.accounts, args.latency, args.rate_limit_probability)
+    server = MockServer(state, args.host, args.port)
+    print(f"Up API:   {server.up_url}")
+    print(f"YNAB API: {server.ynab_url} (budget id {state.budget_id})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import sys
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+"""
+Compact representations of Up and YNAB transactions
+Up's JSON nests every value several levels deep; each transaction is parsed once into a slotted dataclass holding
+only the fields the sync uses, with amounts as integers and account ids interned (there are only a handful of
+distinct accounts, but every transaction refers to one or two of them)
+
+Conversions are exact and cheap: amounts come from Up's integer valueInBaseUnits (never via float, where
+int(2.01 * 1000) is 2009), and createdAt is read with datetime.fromisoformat rather than dateutil's general parser
+"""
+
+# Up reports times in Melbourne time; YNAB dates are the local calendar date of the transaction
+UP_TIMEZONE = ZoneInfo("Australia/Melbourne")
+
+
+def amount_in_cents(amount):
+    """
+    Args:
+        amount (dict): an Up money object, eg. {"value": "-2.01", "valueInBaseUnits": -201, "currencyCode": "AUD"}
+
+    Returns:
+        int: the amount in cents, exactly
+    """
+    if "valueInBaseUnits" in amount:
+        return amount["valueInBaseUnits"]
+    return int(Decimal(amount["value"]) * 100)
+
+
+def cents_to_milliunits(cents):
+    # YNAB uses milliunits (1/1000 of currency unit)
+    return cents * 10
+
+
+def local_date(timestamp):
+    """
+    Args:
+        timestamp (datetime): timezone-aware time, in any offset (including UTC)
+
+    Returns:
+        date: the calendar date in Melbourne at that moment
+    """
+    return timestamp.astimezone(UP_TIMEZONE).date()
+
+
+def _related_id(relationships, name):
+    data = (relationships.get(name) or {}).get("data")
+    return sys.intern(data["id"]) if data else None
+
+
+@dataclass(slots=True)
+class UpTransaction:
+    id: str
+    account_id: str
+    status: str
+    created_at: datetime
+    amount_cents: int
+    currency_code: str
+    description: str
+    raw_text: str = None
+    transfer_account_id: str = None
+    category_id: str = None
+    round_up_cents: int = None  # negative; moved to the Round Up saver on top of the amount
+    cashback_cents: int = None
+    cashback_description: str = None
+
+    @classmethod
+    def from_json(cls, tx):
+        """
+        Args:
+            tx (dict): a transaction from the 'data' field of an Up transactions response
+
+        Returns:
+            UpTransaction
+        """
+        attributes = tx["attributes"]
+        relationships = tx["relationships"]
+        amount = attributes["amount"]
+        round_up = attributes.get("roundUp")
+        cashback = attributes.get("cashback")
+
+        return cls(
+            id=tx["id"],
+            account_id=_related_id(relationships, "account"),
+            status=sys.intern(attributes["status"]),
+            created_at=datetime.fromisoformat(attributes["createdAt"]),
+            amount_cents=amount_in_cents(amount),
+            currency_code=sys.intern(amount["currencyCode"]),
+            description=attributes["description"],
+            raw_text=attributes.get("rawText"),
+            transfer_account_id=_related_id(relationships, "transferAccount"),
+            category_id=_related_id(relationships, "category"),
+            round_up_cents=amount_in_cents(round_up["amount"]) if round_up else None,
+            cashback_cents=amount_in_cents(cashback["amount"]) if cashback else None,
+            cashback_description=cashback["description"] if cashback else None,
+        )
+
+    @classmethod
+    def coerce(cls, tx):
+        """
+        Accepts either raw Up JSON or an UpTransaction, so helpers work on both
+        """
+        return tx if isinstance(tx, cls) else cls.from_json(tx)
+
+    @property
+    def is_settled(self):
+        return self.status == "SETTLED"
+
+    @property
+    def local_date(self):
+        return local_date(self.created_at)
+
+
+def parse_page(page):
+    """
+    Args:
+        page (list): the 'data' field of an Up transactions response
+
+    Returns:
+        list: UpTransaction for each transaction on the page
+    """
+    return [UpTransaction.from_json(tx) for tx in page]
+
+
+@dataclass(slots=True)
+class YnabSubtransaction:
+    amount: int  # milliunits
+    payee_name: str = None
+    payee_id: str = None
+    category_id: str = None
+    memo: str = None
+
+    def to_json(self):
+        body = {"amount": self.amount}
+        for name in ("payee_name", "payee_id", "category_id", "memo"):
+            value = getattr(self, name)
+            if value is not None:
+                body[name] = value
+        return body
+
+
+@dataclass(slots=True)
+class YnabTransaction:
+    account_id: str
+    date: date
+    amount: int  # milliunits
+    payee_name: str = None
+    memo: str = None
+    cleared: str = "cleared"
+    approved: bool = False
+    import_id: str = None
+    payee_id: str = None
+    category_id: str = None
+    subtransactions: list = None  # YnabSubtransactions, for a split
+
+    def to_json(self):
+        """
+        Returns:
+            dict: body for this transaction in a YNAB POST, leaving out optional fields that aren't set
+        """
+        body = {
+            "account_id": self.account_id,
+            "date": self.date.isoformat(),
+            "amount": self.amount,
+            "cleared": self.cleared,
+            "approved": self.approved,
+        }
+        for field in ("payee_name", "memo", "import_id", "payee_id", "category_id"):
+            value = getattr(self, field)
+            if value is not None:
+                body[field] = value
+        if self.subtransactions:
+            body["subtransactions"] = [subtransaction.to_json() for subtransaction in self.subtransactions]
+        return body
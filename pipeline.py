@@ -0,0 +1,77 @@
+import time
+from metrics import METRICS
+from models import parse_page
+from sync_state import CursorTracker
+from transfers import plan_transfers
+from transform import iter_ynab_transactions
+from up_api import iter_transaction_pages
+from ynab_api import DEFAULT_BATCH_SIZE, post_transactions_in_batches
+
+"""
+Streaming sync of one Up account into YNAB
+Pages are yielded by Up as they arrive, parsed once into UpTransactions, transformed lazily and posted to YNAB
+in fixed-size batches, so memory use is bounded by the page and batch size rather than by how much history is
+being synced
+When every account is synced at once (see SyncService.sync_all()), the pages are handed in as they're fetched
+alongside the other accounts' (see up_api.iter_all_account_pages())
+"""
+
+
+def stream_account_to_ynab(up_session, up_account_id, since_date, ynab_account_id, budget_id, ynab_session,
+                           batch_size=DEFAULT_BATCH_SIZE, account_map=None, sync_state=None, transfer_payee_ids=None,
+                           rules=None, archive=None, pages=None):
+    """
+    Streams an Up account's transactions since since_date into a YNAB account
+
+    If an Up page still fails to download after retrying, IncompleteFetchError is raised once the batches already
+    posted have gone through; since YNAB ignores repeated import_ids, the next run can safely start again from the
+    same cursor
+
+    Args:
+        up_session (requests.Session): from up_api.create_session()
+        up_account_id (str)
+        since_date (str | datetime): cursor or reconciliation date to fetch from
+        ynab_account_id (str)
+        budget_id (str)
+        ynab_session (requests.Session): from ynab_api.create_session()
+        batch_size (int): maximum number of transactions per YNAB request
+        account_map (AccountMap): optional Up -> YNAB account links, shared with the transform
+        sync_state (SyncState): if given, transactions already imported are dropped before upload
+        transfer_payee_ids (dict): YNAB account id -> transfer_payee_id; with an account_map, transfers are sent
+            as YNAB transfers, and incoming legs from other mapped accounts are left to their outgoing leg
+        rules (RuleSet): optional payee and category rules, applied by the transform
+        archive (UpArchive): if given, every page fetched is archived too (see archive.py)
+        pages (iterable): the account's pages since since_date, if they're already being fetched; otherwise
+            they're fetched here
+
+    Returns:
+        tuple: (upload results from post_transactions_in_batches(), cursor for the next sync)
+    """
+    tracker = CursorTracker()
+
+    if pages is None:
+        pages = iter_transaction_pages(up_session, up_account_id, since_date)
+    synced_up_account_ids = set(account_map.by_up_id) | {up_account_id} if account_map is not None else None
+
+    def transform_pages():
+        for page in pages:
+            if archive is not None:
+                archive.append(page)
+            # Each page is transformed in one go, so the transform can be timed apart from fetching and uploading
+            started = time.perf_counter()
+            up_transactions = list(tracker.track(parse_page(page)))
+            transfer_plan = None
+            if transfer_payee_ids is not None and account_map is not None:
+                # Only one account is streamed, so legs aren't paired; each is planned by which side it's on
+                transfer_plan = plan_transfers(up_transactions, account_map, transfer_payee_ids, synced_up_account_ids)
+            ynab_page = list(iter_ynab_transactions(up_transactions, ynab_account_id, account_map, transfer_plan,
+                                                   rules=rules))
+            METRICS.inc("transform_seconds_total", time.perf_counter() - started)
+            METRICS.inc("transform_transactions_total", len(up_transactions))
+            yield from ynab_page
+
+    ynab_transactions = transform_pages()
+    results = post_transactions_in_batches(ynab_transactions, budget_id, ynab_session, batch_size, sync_state)
+
+    return results, tracker.cursor(since_date)
+
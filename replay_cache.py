@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import requests
+
+"""
+An opt-in on-disk cache of raw Up and YNAB GET responses, for iterating on transform logic without the network
+ - responses are keyed by method, URL and query string
+ - online, every response is recorded but one is only replayed when the live request fails, and only within a TTL,
+   so repeated runs always see current accounts and pages
+ - the cache is capped in size; the least recently written files (responses and the pointers described below) are
+   evicted first
+ - in offline mode every request is answered from the cache, regardless of age, and a miss is an error
+
+Some query parameters move forward every sync (Up's filter[since] cursor, YNAB's last_knowledge_of_server), so an
+exact match would rarely be found offline. Offline lookups therefore fall back to the most recent response for the
+same URL with those parameters ignored, found through a small .latest pointer file; Up's links.next URLs in a
+replayed page then match exactly. A pointer left behind by an evicted response is a miss, and is evicted in turn
+"""
+
+DEFAULT_CACHE_DIR = ".replay_cache"
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+# Query parameters ignored when falling back to the latest response for a URL
+VOLATILE_PARAMS = {"filter[since]", "last_knowledge_of_server"}
+
+# Responses, and pointers to the latest response for a URL; both count towards max_bytes
+CACHE_SUFFIXES = (".json", ".latest")
+
+
+class OfflineCacheMiss(requests.exceptions.ConnectionError):
+    """
+    Raised in offline mode when a request has no cached response
+    """
+
+
+def _hash(*parts):
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def cache_keys(method, url, params=None):
+    """
+    Args:
+        method (str)
+        url (str)
+        params (dict): query parameters passed separately from the url, if any
+
+    Returns:
+        tuple: (exact key, key ignoring VOLATILE_PARAMS)
+    """
+    parts = urlsplit(url)
+    query = sorted(parse_qsl(parts.query, keep_blank_values=True) + sorted((params or {}).items()))
+    base = f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+    exact = _hash(method.upper(), base, urlencode(query))
+    relaxed = _hash(method.upper(), base, urlencode([(k, v) for k, v in query if k not in VOLATILE_PARAMS]))
+    return exact, relaxed
+
+
+class ReplayCache:
+    """
+    Args:
+        directory (str): where responses are stored
+        ttl (float): seconds a response can stand in for a failed request when online
+        max_bytes (int): total size the cache is trimmed back to
+        offline (bool): answer every request from the cache, never the network
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith(CACHE_SUFFIXES)]
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, f"{key}.{suffix}")
+
+    def get(self, method, url, params=None):
+        """
+        Returns:
+            requests.Response: the cached response, or None if there's no usable entry
+        """
+        exact, relaxed = cache_keys(method, url, params)
+
+        entry = self._read(exact)
+        if entry is None and self.offline:
+            try:
+                with open(self._path(relaxed, "latest")) as file:
+                    entry = self._read(file.read().strip())
+            except FileNotFoundError:
+                pass
+
+        if entry is None:
+            return None
+        if not self.offline and time.time() - entry["fetched_at"] > self.ttl:
+            return None
+        return self._to_response(entry)
+
+    def put(self, method, url, response, params=None):
+        """
+        Stores a successful response; anything else is ignored
+        """
+        if response.status_code != 200:
+            return
+
+        exact, relaxed = cache_keys(method, url, params)
+        entry = {
+            "url": response.url or url,
+            "fetched_at": time.time(),
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+            "body": response.text,
+        }
+        self._write(self._path(exact, "json"), json.dumps(entry))
+        self._write(self._path(relaxed, "latest"), exact)
+        self._evict()
+
+    def _read(self, key):
+        try:
+            with open(self._path(key, "json")) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, path, text):
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w") as file:
+            file.write(text)
+        os.replace(temporary_path, path)
+
+        with self.lock:
+            self.total_bytes += os.path.getsize(path) - previous_size
+
+    def _evict(self):
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+
+            entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+            for entry in entries:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.total_bytes -= entry.stat().st_size
+                os.remove(entry.path)
+
+    @staticmethod
+    def _to_response(entry):
+        response = requests.Response()
+        response.status_code = entry["status_code"]
+        response.headers.update(entry["headers"])
+        response.url = entry["url"]
+        response.encoding = "utf-8"
+        response._content = entry["body"].encode("utf-8")
+        return response
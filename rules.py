@@ -0,0 +1,255 @@
+import re
+import yaml
+
+"""
+Payee clean-up and categorisation rules, read from rules.yaml:
+
+rules:
+  - match: "WOOLWORTHS|COLES"    # regular expression, case-insensitive
+    field: raw_text              # description (default), raw_text, category (Up category id) or merchant
+    payee: Groceries             # optional; the payee name sent to YNAB instead of Up's description
+    category_id: <YNAB category id>    # optional
+  - match: "^Uber"
+    payee: Uber
+
+Up has no separate merchant field; its description is the cleaned-up merchant name, so 'merchant' is another name
+for 'description'
+
+The first rule listed that matches is the one applied, wherever in the text each rule matches. Rather than trying
+each rule in turn for every transaction, plain-text patterns (and alternations of plain text, like the first above),
+which is what most rules are, are compiled once per field and action (payee or category) into a trie, written out
+as one regex of nested alternations that share their common prefixes. Most transactions match none of them, which
+that regex finds in one search however many rules there are; when it does match, the trie is walked from each
+position of the text to find every rule that matches, and the first listed is kept
+Other patterns are tried on their own, in the order listed, stopping at the first plain-text match found above;
+those that can safely be joined (no groups, flags or backreferences to disturb) are first searched for together,
+so they're only tried one by one if one of them matches
+"""
+
+DEFAULT_RULES_PATH = "rules.yaml"
+
+# Characters that make a pattern more than plain text
+METACHARACTERS = set(".^$*+?{}[]\\|()")
+
+# Rule field -> UpTransaction attribute it's matched against
+FIELDS = {
+    "description": "description",
+    "merchant": "description",
+    "raw_text": "raw_text",
+    "category": "category_id",
+}
+
+
+class RuleSet:
+    """
+    Compiled payee and category rules
+
+    Args:
+        rules (list): rule entries as found under 'rules' in rules.yaml
+
+    Raises:
+        ValueError: if a rule has no match, an unknown field, no action or an invalid pattern
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+
+        # (attribute, action) -> RuleMatcher
+        self.matchers = {}
+        grouped = {}
+        for number, rule in enumerate(rules, 1):
+            field = rule.get("field", "description")
+            if not rule.get("match"):
+                raise ValueError(f"Rule {number} has no 'match' pattern")
+            if field not in FIELDS:
+                raise ValueError(f"Rule {number} has an unknown field '{field}'; use one of {', '.join(FIELDS)}")
+            if not (rule.get("payee") or rule.get("category_id")):
+                raise ValueError(f"Rule {number} sets neither 'payee' nor 'category_id'")
+            try:
+                pattern = re.compile(rule["match"], re.IGNORECASE)
+            except re.error as e:
+                raise ValueError(f"Rule {number} has an invalid pattern: {e}")
+
+            for action in ("payee", "category_id"):
+                if rule.get(action):
+                    grouped.setdefault((FIELDS[field], action), []).append((pattern, number, rule))
+
+        for key, entries in grouped.items():
+            self.matchers[key] = RuleMatcher(entries)
+
+    @classmethod
+    def from_yaml(cls, path=DEFAULT_RULES_PATH):
+        """
+        Args:
+            path (str): location of rules.yaml
+
+        Returns:
+            RuleSet
+        """
+        with open(path, "r") as file:
+            return cls((yaml.safe_load(file) or {}).get("rules") or [])
+
+    def _first(self, tx, action):
+        # The matching rule listed first, across the fields matched for this action
+        best = None
+        for (attribute, matcher_action), matcher in self.matchers.items():
+            if matcher_action != action:
+                continue
+            text = getattr(tx, attribute)
+            found = matcher.first(text, best[0] if best else None) if text else None
+            if found is not None:
+                best = found
+        return best[1] if best else None
+
+    def apply(self, tx):
+        """
+        Args:
+            tx (UpTransaction)
+
+        Returns:
+            tuple: (payee name, YNAB category id); either is None if no rule sets it
+        """
+        payee_rule = self._first(tx, "payee")
+        category_rule = self._first(tx, "category_id")
+        return (payee_rule["payee"] if payee_rule else None,
+                category_rule["category_id"] if category_rule else None)
+
+
+class RuleMatcher:
+    """
+    The rules for one field and action, compiled for finding the first listed that matches
+
+    Args:
+        entries (list): (compiled pattern, rule number, rule), in the order listed
+    """
+
+    def __init__(self, entries):
+        # Plain text (lower case) -> (rule number, rule); the first rule listed keeps a text that appears twice
+        self.rules_by_text = {}
+        # (rule number, rule, pattern, whether it's also in the joined regex), for the other patterns
+        self.patterns = []
+        joinable = []
+        for pattern, number, rule in entries:
+            texts = _plain_alternatives(pattern.pattern)
+            if texts is None:
+                joined = _joinable(pattern)
+                self.patterns.append((number, rule, pattern, joined))
+                if joined:
+                    joinable.append(f"(?:{pattern.pattern})")
+                continue
+            for text in texts:
+                self.rules_by_text.setdefault(text.lower(), (number, rule))
+
+        self.trie = _trie(self.rules_by_text)
+        self.text_regex = re.compile(_trie_pattern(self.trie), re.IGNORECASE) if self.rules_by_text else None
+        self.joined_regex = re.compile("|".join(joinable), re.IGNORECASE) if joinable else None
+
+    def first(self, text, before=None):
+        """
+        Args:
+            text (str)
+            before (int): only rules numbered lower than this are of interest
+
+        Returns:
+            tuple: (rule number, rule) of the first rule listed that matches text, or None
+        """
+        best = None
+        if self.text_regex is not None and self.text_regex.search(text):
+            best = self._first_text(text.lower())
+            if best is not None and before is not None and best[0] >= before:
+                best = None
+        if best is not None:
+            before = best[0]
+
+        joined_match = None
+        for number, rule, pattern, joined in self.patterns:
+            if before is not None and number >= before:
+                break
+            if joined:
+                if joined_match is None:
+                    joined_match = bool(self.joined_regex.search(text))
+                if not joined_match:
+                    continue
+            if pattern.search(text):
+                return number, rule
+        return best
+
+    def _first_text(self, text):
+        # Walks the trie from every position in text, keeping the first listed of all the texts found
+        best = None
+        for start in range(len(text)):
+            node = self.trie
+            for char in text[start:]:
+                node = node.get(char)
+                if node is None:
+                    break
+                if None in node:
+                    found = self.rules_by_text[node[None]]
+                    if best is None or found[0] < best[0]:
+                        best = found
+        return best
+
+
+def _joinable(pattern):
+    """
+    Returns:
+        bool: whether pattern means the same inside a joined alternation: it has no groups (so no backreferences)
+            and no global flags, which are only allowed at the start of a whole regex
+    """
+    if pattern.groups:
+        return False
+    try:
+        re.compile(f"(?:)|(?:{pattern.pattern})")
+    except re.error:
+        return False
+    return True
+
+
+def _plain_alternatives(pattern):
+    """
+    Returns:
+        list: the plain-text alternatives making up pattern, or None if it uses any other regex syntax
+    """
+    texts = pattern.split("|")
+    if any(not text or METACHARACTERS & set(text) for text in texts):
+        return None
+    return texts
+
+
+def _trie(texts):
+    """
+    Args:
+        texts (iterable): lower case
+
+    Returns:
+        dict: char -> child node; a node where a text ends holds that text under None
+    """
+    trie = {}
+    for text in texts:
+        node = trie
+        for char in text:
+            node = node.setdefault(char, {})
+        node[None] = text
+    return trie
+
+
+def _trie_pattern(trie):
+    """
+    Writes a trie of plain texts out as one regex whose alternations follow it, so texts with a common prefix share it
+    No groups are used (each one would add to the cost of every match)
+
+    Args:
+        trie (dict): from _trie()
+
+    Returns:
+        str
+    """
+    def emit(node):
+        branches = [re.escape(char) + emit(child) for char, child in node.items() if char is not None]
+        if None in node:
+            branches.append("")
+        if len(branches) == 1:
+            return branches[0]
+        return f"(?:{'|'.join(branches)})"
+
+    return emit(trie)
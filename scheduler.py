@@ -0,0 +1,57 @@
+import heapq
+import random
+import threading
+import time
+
+"""
+A minimal scheduler for daemon mode: each job runs every `interval` seconds, give or take up to `jitter` seconds,
+so several daemons (eg. one per tenant) don't all hit the APIs at the same moment
+A daemon schedules one job, syncing every account (see SyncService.run_daemon()); if more are added, they run one
+at a time on the calling thread, in order of when they're due, so they can share sessions and state
+"""
+
+
+class Scheduler:
+    """
+    Args:
+        interval (float): seconds between runs of each job
+        jitter (float): each run is moved earlier or later by up to this many seconds, chosen at random
+        stop_event (threading.Event): set it to stop run() after the job in progress
+    """
+
+    def __init__(self, interval, jitter=0, stop_event=None):
+        self.interval = interval
+        self.jitter = jitter
+        self.stop_event = stop_event or threading.Event()
+        self.jobs = []
+        self.sequence = 0
+
+    def _schedule(self, delay, name, job):
+        heapq.heappush(self.jobs, (time.monotonic() + max(delay, 0), self.sequence, name, job))
+        self.sequence += 1
+
+    def add(self, name, job):
+        """
+        Adds a job; its first run is within `jitter` seconds from now, which staggers jobs added together
+        """
+        self._schedule(random.uniform(0, self.jitter), name, job)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        """
+        Runs jobs as they fall due until stop() is called; an exception in a job is reported and the job rescheduled
+        """
+        while self.jobs and not self.stop_event.is_set():
+            due_at, _, name, job = heapq.heappop(self.jobs)
+
+            if self.stop_event.wait(max(due_at - time.monotonic(), 0)):
+                break
+
+            try:
+                job()
+            except Exception as e:
+                print(f"Scheduled job {name} failed: {e}")
+
+            self._schedule(self.interval + random.uniform(-self.jitter, self.jitter), name, job)
@@ -0,0 +1,478 @@
+import os
+import signal
+import time
+from datetime import datetime, timezone
+import requests
+from dotenv import load_dotenv
+from account_map import DEFAULT_RESOURCES_PATH, AccountMap
+from archive import UpArchive
+from backfill import backfill_account, iter_shards_in_order, month_shards
+from diff import patch_changed_transactions
+from metrics import METRICS, MetricsServer
+from models import UpTransaction, parse_page
+from pipeline import stream_account_to_ynab
+from rules import DEFAULT_RULES_PATH, RuleSet
+from scheduler import Scheduler
+from sync_state import (DEFAULT_RECONCILIATION_LOOKBACK_DAYS, DEFAULT_STATE_PATH, SyncState, reconciliation_start,
+                        to_utc_timestamp)
+from transfers import plan_transfers
+from transform import iter_ynab_transactions
+from up_api import (DEFAULT_MAX_CONCURRENCY, create_session as create_up_session, get_accounts, get_transaction,
+                    iter_all_account_pages, iter_transaction_pages)
+from verify import verify_accounts
+from ynab_api import DEFAULT_BATCH_SIZE, create_session as create_ynab_session, refresh_account_transactions
+from ynab_metadata import YnabMetadata
+
+"""
+Syncing every mapped Up account into YNAB, with everything a sync needs set up once and kept between runs:
+the keep-alive Up and YNAB sessions (and the YNAB rate limiter), the account map, the sync state and the cached
+YNAB accounts and transfer payees (see ynab_metadata.py). Used by up_to_ynab.py, both for a one-off sync and in
+daemon mode, where reusing them saves the per-run start-up, TLS handshakes and lookups
+A sync of every account fetches them from Up at once over the pooled session, streaming each account's pages to
+YNAB in turn as they arrive
+Each account sync is timed and summarised as a JSON log line (see metrics.py), with what it cost at each stage
+"""
+
+
+class SyncService:
+    """
+    Args:
+        up_api_key (str)
+        ynab_api_key (str)
+        budget_id (str): YNAB budget to sync into
+        account_map (AccountMap): Up -> YNAB account links; each linked account is synced
+        sync_state (SyncState)
+        batch_size (int): maximum number of transactions per YNAB request
+        ynab_account_id (str): YNAB account for default_up_account_id, when the account map is empty
+        default_up_account_id (str): the Up account synced when the account map is empty
+        cache (ReplayCache): optional cache of raw API responses
+        name (str): identifies this service (eg. the tenant) in logs
+        up_pool_size (int): connections kept open to Up; enough for the accounts fetched at once by a sync, or the
+            months fetched at once by a backfill
+        lookback_days (float): how far back a first sync reaches if the YNAB account has never been reconciled
+        rules (RuleSet): optional payee and category rules, applied by the transform
+        archive (UpArchive): if given, every page of Up transactions fetched is archived (see archive.py)
+    """
+
+    def __init__(self, up_api_key, ynab_api_key, budget_id, account_map, sync_state, batch_size=DEFAULT_BATCH_SIZE,
+                 ynab_account_id=None, default_up_account_id=None, cache=None, name=None,
+                 up_pool_size=DEFAULT_MAX_CONCURRENCY, lookback_days=DEFAULT_RECONCILIATION_LOOKBACK_DAYS,
+                 rules=None, archive=None):
+        self.name = name
+        self.budget_id = budget_id
+        self.account_map = account_map
+        self.sync_state = sync_state
+        self.batch_size = batch_size
+        self.ynab_account_id = ynab_account_id
+        self.default_up_account_id = default_up_account_id
+        self.lookback_days = lookback_days
+        self.rules = rules
+        self.archive = archive
+        self.up_pool_size = up_pool_size
+
+        self.up_session = create_up_session(up_api_key, up_pool_size, cache=cache)
+        self.ynab_session = create_ynab_session(ynab_api_key, cache=cache)
+        self.metadata = YnabMetadata(budget_id, self.ynab_session, sync_state)
+
+    @classmethod
+    def from_env(cls, up_pool_size=None, cache=None):
+        """
+        Builds a service from the .env file / environment, as used by the numbered scripts
+        Exits with a message if a required variable is missing
+
+        Args:
+            up_pool_size (int): connections kept open to Up; defaults to UP_MAX_CONCURRENCY
+            cache (ReplayCache): optional cache of raw API responses
+        """
+        load_dotenv()
+        up_pool_size = up_pool_size or int(os.getenv("UP_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+
+        required = {name: os.getenv(name) for name in ("UP_API_KEY", "YNAB_API_KEY", "YNAB_BUDGET_ID")}
+        for name, value in required.items():
+            if not value:
+                print(f"Error: {name} not found in environment variables")
+                exit(1)
+
+        resources_path = os.getenv("RESOURCES_PATH", DEFAULT_RESOURCES_PATH)
+        account_map = AccountMap.from_yaml(resources_path) if os.path.exists(resources_path) else AccountMap([])
+        if not account_map.accounts and not (os.getenv("UP_DEBITS_ACCOUNT_ID") and os.getenv("YNAB_ACCOUNT_ID")):
+            print(f"Error: no accounts to sync; list them in {resources_path}, "
+                  f"or set UP_DEBITS_ACCOUNT_ID and YNAB_ACCOUNT_ID in the .env file")
+            exit(1)
+
+        rules_path = os.getenv("RULES_PATH", DEFAULT_RULES_PATH)
+        try:
+            rules = RuleSet.from_yaml(rules_path) if os.path.exists(rules_path) else None
+        except ValueError as e:
+            print(f"Error in {rules_path}: {e}")
+            exit(1)
+
+        return cls(
+            required["UP_API_KEY"], required["YNAB_API_KEY"], required["YNAB_BUDGET_ID"], account_map,
+            SyncState(os.getenv("SYNC_STATE_PATH", DEFAULT_STATE_PATH)),
+            batch_size=int(os.getenv("YNAB_BATCH_SIZE", DEFAULT_BATCH_SIZE)),
+            ynab_account_id=os.getenv("YNAB_ACCOUNT_ID"),
+            default_up_account_id=os.getenv("UP_DEBITS_ACCOUNT_ID"),
+            up_pool_size=up_pool_size,
+            lookback_days=float(os.getenv("RECONCILIATION_LOOKBACK_DAYS", DEFAULT_RECONCILIATION_LOOKBACK_DAYS)),
+            rules=rules,
+            archive=UpArchive(os.environ["ARCHIVE_DIR"]) if os.getenv("ARCHIVE_DIR") else None,
+            cache=cache)
+
+    def close(self):
+        self.sync_state.close()
+        self.up_session.close()
+        self.ynab_session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def accounts(self):
+        """
+        Returns:
+            list: (name, Up account id, YNAB account id) for each account to sync
+        """
+        if self.account_map.accounts:
+            return [(account["name"], account["up"]["id"], account["ynab"]["id"])
+                    for account in self.account_map.accounts]
+        return [(self.default_up_account_id, self.default_up_account_id, self.ynab_account_id)]
+
+    def load_up_accounts(self):
+        # Each Up account's type, so unlisted TRANSACTIONAL accounts (eg. 2Up) don't fall back to the default saver;
+        # fetched every run, since accounts can be opened at any time
+        if self.account_map.default_saver_ynab_id is not None:
+            self.account_map.set_up_accounts(get_accounts(self.up_session))
+
+    def get_transfer_payee_ids(self):
+        # From the metadata cache; YNAB is only asked if a mapped account isn't in it yet
+        return self.metadata.transfer_payee_ids(self.account_map.by_ynab_id)
+
+    def since_date(self, up_account_id, ynab_account_id):
+        """
+        Where an account's sync starts: its stored cursor, or on a first sync the last YNAB reconciliation date
+        (or, if the account has never been reconciled, lookback_days ago)
+
+        Returns:
+            str
+        """
+        last_synced_at = self.sync_state.get_last_synced_at(up_account_id)
+        if last_synced_at:
+            return last_synced_at
+
+        # A cached reconciliation date is used as is: if YNAB has moved on since, the sync just starts a little
+        # earlier, and the extra transactions are skipped as already imported
+        last_reconciled_date = self.sync_state.get_last_reconciled_date(ynab_account_id)
+        if last_reconciled_date is None:
+            refresh_account_transactions(self.sync_state, self.budget_id, ynab_account_id, self.ynab_session)
+            last_reconciled_date = self.sync_state.get_last_reconciled_date(ynab_account_id)
+        return reconciliation_start(last_reconciled_date, self.lookback_days)
+
+    def sync_account(self, name, up_account_id, ynab_account_id, fetching=None):
+        """
+        Streams one account's new Up transactions into YNAB and moves its cursor on
+
+        Args:
+            name (str)
+            up_account_id (str)
+            ynab_account_id (str)
+            fetching (tuple): (since date, generator of the account's pages since then), if sync_all() is
+                already fetching the account; otherwise its pages are fetched here
+
+        Returns:
+            dict: upload results (see ynab_api.post_transactions_in_batches()), or None if the sync didn't run
+        """
+        # Fetching is counted per Up account, as sync_all() fetches the others at the same time; the transform runs
+        # here, one account after another
+        stage_counters = {counter: {"account": up_account_id} for counter in (
+            "up_pages_total", "up_transactions_total", "http_response_bytes_total", "http_retries_total")}
+        stage_counters.update({"transform_transactions_total": {}, "transform_seconds_total": {}})
+        before = {counter: METRICS.total(counter, **labels) for counter, labels in stage_counters.items()}
+        started = time.perf_counter()
+
+        results = self._sync_account(name, up_account_id, ynab_account_id, fetching)
+
+        seconds = time.perf_counter() - started
+        ok = results is not None and not results["failed"]
+        METRICS.observe("sync_seconds", seconds, account=name)
+        if ok:
+            METRICS.set("last_sync_timestamp_seconds", time.time(), account=name)
+
+        # What this sync cost at each stage, for the JSON log
+        fields = {counter.removesuffix("_total"): METRICS.total(counter, **labels) - before[counter]
+                  for counter, labels in stage_counters.items()}
+        if fields["transform_seconds"]:
+            fields["transform_per_second"] = round(fields["transform_transactions"] / fields["transform_seconds"])
+            fields["transform_seconds"] = round(fields["transform_seconds"], 4)
+        if results is not None:
+            fields.update({result: len(results[result]) for result in ("created", "duplicates", "skipped", "failed")})
+        METRICS.log_event("sync", tenant=self.name, account=name, ok=ok, seconds=round(seconds, 3),
+                          ynab_rate_limit_remaining=METRICS.get("ynab_rate_limit_remaining") or None, **fields)
+        return results
+
+    def _sync_account(self, name, up_account_id, ynab_account_id, fetching=None):
+        account_map = self.account_map if self.account_map.accounts else None
+        try:
+            if fetching is not None:
+                since_date, pages = fetching
+            else:
+                since_date, pages = self.since_date(up_account_id, ynab_account_id), None
+                self.load_up_accounts()
+            print(f"{name}: syncing Up transactions since {since_date}")
+            results, cursor = stream_account_to_ynab(
+                self.up_session, up_account_id, since_date, ynab_account_id, self.budget_id, self.ynab_session,
+                self.batch_size, account_map, self.sync_state,
+                self.get_transfer_payee_ids() if account_map is not None else None, self.rules, self.archive, pages)
+
+        except requests.exceptions.RequestException as e:
+            # The cursor is unchanged, so the next sync starts from the same place
+            print(f"{name}: sync failed: {e}")
+            return None
+
+        print(f"{name}: created {len(results['created'])}, "
+              f"skipped {len(results['skipped']) + len(results['duplicates'])} already imported")
+        if results["failed"]:
+            print(f"{name}: failed to post {len(results['failed'])} transactions; they will be retried next sync")
+        else:
+            self.sync_state.record_sync(up_account_id, last_synced_at=cursor)
+        return results
+
+    def sync_all(self, max_workers=None):
+        """
+        Syncs every account: their new Up transactions are fetched at once (see up_api.iter_all_account_pages()),
+        and each account's pages are streamed into YNAB in turn while the others keep downloading
+        Every mapped account is being synced, so each transfer leg is planned by which side it's on, as when one
+        account is synced: the outgoing leg is sent as a YNAB transfer and the incoming one left to it
+        An account that can't be fetched is left for the next sync; the others go ahead. Transactions a webhook sent
+        to YNAB before they settled are then brought up to date (see update_pending())
+
+        Args:
+            max_workers (int): accounts fetched at the same time; defaults to up_pool_size
+
+        Returns:
+            dict: upload results (or None) keyed by Up account id
+        """
+        accounts = self.accounts()
+        try:
+            since_dates = {up_account_id: self.since_date(up_account_id, ynab_account_id)
+                           for _, up_account_id, ynab_account_id in accounts}
+            self.load_up_accounts()
+        except requests.exceptions.RequestException as e:
+            print(f"Sync failed: {e}")
+            return {up_account_id: None for _, up_account_id, _ in accounts}
+
+        results = {}
+        account_pages = iter_all_account_pages(self.up_session, since_dates, list(since_dates),
+                                               max_workers or self.up_pool_size)
+        try:
+            for (name, up_account_id, ynab_account_id), (_, pages) in zip(accounts, account_pages):
+                results[up_account_id] = self.sync_account(name, up_account_id, ynab_account_id,
+                                                           (since_dates[up_account_id], pages))
+        finally:
+            account_pages.close()
+        self.update_pending()
+        return results
+
+    def update_pending(self):
+        """
+        Brings YNAB up to date with the Up transactions a webhook sent while HELD, or whose TRANSACTION_SETTLED
+        webhook event failed (see webhooks.py): their HELD copy is already imported, so a sync skips them; instead
+        each is fetched again and only what changed is PATCHed (see diff.py)
+
+        Returns:
+            dict: PATCH results (see ynab_api.patch_transactions_in_batches()), or None if nothing was done
+        """
+        pending = self.sync_state.get_pending_updates()
+        if not pending:
+            return None
+        account_map = self.account_map if self.account_map.accounts else None
+        print(f"Updating {len(pending)} transactions sent to YNAB by a webhook before they settled")
+
+        try:
+            up_transactions = []
+            gone = []
+            for transaction_id in pending:
+                try:
+                    up_transactions.append(UpTransaction.from_json(get_transaction(self.up_session, transaction_id)))
+                except requests.exceptions.HTTPError as e:
+                    if e.response is None or e.response.status_code != 404:
+                        raise
+                    gone.append(transaction_id)
+
+            transfer_plan = None
+            if account_map is not None:
+                transfer_plan = plan_transfers(up_transactions, account_map, self.get_transfer_payee_ids(),
+                                               set(account_map.by_up_id))
+            ynab_transactions = list(iter_ynab_transactions(up_transactions, self.ynab_account_id, account_map,
+                                                            transfer_plan, include_held=True, rules=self.rules))
+            for ynab_account_id in {tx.account_id for tx in ynab_transactions}:
+                refresh_account_transactions(self.sync_state, self.budget_id, ynab_account_id, self.ynab_session)
+            results = patch_changed_transactions(ynab_transactions, self.budget_id, self.ynab_session,
+                                                 self.sync_state, self.batch_size)
+        except requests.exceptions.RequestException as e:
+            print(f"Update of pending transactions failed: {e}; it will be retried next sync")
+            return None
+
+        # Deleted from Up since, or now up to date; any still HELD are kept for the next sync
+        self.sync_state.forget_pending_updates(
+            gone + [tx.id for tx in up_transactions if tx.is_settled and not results["failed"]])
+        METRICS.inc("patch_transactions_total", len(results["updated"]), result="updated")
+        METRICS.inc("patch_transactions_total", len(results["failed"]), result="failed")
+        return results
+
+    def backfill(self, since_date, until_date=None, max_workers=DEFAULT_MAX_CONCURRENCY):
+        """
+        Backfills every account from since_date, a month at a time with max_workers months fetched at once (see
+        backfill.py); an interrupted backfill picks up where it stopped when run again with the same since_date
+        Once an account's backfill is complete, its sync cursor is moved up to it, unless it's already further on
+        """
+        account_map = self.account_map if self.account_map.accounts else None
+        for name, up_account_id, ynab_account_id in self.accounts():
+            print(f"{name}: backfilling from {since_date}")
+            try:
+                self.load_up_accounts()
+                results, tracker, complete = backfill_account(
+                    self.up_session, up_account_id, since_date, ynab_account_id, self.budget_id, self.ynab_session,
+                    self.sync_state, until_date, max_workers, self.batch_size, account_map,
+                    self.get_transfer_payee_ids() if account_map is not None else None, self.rules,
+                    self.archive)
+            except requests.exceptions.RequestException as e:
+                print(f"{name}: backfill stopped: {e}; run it again to resume")
+                continue
+
+            print(f"{name}: created {len(results['created'])}, "
+                  f"skipped {len(results['skipped']) + len(results['duplicates'])} already imported")
+            last_synced_at = self.sync_state.get_last_synced_at(up_account_id)
+            cursor = tracker.cursor()
+            if complete and cursor and (last_synced_at is None or cursor > last_synced_at):
+                self.sync_state.record_sync(up_account_id, last_synced_at=cursor)
+
+    def export(self, archive, since_date, until_date=None, max_workers=DEFAULT_MAX_CONCURRENCY):
+        """
+        Archives every account's Up history from since_date, several months at a time; nothing goes to YNAB
+        Transactions already in the archive are left as they are, so an interrupted export can simply be run again
+
+        Args:
+            archive (UpArchive)
+            since_date (str | datetime)
+            until_date (str | datetime): defaults to now
+            max_workers (int): months fetched at the same time
+
+        Returns:
+            dict: transactions fetched, keyed by Up account id, or None for an account whose export stopped
+        """
+        until_date = until_date or datetime.now(timezone.utc)
+        fetched = {}
+        for name, up_account_id, _ in self.accounts():
+            print(f"{name}: archiving Up transactions since {since_date}")
+            try:
+                fetched[up_account_id] = sum(
+                    len(up_transactions) for _, up_transactions in iter_shards_in_order(
+                        self.up_session, up_account_id, month_shards(since_date, until_date), max_workers,
+                        archive=archive))
+            except requests.exceptions.RequestException as e:
+                print(f"{name}: export stopped: {e}; run it again to carry on")
+                fetched[up_account_id] = None
+        return fetched
+
+    def update_changed(self, since_date):
+        """
+        Brings transactions already in YNAB up to date with Up, for everything since since_date: the YNAB cache is
+        refreshed with a delta request, then only transactions that differ are PATCHed, in bulk (see diff.py)
+
+        Returns:
+            dict: PATCH results (see ynab_api.patch_transactions_in_batches()) keyed by Up account id
+        """
+        account_map = self.account_map if self.account_map.accounts else None
+        since_date = to_utc_timestamp(since_date)
+        updated = {}
+
+        for name, up_account_id, ynab_account_id in self.accounts():
+            print(f"{name}: checking Up transactions since {since_date} for changes")
+            try:
+                self.load_up_accounts()
+                refresh_account_transactions(self.sync_state, self.budget_id, ynab_account_id, self.ynab_session)
+                up_transactions = [tx for page in iter_transaction_pages(self.up_session, up_account_id, since_date)
+                                   for tx in parse_page(page)]
+                transfer_plan = None
+                if account_map is not None:
+                    transfer_plan = plan_transfers(up_transactions, account_map, self.get_transfer_payee_ids(),
+                                                   set(account_map.by_up_id) | {up_account_id})
+                ynab_transactions = iter_ynab_transactions(up_transactions, ynab_account_id, account_map,
+                                                           transfer_plan, rules=self.rules)
+                results = patch_changed_transactions(ynab_transactions, self.budget_id, self.ynab_session,
+                                                     self.sync_state, self.batch_size)
+            except requests.exceptions.RequestException as e:
+                print(f"{name}: update failed: {e}")
+                updated[up_account_id] = None
+                continue
+
+            print(f"{name}: updated {len(results['updated'])} changed transactions")
+            if results["failed"]:
+                print(f"{name}: failed to update {len(results['failed'])} transactions")
+            METRICS.inc("patch_transactions_total", len(results["updated"]), result="updated")
+            METRICS.inc("patch_transactions_total", len(results["failed"]), result="failed")
+            updated[up_account_id] = results
+
+        return updated
+
+    def verify(self, since_date, max_workers=DEFAULT_MAX_CONCURRENCY):
+        """
+        Compares every synced YNAB account's balance with Up's, and for any that differ finds the day the drift
+        started (see verify.py)
+
+        Returns:
+            list: a report per YNAB account, as from verify.verify_accounts()
+        """
+        account_map = self.account_map if self.account_map.accounts else None
+        if account_map is not None:
+            self.load_up_accounts()
+
+        # Up accounts syncing into the same YNAB account are compared together
+        groups = {}
+        for name, up_account_id, ynab_account_id in self.accounts():
+            group = groups.setdefault(ynab_account_id, ([], []))
+            group[0].append(name)
+            group[1].append(up_account_id)
+
+        return verify_accounts(
+            self.up_session, self.ynab_session, self.budget_id, self.sync_state, self.metadata,
+            [(" + ".join(names), ynab_account_id, up_account_ids)
+             for ynab_account_id, (names, up_account_ids) in groups.items()],
+            since_date, max_workers, account_map, self.get_transfer_payee_ids() if account_map is not None else None)
+
+    def run_daemon(self, interval, jitter=0, metrics_file=None, metrics_port=None):
+        """
+        Keeps syncing every account (see sync_all()) every `interval` seconds (+/- `jitter`) until SIGINT or
+        SIGTERM, which let the sync in progress finish first
+
+        Args:
+            interval (float): seconds between syncs
+            jitter (float): random seconds added to or taken from each interval
+            metrics_file (str): if given, Prometheus metrics are written here after every sync
+            metrics_port (int): if given, Prometheus metrics are served at http://0.0.0.0:port/metrics
+        """
+        def scheduled_sync():
+            self.sync_all()
+            if metrics_file:
+                METRICS.write_prometheus(metrics_file)
+
+        # One job syncs every account, so they're fetched at once (see sync_all())
+        scheduler = Scheduler(interval, jitter)
+        scheduler.add("sync", scheduled_sync)
+
+        metrics_server = None
+        if metrics_port is not None:
+            metrics_server = MetricsServer(host="0.0.0.0", port=metrics_port).start()
+            print(f"Serving metrics on port {metrics_port}")
+
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda *_: scheduler.stop())
+
+        print(f"Syncing {len(self.accounts())} accounts every {interval}s (+/- {jitter}s)")
+        scheduler.run()
+
+        if metrics_server is not None:
+            metrics_server.stop()
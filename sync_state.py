@@ -0,0 +1,531 @@
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from models import UpTransaction
+
+"""
+A small on-disk store remembering where the last sync got up to, so each run only fetches what's new
+ - account_state: per Up account, the createdAt of the newest Up transaction synced (in UTC)
+ - ynab_accounts, ynab_transactions: a cached copy of each YNAB account's transactions, kept current with
+   server_knowledge delta requests; the server_knowledge there is the one delta cursor per YNAB account
+ - imported_transactions: every import_id already in YNAB, so repeat runs skip them before uploading
+ - ynab_metadata: YNAB accounts, payees and categories per budget, also delta-refreshed (see ynab_metadata.py)
+ - backfill_state: how far a sharded backfill has got, so an interrupted one resumes (see backfill.py)
+ - pending_updates: Up transactions sent to YNAB by a webhook while HELD, or whose TRANSACTION_SETTLED webhook event
+   failed, for the next sync to bring up to date once they've settled (see webhooks.py)
+"""
+
+DEFAULT_STATE_PATH = "sync_state.db"
+
+# How far back a first sync reaches when the YNAB account has never been reconciled
+DEFAULT_RECONCILIATION_LOOKBACK_DAYS = 30
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS account_state (
+        up_account_id TEXT PRIMARY KEY,
+        last_synced_at TEXT,
+        updated_at TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ynab_accounts (
+        ynab_account_id TEXT PRIMARY KEY,
+        server_knowledge INTEGER,
+        last_reconciled_date TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ynab_transactions (
+        id TEXT PRIMARY KEY,
+        ynab_account_id TEXT NOT NULL,
+        date TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        cleared TEXT NOT NULL,
+        import_id TEXT,
+        data TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ynab_transactions_account_date ON ynab_transactions (ynab_account_id, date)",
+    "CREATE INDEX IF NOT EXISTS ynab_transactions_import_id ON ynab_transactions (import_id)",
+    """
+    CREATE TABLE IF NOT EXISTS imported_transactions (
+        ynab_account_id TEXT NOT NULL,
+        import_id TEXT NOT NULL,
+        ynab_transaction_id TEXT,
+        PRIMARY KEY (ynab_account_id, import_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ynab_metadata (
+        budget_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        id TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (budget_id, kind, id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ynab_metadata_knowledge (
+        budget_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        server_knowledge INTEGER NOT NULL,
+        PRIMARY KEY (budget_id, kind)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS backfill_state (
+        up_account_id TEXT PRIMARY KEY,
+        since TEXT NOT NULL,
+        completed_until TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS pending_updates (
+        up_transaction_id TEXT PRIMARY KEY,
+        recorded_at TEXT NOT NULL
+    )
+    """,
+]
+
+
+def latest_reconciled_date(transactions, latest=None):
+    """
+    A running maximum of the dates of reconciled transactions
+    YNAB dates are ISO 8601 (YYYY-MM-DD), which sort as strings in date order, so none of them need parsing
+
+    Args:
+        transactions (iterable): YNAB transactions
+        latest (str): the latest reconciled date known so far, if any
+
+    Returns:
+        str: the latest of `latest` and the reconciled transactions' dates, or None
+    """
+    for tx in transactions:
+        if tx["cleared"] == "reconciled" and not tx.get("deleted") and (latest is None or tx["date"] > latest):
+            latest = tx["date"]
+    return latest
+
+
+def reconciliation_start(last_reconciled_date, lookback_days=DEFAULT_RECONCILIATION_LOOKBACK_DAYS):
+    """
+    Where a first sync starts: the last reconciliation date, or lookback_days ago if there hasn't been one
+
+    Args:
+        last_reconciled_date (str): YYYY-MM-DD, or None
+        lookback_days (float)
+
+    Returns:
+        str: timestamp to pass as filter[since]
+    """
+    if last_reconciled_date is not None:
+        return f"{last_reconciled_date}T00:00:00Z"
+    return to_utc_timestamp(datetime.now(timezone.utc) - timedelta(days=lookback_days))
+
+
+def to_utc_timestamp(value):
+    """
+    Normalises an RFC 3339 string or datetime to a UTC timestamp ending in 'Z'
+    Avoids '+hh:mm' offsets, which would otherwise need escaping when used in an Up filter[since] query
+
+    Args:
+        value (str | datetime)
+
+    Returns:
+        str: eg. '2025-03-20T00:11:12Z'
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class CursorTracker:
+    """
+    Works out where the next sync should start from, watching transactions as they're fetched
+    Held transactions aren't uploaded yet, so the cursor never moves past the oldest one still held
+    """
+
+    def __init__(self):
+        self.newest_created_at = None
+        self.oldest_held_at = None
+
+    def observe(self, tx):
+        tx = UpTransaction.coerce(tx)
+        created_at = to_utc_timestamp(tx.created_at)
+        if self.newest_created_at is None or created_at > self.newest_created_at:
+            self.newest_created_at = created_at
+        if not tx.is_settled and (self.oldest_held_at is None or created_at < self.oldest_held_at):
+            self.oldest_held_at = created_at
+
+    def track(self, up_transactions):
+        """
+        Passes transactions straight through, observing each one on the way; for use in a streaming pipeline
+        """
+        for tx in up_transactions:
+            self.observe(tx)
+            yield tx
+
+    def cursor(self, previous_cursor=None):
+        """
+        Args:
+            previous_cursor (str): cursor used for this run, returned unchanged if nothing new was seen
+
+        Returns:
+            str: UTC timestamp to pass as filter[since] next time
+        """
+        if self.oldest_held_at is not None:
+            return self.oldest_held_at
+        return self.newest_created_at or previous_cursor
+
+
+def next_sync_cursor(up_transactions, previous_cursor=None):
+    """
+    Works out where the next sync should start from, given a list of transactions fetched this run
+
+    Args:
+        up_transactions (list): Up transactions (raw or UpTransaction) fetched this run
+        previous_cursor (str): cursor used for this run, returned unchanged if nothing new was fetched
+
+    Returns:
+        str: UTC timestamp to pass as filter[since] next time
+    """
+    tracker = CursorTracker()
+    for tx in up_transactions:
+        tracker.observe(tx)
+    return tracker.cursor(previous_cursor)
+
+
+class SyncState:
+    """
+    SQLite-backed sync state, keyed by Up account id
+    """
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        # Opened once and used by one thread at a time, though not always the thread that opened it (eg. the
+        # webhook receiver's worker)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_last_synced_at(self, up_account_id):
+        """
+        Args:
+            up_account_id (str)
+
+        Returns:
+            str: createdAt of the newest synced Up transaction, or None if the account has never been synced
+        """
+        row = self.connection.execute(
+            "SELECT last_synced_at FROM account_state WHERE up_account_id = ?", (up_account_id,)).fetchone()
+        return row["last_synced_at"] if row else None
+
+    def record_sync(self, up_account_id, last_synced_at):
+        """
+        Saves progress for an account
+
+        Args:
+            up_account_id (str)
+            last_synced_at (str | datetime): createdAt of the newest synced Up transaction
+        """
+        with self.connection:
+            self.connection.execute(
+                """
+                INSERT INTO account_state (up_account_id, last_synced_at, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (up_account_id) DO UPDATE SET
+                    last_synced_at = excluded.last_synced_at,
+                    updated_at = excluded.updated_at
+                """,
+                (up_account_id, to_utc_timestamp(last_synced_at), to_utc_timestamp(datetime.now(timezone.utc))))
+
+    def get_ynab_server_knowledge(self, ynab_account_id):
+        """
+        Args:
+            ynab_account_id (str)
+
+        Returns:
+            int: server_knowledge the cached transactions are current to, or None if nothing is cached yet
+        """
+        row = self.connection.execute(
+            "SELECT server_knowledge FROM ynab_accounts WHERE ynab_account_id = ?",
+            (ynab_account_id,)).fetchone()
+        return row["server_knowledge"] if row else None
+
+    def merge_ynab_transactions(self, ynab_account_id, transactions, server_knowledge):
+        """
+        Applies a YNAB transactions response (full or delta) to the cache for an account
+        Transactions flagged as deleted are removed; everything else is inserted or replaced
+        The account's last reconciled date is kept up to date from the same response, so reading it is a lookup
+
+        Args:
+            ynab_account_id (str)
+            transactions (list): transactions from the YNAB response
+            server_knowledge (int): server_knowledge from the same response
+        """
+        deleted = [(tx["id"],) for tx in transactions if tx.get("deleted")]
+        current = [
+            (tx["id"], ynab_account_id, tx["date"], tx["amount"], tx["cleared"], tx.get("import_id"), json.dumps(tx))
+            for tx in transactions if not tx.get("deleted")
+        ]
+
+        with self.connection:
+            self.connection.executemany("DELETE FROM ynab_transactions WHERE id = ?", deleted)
+            self.connection.executemany(
+                """
+                INSERT OR REPLACE INTO ynab_transactions (id, ynab_account_id, date, amount, cleared, import_id, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                current)
+
+            # The date only moves back if the transaction it came from was deleted or un-reconciled (rare), in which
+            # case it's found again from the cache
+            last_reconciled_date = self.get_last_reconciled_date(ynab_account_id)
+            if last_reconciled_date is not None and self.connection.execute(
+                    "SELECT 1 FROM ynab_transactions WHERE ynab_account_id = ? AND date = ? AND cleared = 'reconciled'",
+                    (ynab_account_id, last_reconciled_date)).fetchone() is None:
+                last_reconciled_date = self.connection.execute(
+                    "SELECT MAX(date) FROM ynab_transactions WHERE ynab_account_id = ? AND cleared = 'reconciled'",
+                    (ynab_account_id,)).fetchone()[0]
+
+            self.connection.execute(
+                "INSERT OR REPLACE INTO ynab_accounts (ynab_account_id, server_knowledge, last_reconciled_date) "
+                "VALUES (?, ?, ?)",
+                (ynab_account_id, server_knowledge, latest_reconciled_date(transactions, last_reconciled_date)))
+
+        # Anything YNAB already holds (or once held) with an import_id doesn't need uploading again
+        self.record_imported(
+            (ynab_account_id, tx["import_id"], tx["id"]) for tx in transactions if tx.get("import_id"))
+
+    def get_last_reconciled_date(self, ynab_account_id):
+        """
+        Args:
+            ynab_account_id (str)
+
+        Returns:
+            str: date (YYYY-MM-DD) of the newest cached reconciled transaction, or None if there isn't one
+        """
+        row = self.connection.execute(
+            "SELECT last_reconciled_date FROM ynab_accounts WHERE ynab_account_id = ?",
+            (ynab_account_id,)).fetchone()
+        return row["last_reconciled_date"] if row else None
+
+    def record_imported(self, imported):
+        """
+        Adds transactions to the index of what's already in YNAB
+
+        Args:
+            imported (iterable): (ynab_account_id, import_id, ynab_transaction_id) tuples; the YNAB id may be None
+                when only the import_id is known (eg. YNAB reported it as a duplicate)
+        """
+        with self.connection:
+            self.connection.executemany(
+                """
+                INSERT INTO imported_transactions (ynab_account_id, import_id, ynab_transaction_id) VALUES (?, ?, ?)
+                ON CONFLICT (ynab_account_id, import_id) DO UPDATE SET
+                    ynab_transaction_id = COALESCE(excluded.ynab_transaction_id, ynab_transaction_id)
+                """,
+                imported)
+
+    def find_imported(self, ynab_account_id, import_ids):
+        """
+        Args:
+            ynab_account_id (str)
+            import_ids (list): import_ids to check; looked up in one query, so pass a batch at a time
+
+        Returns:
+            set: the import_ids that are already in YNAB
+        """
+        imported = set()
+        # Stay well inside SQLite's limit on the number of bound parameters
+        for start in range(0, len(import_ids), 500):
+            chunk = import_ids[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT import_id FROM imported_transactions WHERE ynab_account_id = ? "
+                f"AND import_id IN ({', '.join('?' * len(chunk))})",
+                (ynab_account_id, *chunk))
+            imported.update(row["import_id"] for row in rows)
+        return imported
+
+    def get_imported(self, import_id):
+        """
+        Args:
+            import_id (str)
+
+        Returns:
+            list: dicts of 'ynab_account_id' and 'ynab_transaction_id' (None if not known) for each YNAB account
+                holding the import_id
+        """
+        rows = self.connection.execute(
+            "SELECT ynab_account_id, ynab_transaction_id FROM imported_transactions WHERE import_id = ?",
+            (import_id,))
+        return [dict(row) for row in rows]
+
+    def forget_imported(self, ynab_account_id, import_id):
+        """
+        Removes a transaction from the index of what's in YNAB, and from the cached copy, eg. once it's deleted
+        """
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM imported_transactions WHERE ynab_account_id = ? AND import_id = ?",
+                (ynab_account_id, import_id))
+            self.connection.execute(
+                "DELETE FROM ynab_transactions WHERE ynab_account_id = ? AND import_id = ?",
+                (ynab_account_id, import_id))
+
+    def get_backfill_checkpoint(self, up_account_id, since):
+        """
+        Args:
+            up_account_id (str)
+            since (str | datetime): start of the backfill
+
+        Returns:
+            str: UTC timestamp up to which a backfill from the same start has been uploaded, or None
+        """
+        row = self.connection.execute(
+            "SELECT completed_until FROM backfill_state WHERE up_account_id = ? AND since = ?",
+            (up_account_id, to_utc_timestamp(since))).fetchone()
+        return row["completed_until"] if row else None
+
+    def record_backfill_checkpoint(self, up_account_id, since, completed_until):
+        """
+        Records that everything from since up to completed_until has been uploaded; replaces any earlier backfill
+        """
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO backfill_state (up_account_id, since, completed_until) VALUES (?, ?, ?)",
+                (up_account_id, to_utc_timestamp(since), to_utc_timestamp(completed_until)))
+
+    def record_pending_update(self, up_transaction_id):
+        """
+        Records an Up transaction whose YNAB copy couldn't be brought up to date (eg. by a webhook event), for the
+        next sync to retry
+        """
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pending_updates (up_transaction_id, recorded_at) VALUES (?, ?)",
+                (up_transaction_id, to_utc_timestamp(datetime.now(timezone.utc))))
+
+    def get_pending_updates(self):
+        """
+        Returns:
+            list: ids of the Up transactions recorded by record_pending_update(), oldest first
+        """
+        rows = self.connection.execute("SELECT up_transaction_id FROM pending_updates ORDER BY recorded_at")
+        return [row["up_transaction_id"] for row in rows]
+
+    def forget_pending_updates(self, up_transaction_ids):
+        with self.connection:
+            self.connection.executemany("DELETE FROM pending_updates WHERE up_transaction_id = ?",
+                                        [(up_transaction_id,) for up_transaction_id in up_transaction_ids])
+
+    def find_cached_transactions(self, ynab_account_id, import_ids):
+        """
+        Args:
+            ynab_account_id (str)
+            import_ids (list): import_ids to look up; pass a batch at a time
+
+        Returns:
+            dict: cached YNAB transactions keyed by import_id, for those in the cache
+        """
+        cached = {}
+        for start in range(0, len(import_ids), 500):
+            chunk = import_ids[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT import_id, data FROM ynab_transactions WHERE ynab_account_id = ? "
+                f"AND import_id IN ({', '.join('?' * len(chunk))})",
+                (ynab_account_id, *chunk))
+            cached.update((row["import_id"], json.loads(row["data"])) for row in rows)
+        return cached
+
+    def update_cached_transactions(self, transactions):
+        """
+        Refreshes cached transactions from a YNAB response that changed them (eg. a PATCH), without moving the
+        account's server_knowledge on; transactions that aren't cached are ignored
+        """
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE ynab_transactions SET date = ?, amount = ?, cleared = ?, data = ? WHERE id = ?",
+                [(tx["date"], tx["amount"], tx["cleared"], json.dumps(tx), tx["id"]) for tx in transactions])
+
+    def get_metadata_knowledge(self, budget_id, kind):
+        """
+        Args:
+            budget_id (str)
+            kind (str): 'accounts', 'payees' or 'categories'
+
+        Returns:
+            int: server_knowledge the cached metadata is current to, or None if nothing is cached yet
+        """
+        row = self.connection.execute(
+            "SELECT server_knowledge FROM ynab_metadata_knowledge WHERE budget_id = ? AND kind = ?",
+            (budget_id, kind)).fetchone()
+        return row["server_knowledge"] if row else None
+
+    def merge_metadata(self, budget_id, kind, items, server_knowledge):
+        """
+        Applies a YNAB accounts, payees or categories response (full or delta) to the cache
+        Items flagged as deleted are removed; everything else is inserted or replaced
+
+        Args:
+            budget_id (str)
+            kind (str): 'accounts', 'payees' or 'categories'
+            items (list): from the YNAB response
+            server_knowledge (int): server_knowledge from the same response
+        """
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM ynab_metadata WHERE budget_id = ? AND kind = ? AND id = ?",
+                [(budget_id, kind, item["id"]) for item in items if item.get("deleted")])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO ynab_metadata (budget_id, kind, id, data) VALUES (?, ?, ?, ?)",
+                [(budget_id, kind, item["id"], json.dumps(item)) for item in items if not item.get("deleted")])
+            self.connection.execute(
+                "INSERT OR REPLACE INTO ynab_metadata_knowledge (budget_id, kind, server_knowledge) VALUES (?, ?, ?)",
+                (budget_id, kind, server_knowledge))
+
+    def get_metadata(self, budget_id, kind):
+        """
+        Returns:
+            list: the cached accounts, payees or categories for a budget
+        """
+        rows = self.connection.execute(
+            "SELECT data FROM ynab_metadata WHERE budget_id = ? AND kind = ?", (budget_id, kind))
+        return [json.loads(row["data"]) for row in rows]
+
+    def get_daily_totals(self, ynab_account_id, since_day):
+        """
+        Args:
+            ynab_account_id (str)
+            since_day (str): YYYY-MM-DD
+
+        Returns:
+            dict: total milliunits of the cached transactions on each day from since_day, keyed by date
+        """
+        rows = self.connection.execute(
+            "SELECT date, SUM(amount) AS total FROM ynab_transactions WHERE ynab_account_id = ? AND date >= ? "
+            "GROUP BY date",
+            (ynab_account_id, since_day))
+        return {row["date"]: row["total"] for row in rows}
+
+    def get_cached_transactions_on(self, ynab_account_id, day):
+        """
+        Returns:
+            list: the cached YNAB transactions dated day (YYYY-MM-DD)
+        """
+        rows = self.connection.execute(
+            "SELECT data FROM ynab_transactions WHERE ynab_account_id = ? AND date = ?", (ynab_account_id, day))
+        return [json.loads(row["data"]) for row in rows]
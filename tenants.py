@@ -0,0 +1,225 @@
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import yaml
+from account_map import AccountMap
+from metrics import METRICS
+from rules import RuleSet
+from sync_state import SyncState
+from sync_service import SyncService
+from ynab_api import DEFAULT_BATCH_SIZE
+
+"""
+Syncing several households at once, each with its own Up token, YNAB token, budget and account map, listed in a
+tenants file:
+
+tenants:
+  - name: smith
+    up_api_key: ${SMITH_UP_API_KEY}       # ${VAR}s are read from the environment (.env), keeping tokens out
+    ynab_api_key: ${SMITH_YNAB_API_KEY}   # of the file
+    budget_id: <YNAB budget id>
+    resources: resources-smith.yaml       # account map, laid out as in resources.yaml; or list 'accounts'
+                                          # (and 'default_saver') here directly
+    state: state/smith.db                 # optional; defaults to state/<name>.db
+    rules: rules-smith.yaml               # optional payee and category rules, laid out as in rules.yaml
+
+Each tenant syncs in its own process, with its own sessions, YNAB rate limiter (tokens are limited separately) and
+sync state database, so a slow or throttled tenant never holds up the rest
+"""
+
+DEFAULT_TENANTS_PATH = "tenants.yaml"
+DEFAULT_STATE_DIR = "state"
+
+
+class Tenant:
+    """
+    One household's credentials and accounts; picklable, so it can be handed to a worker process
+
+    Args:
+        name (str)
+        up_api_key (str)
+        ynab_api_key (str)
+        budget_id (str)
+        account_map (AccountMap)
+        state_path (str): the tenant's own sync state database
+        batch_size (int): maximum number of transactions per YNAB request
+        rules (RuleSet): optional payee and category rules
+    """
+
+    def __init__(self, name, up_api_key, ynab_api_key, budget_id, account_map, state_path,
+                 batch_size=DEFAULT_BATCH_SIZE, rules=None):
+        self.name = name
+        self.up_api_key = up_api_key
+        self.ynab_api_key = ynab_api_key
+        self.budget_id = budget_id
+        self.account_map = account_map
+        self.state_path = state_path
+        self.batch_size = batch_size
+        self.rules = rules
+
+    def service(self):
+        """
+        Returns:
+            SyncService: opens the tenant's sessions and sync state; call in the process that will use them
+        """
+        state_dir = os.path.dirname(self.state_path)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        return SyncService(self.up_api_key, self.ynab_api_key, self.budget_id, self.account_map,
+                           SyncState(self.state_path), self.batch_size, name=self.name, rules=self.rules)
+
+
+def load_tenants(path=DEFAULT_TENANTS_PATH):
+    """
+    Args:
+        path (str): location of the tenants file
+
+    Returns:
+        list: Tenants
+
+    Raises:
+        ValueError: if a tenant is missing a required setting, or has an invalid rule
+    """
+    with open(path, "r") as file:
+        config = yaml.safe_load(file) or {}
+
+    base_dir = os.path.dirname(path)
+    tenants = []
+    for entry in config.get("tenants") or []:
+        entry = {key: os.path.expandvars(value) if isinstance(value, str) else value for key, value in entry.items()}
+
+        for key in ("name", "up_api_key", "ynab_api_key", "budget_id"):
+            if not entry.get(key) or "${" in str(entry[key]):
+                raise ValueError(f"Tenant {entry.get('name', len(tenants) + 1)}: {key} is missing or not set")
+
+        if entry.get("resources"):
+            account_map = AccountMap.from_yaml(os.path.join(base_dir, entry["resources"]))
+        else:
+            account_map = AccountMap.from_dict(entry)
+        if not account_map.accounts:
+            raise ValueError(f"Tenant {entry['name']}: no accounts listed")
+
+        rules = None
+        if entry.get("rules"):
+            try:
+                rules = RuleSet.from_yaml(os.path.join(base_dir, entry["rules"]))
+            except ValueError as e:
+                raise ValueError(f"Tenant {entry['name']}: {e}")
+
+        state_path = entry.get("state") or os.path.join(DEFAULT_STATE_DIR, f"{entry['name']}.db")
+        tenants.append(Tenant(
+            entry["name"], entry["up_api_key"], entry["ynab_api_key"], entry["budget_id"], account_map,
+            os.path.join(base_dir, state_path), entry.get("batch_size", DEFAULT_BATCH_SIZE), rules))
+
+    return tenants
+
+
+def sync_tenant(tenant, metrics_log=None, metrics_file=None):
+    """
+    Syncs every account of one tenant; runs in a worker process
+
+    Args:
+        tenant (Tenant)
+        metrics_log (str): where to append JSON log lines, if anywhere (see Metrics.configure_log())
+        metrics_file (str): where to write the tenant's Prometheus metrics afterwards, if anywhere
+
+    Returns:
+        dict: counts of 'created', 'skipped' and 'failed' transactions, and accounts that 'errored'
+    """
+    if metrics_log:
+        METRICS.configure_log(metrics_log)
+
+    with tenant.service() as service:
+        results = service.sync_all()
+    if metrics_file:
+        METRICS.write_prometheus(metrics_file)
+
+    summary = {"created": 0, "skipped": 0, "failed": 0, "errored": 0}
+    for account_results in results.values():
+        if account_results is None:
+            summary["errored"] += 1
+            continue
+        summary["created"] += len(account_results["created"])
+        summary["skipped"] += len(account_results["skipped"]) + len(account_results["duplicates"])
+        summary["failed"] += len(account_results["failed"])
+    return summary
+
+
+def sync_tenants(tenants, max_workers=None, metrics_log=None, metrics_file=None):
+    """
+    Syncs tenants in parallel, one process each (up to max_workers at a time)
+
+    Args:
+        tenants (list): Tenants
+        max_workers (int): defaults to one process per tenant
+        metrics_log (str): where each tenant appends its JSON log lines, if anywhere
+        metrics_file (str): Prometheus metrics file, written per tenant (see tenant_metrics_file())
+
+    Returns:
+        dict: sync_tenant() summaries keyed by tenant name; None for a tenant whose sync crashed
+    """
+    summaries = {}
+    with ProcessPoolExecutor(max_workers=max_workers or len(tenants) or 1) as executor:
+        futures = {
+            executor.submit(sync_tenant, tenant, metrics_log,
+                            tenant_metrics_file(metrics_file, tenant.name) if metrics_file else None): tenant.name
+            for tenant in tenants
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                summaries[name] = future.result()
+                print(f"[{name}] done: {summaries[name]}")
+            except Exception as e:
+                print(f"[{name}] sync failed: {e}")
+                summaries[name] = None
+    return summaries
+
+
+def _run_tenant_daemon(tenant, interval, jitter, metrics_file, metrics_port, metrics_log):
+    if metrics_log:
+        METRICS.configure_log(metrics_log)
+    with tenant.service() as service:
+        service.run_daemon(interval, jitter, metrics_file, metrics_port)
+
+
+def tenant_metrics_file(metrics_file, tenant_name):
+    """
+    Each tenant's process keeps its own metrics, so each writes its own file: {tenant} in the path is replaced with
+    the tenant's name, or the name is added before the extension, eg. metrics.prom -> metrics.smith.prom
+    """
+    if "{tenant}" in metrics_file:
+        return metrics_file.replace("{tenant}", tenant_name)
+    root, extension = os.path.splitext(metrics_file)
+    return f"{root}.{tenant_name}{extension}"
+
+
+def run_tenant_daemons(tenants, interval, jitter=0, metrics_file=None, metrics_port=None, metrics_log=None):
+    """
+    Runs a daemon (see SyncService.run_daemon()) per tenant, each in its own process, until SIGINT or SIGTERM;
+    the signal is passed on so each finishes the sync in progress
+    Metrics files are per tenant (see tenant_metrics_file()), and tenants serve metrics on consecutive ports from
+    metrics_port, in the order they're listed
+    """
+    processes = []
+    for index, tenant in enumerate(tenants):
+        args = (tenant, interval, jitter,
+                tenant_metrics_file(metrics_file, tenant.name) if metrics_file else None,
+                metrics_port + index if metrics_port is not None else None,
+                metrics_log)
+        processes.append(multiprocessing.Process(target=_run_tenant_daemon, args=args, name=tenant.name))
+
+    for process in processes:
+        process.start()
+
+    def stop(*_):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, stop)
+
+    for process in processes:
+        process.join()
@@ -0,0 +1,59 @@
+import os
+from datetime import date, timedelta
+import pytest
+import archive
+from archive import UpArchive
+from conftest import CREATED_AT, up_transaction
+
+"""
+Appending to and reading from the columnar transaction archive (see archive.py)
+"""
+
+
+def test_round_trip(tmp_path):
+    up_archive = UpArchive(str(tmp_path))
+    page = [
+        up_transaction("b", cents=-2000, days=2, category_id="groceries"),
+        up_transaction("a", cents=-1000, days=1),
+        up_transaction("c", cents=50000, days=40, account_id="up-savings"),
+        up_transaction("held", cents=-300, status="HELD"),
+    ]
+
+    assert up_archive.append(page) == 3
+    assert up_archive.append(page) == 0
+
+    columns = up_archive.query()
+    assert columns.accounts == ["up-savings", "up-spending"]
+    assert list(columns.amount_cents) == [50000, -1000, -2000]
+    assert [columns.categories[code] for code in columns.category] == [None, None, "groceries"]
+    assert date.fromordinal(columns.date[1]) == date(2025, 3, 2)
+    assert [tx["id"] for tx in up_archive.iter_raw("up-spending", "2025-03")] == ["a", "b"]
+
+    march = up_archive.query(CREATED_AT, CREATED_AT + timedelta(days=2), ["up-spending"])
+    assert list(march.amount_cents) == [-1000]
+
+
+def test_interrupted_append_leaves_the_partition_as_it_was(tmp_path, monkeypatch):
+    up_archive = UpArchive(str(tmp_path))
+    up_archive.append([up_transaction("a", cents=-1000, days=5)])
+    partition_path = os.path.join(str(tmp_path), "up-spending", "2025-03")
+    files = len(os.listdir(partition_path))
+
+    def crash(source, destination):
+        raise OSError("interrupted")
+
+    # The append is interrupted just before index.json is replaced, once the new generation is fully written
+    monkeypatch.setattr(archive.os, "replace", crash)
+    with pytest.raises(OSError):
+        up_archive.append([up_transaction("b", cents=-2000, days=1)])
+    monkeypatch.undo()
+
+    # Nothing of the append is visible
+    assert list(up_archive.query().amount_cents) == [-1000]
+    assert [tx["id"] for tx in up_archive.iter_raw("up-spending", "2025-03")] == ["a"]
+
+    # The next append writes over whatever an interrupted one left, and clears the rest away
+    up_archive.append([up_transaction("b", cents=-2000, days=1)])
+    assert list(up_archive.query().amount_cents) == [-2000, -1000]
+    assert [tx["id"] for tx in up_archive.iter_raw("up-spending", "2025-03")] == ["b", "a"]
+    assert len(os.listdir(partition_path)) == files
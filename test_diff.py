@@ -0,0 +1,50 @@
+from datetime import date
+from diff import transaction_changes
+from models import YnabSubtransaction, YnabTransaction
+
+"""
+Which fields a sync PATCHes on transactions already in YNAB (see diff.py)
+"""
+
+
+def fresh(**fields):
+    return YnabTransaction(**{"account_id": "ynab-spending", "date": date(2025, 3, 1), "amount": -12000,
+                              "payee_name": "Cafe", "memo": "Up Bank: SQ *CAFE", "import_id": "up-1", **fields})
+
+
+def cached(**fields):
+    return {"id": "ynab-1", "date": "2025-03-01", "amount": -12000, "payee_name": "Cafe", "import_payee_name": "Cafe",
+            "memo": "Up Bank: SQ *CAFE", "cleared": "cleared", "category_id": None, **fields}
+
+
+def test_unchanged_transaction_is_left_alone():
+    assert transaction_changes(fresh(), cached()) == {}
+
+
+def test_settled_amount_and_date_are_sent():
+    changes = transaction_changes(fresh(amount=-13000, date=date(2025, 3, 2)), cached(cleared="uncleared"))
+
+    assert changes == {"amount": -13000, "date": "2025-03-02", "cleared": "cleared"}
+
+
+def test_memo_edited_in_ynab_is_kept():
+    assert transaction_changes(fresh(), cached(memo="Birthday lunch")) == {}
+
+
+def test_renamed_payee_is_kept_until_up_renames():
+    assert transaction_changes(fresh(), cached(payee_name="Local Cafe")) == {}
+    assert transaction_changes(fresh(payee_name="Cafe Two"), cached(payee_name="Local Cafe")) == {
+        "payee_name": "Cafe Two"}
+
+
+def test_reconciled_and_split_amounts_are_left_alone():
+    assert transaction_changes(fresh(amount=-13000), cached(cleared="reconciled")) == {}
+    assert transaction_changes(fresh(amount=-13000), cached(subtransactions=[{"amount": -12000}])) == {}
+
+
+def test_unsplit_copy_of_a_round_up_keeps_its_amount():
+    split = fresh(amount=-12500, subtransactions=[YnabSubtransaction(amount=-12000, payee_name="Cafe"),
+                                                  YnabSubtransaction(amount=-500, memo="Round Up")])
+
+    assert transaction_changes(split, cached()) == {}
+    assert transaction_changes(split, cached(cleared="uncleared")) == {"cleared": "cleared"}
@@ -0,0 +1,190 @@
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+import http_client
+from http_client import RetryingSession, TokenBucket, backoff_delay, retry_after_seconds
+from replay_cache import OfflineCacheMiss, ReplayCache
+
+"""
+Rate limiting, Retry-After and backoff, which failures are retried, and when the replay cache answers (see
+http_client.py)
+"""
+
+URL = "https://api.example.com/resource"
+
+
+class Clock:
+    # Stands in for time.monotonic() and time.sleep(), so waits are recorded rather than slept
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ScriptedAdapter(BaseAdapter):
+    """
+    Answers each request with the next outcome: a (status, headers[, body]) tuple, or an exception to raise
+    """
+
+    def __init__(self, outcomes):
+        super().__init__()
+        self.outcomes = list(outcomes)
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        self.sent += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        status, headers = outcome[:2]
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response._content = outcome[2] if len(outcome) > 2 else b"{}"
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(http_client.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(http_client.time, "sleep", clock.sleep)
+    # The longest backoff allowed, so the delays are predictable
+    monkeypatch.setattr(http_client.random, "uniform", lambda low, high: high)
+    return clock
+
+
+def scripted_session(outcomes, max_retries=3, cache=None):
+    adapter = ScriptedAdapter(outcomes)
+    session = RetryingSession(max_retries=max_retries, backoff_base=1, backoff_cap=60, cache=cache)
+    session.mount("https://", adapter)
+    return session, adapter
+
+
+def connection_refused():
+    reason = NewConnectionError(None, "Connection refused")
+    return requests.exceptions.ConnectionError(MaxRetryError(None, URL, reason))
+
+
+def test_token_bucket_allows_a_burst_then_spaces_requests(clock):
+    bucket = TokenBucket(2, 10)
+
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert sum(clock.sleeps) == pytest.approx(5)
+
+
+def test_token_bucket_follows_the_servers_remaining_limit(clock):
+    bucket = TokenBucket(200, 3600)
+
+    bucket.limit_remaining(0)
+    bucket.acquire()
+
+    assert sum(clock.sleeps) == pytest.approx(18)
+
+
+def test_retry_after_in_seconds_or_as_a_date():
+    def response(headers):
+        response = requests.Response()
+        response.headers.update(headers)
+        return response
+
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+
+    assert retry_after_seconds(response({"Retry-After": "7"})) == 7
+    assert 25 < retry_after_seconds(response({"Retry-After": format_datetime(retry_at, usegmt=True)})) <= 30
+    assert retry_after_seconds(response({"Retry-After": "soon"})) is None
+    assert retry_after_seconds(response({})) is None
+
+
+def test_backoff_doubles_up_to_the_cap(clock):
+    assert [backoff_delay(attempt, base=1, cap=5) for attempt in range(5)] == [1, 2, 4, 5, 5]
+
+
+def test_retry_after_is_waited_for(clock):
+    session, adapter = scripted_session([(503, {"Retry-After": "7"}), (200, {})])
+
+    assert session.get(URL).status_code == 200
+    assert adapter.sent == 2
+    assert clock.sleeps == [7]
+
+
+def test_backoff_without_retry_after(clock):
+    session, adapter = scripted_session([(502, {}), (502, {}), (200, {})])
+
+    assert session.get(URL).status_code == 200
+    assert clock.sleeps == [1, 2]
+
+
+def test_last_response_is_returned_once_retries_run_out(clock):
+    session, adapter = scripted_session([(503, {})] * 3, max_retries=2)
+
+    assert session.get(URL).status_code == 503
+    assert adapter.sent == 3
+
+
+def test_post_is_retried_after_429_but_not_5xx(clock):
+    session, adapter = scripted_session([(429, {"Retry-After": "1"}), (200, {})])
+    assert session.post(URL).status_code == 200
+    assert adapter.sent == 2
+
+    session, adapter = scripted_session([(502, {}), (200, {})])
+    assert session.post(URL).status_code == 502
+    assert adapter.sent == 1
+
+
+def test_post_is_retried_only_when_it_never_connected(clock):
+    session, adapter = scripted_session([connection_refused(), (200, {})])
+    assert session.post(URL).status_code == 200
+    assert adapter.sent == 2
+
+    session, adapter = scripted_session([requests.exceptions.ReadTimeout("read timed out"), (200, {})])
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        session.post(URL)
+    assert adapter.sent == 1
+
+    session, adapter = scripted_session([requests.exceptions.ReadTimeout("read timed out"), (200, {})])
+    assert session.get(URL).status_code == 200
+
+
+def test_online_cache_is_only_used_when_a_request_fails(clock, tmp_path):
+    cache = ReplayCache(str(tmp_path))
+    session, adapter = scripted_session([(200, {}, b"old"), (200, {}, b"new")], cache=cache)
+    assert session.get(URL).content == b"old"
+    assert session.get(URL).content == b"new"
+    assert adapter.sent == 2
+
+    session, adapter = scripted_session([(503, {})] * 2, max_retries=1, cache=cache)
+    assert session.get(URL).content == b"new"
+
+    session, adapter = scripted_session([connection_refused()] * 2, max_retries=1, cache=cache)
+    assert session.get(URL).content == b"new"
+
+
+def test_offline_cache_answers_everything(tmp_path):
+    cache = ReplayCache(str(tmp_path))
+    scripted_session([(200, {}, b"cached")], cache=cache)[0].get(URL)
+
+    cache.offline = True
+    session, adapter = scripted_session([], cache=cache)
+    assert session.get(URL).content == b"cached"
+    with pytest.raises(OfflineCacheMiss):
+        session.get(f"{URL}/other")
+    assert adapter.sent == 0
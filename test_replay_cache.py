@@ -0,0 +1,33 @@
+import os
+import requests
+from replay_cache import ReplayCache
+
+"""
+Keeping the replay cache within its size cap (see replay_cache.py)
+"""
+
+URL = "https://api.example.com/resource"
+
+
+def ok(body):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    return response
+
+
+def test_responses_and_pointers_are_evicted_within_the_cap(tmp_path):
+    cache = ReplayCache(str(tmp_path), max_bytes=2000)
+    for page in range(50):
+        cache.put("GET", f"{URL}/{page}", ok(b"x" * 100))
+
+    files = os.listdir(str(tmp_path))
+    assert cache.total_bytes == sum(os.path.getsize(os.path.join(str(tmp_path), name)) for name in files)
+    assert cache.total_bytes <= 2000
+    assert 0 < sum(name.endswith(".latest") for name in files) < 50
+
+    # The newest response is still there, and found through its pointer offline
+    cache.offline = True
+    assert cache.get("GET", f"{URL}/49", {"filter[since]": "2025-03-01"}).content == b"x" * 100
+    assert cache.get("GET", f"{URL}/0") is None
+    assert ReplayCache(str(tmp_path)).total_bytes == cache.total_bytes
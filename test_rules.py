@@ -0,0 +1,84 @@
+from datetime import datetime, timezone
+import pytest
+from models import UpTransaction
+from rules import RuleSet
+
+"""
+Rule precedence and validation (see rules.py)
+"""
+
+
+def up_transaction(description, raw_text=None, category_id=None):
+    return UpTransaction(id="up-1", account_id="up-spending", status="SETTLED",
+                         created_at=datetime(2025, 3, 1, tzinfo=timezone.utc), amount_cents=-1000,
+                         currency_code="AUD", description=description, raw_text=raw_text, category_id=category_id)
+
+
+def test_first_rule_listed_wins_wherever_it_matches():
+    rules = RuleSet([
+        {"match": "WOOLWORTHS", "payee": "Groceries"},
+        {"match": "Uber", "payee": "Uber"},
+    ])
+
+    assert rules.apply(up_transaction("Uber Eats Woolworths")) == ("Groceries", None)
+    assert rules.apply(up_transaction("Uber trip")) == ("Uber", None)
+
+
+def test_first_rule_listed_wins_over_a_longer_text():
+    rules = RuleSet([
+        {"match": "WOOL", "payee": "Wool"},
+        {"match": "WOOLWORTHS", "payee": "Groceries"},
+    ])
+
+    assert rules.apply(up_transaction("Woolworths Metro")) == ("Wool", None)
+
+
+def test_patterns_and_plain_text_keep_the_listed_order():
+    rules = RuleSet([
+        {"match": "^Uber", "payee": "Uber"},
+        {"match": "Eats", "payee": "Food"},
+        {"match": "^Coles\\b", "payee": "Groceries"},
+    ])
+
+    assert rules.apply(up_transaction("Uber Eats")) == ("Uber", None)
+    assert rules.apply(up_transaction("Menulog Eats")) == ("Food", None)
+    assert rules.apply(up_transaction("Coles Eats")) == ("Food", None)
+    assert rules.apply(up_transaction("Coles Express")) == ("Groceries", None)
+    assert rules.apply(up_transaction("Nothing")) == (None, None)
+
+
+def test_payee_and_category_are_found_separately_across_fields():
+    rules = RuleSet([
+        {"match": "restaurants-and-cafes", "field": "category", "category_id": "ynab-eating-out"},
+        {"match": "SQ \\*", "field": "raw_text", "payee": "Square"},
+        {"match": "Cafe", "payee": "Cafe", "category_id": "ynab-coffee"},
+    ])
+
+    assert rules.apply(up_transaction("Cafe", "SQ *CAFE", "restaurants-and-cafes")) == ("Square", "ynab-eating-out")
+    assert rules.apply(up_transaction("Cafe")) == ("Cafe", "ynab-coffee")
+
+
+def test_patterns_that_cant_be_joined_still_match():
+    rules = RuleSet([
+        {"match": "(?i)^bp\\b", "payee": "BP"},
+        {"match": "(a)\\1", "payee": "Double A"},
+        {"match": "(?P<shop>Kmart) (?P=shop)", "payee": "Kmart"},
+        {"match": "Caltex", "payee": "Caltex"},
+    ])
+
+    assert rules.apply(up_transaction("BP Connect")) == ("BP", None)
+    assert rules.apply(up_transaction("Baar")) == ("Double A", None)
+    assert rules.apply(up_transaction("Kmart Kmart")) == ("Kmart", None)
+    assert rules.apply(up_transaction("Caltex Kmart")) == ("Caltex", None)
+
+
+@pytest.mark.parametrize("rule, message", [
+    ({"payee": "X"}, "Rule 2 has no 'match' pattern"),
+    ({"match": "(", "payee": "X"}, "Rule 2 has an invalid pattern"),
+    ({"match": "a", "field": "merchant_name", "payee": "X"}, "Rule 2 has an unknown field 'merchant_name'"),
+    ({"match": "a"}, "Rule 2 sets neither 'payee' nor 'category_id'"),
+    ({"match": "a(?i)b", "payee": "X"}, "Rule 2 has an invalid pattern"),
+])
+def test_invalid_rules_are_named(rule, message):
+    with pytest.raises(ValueError, match=message.replace("(", "\\(")):
+        RuleSet([{"match": "Uber", "payee": "Uber"}, rule])
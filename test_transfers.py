@@ -0,0 +1,103 @@
+from account_map import AccountMap
+from conftest import up_transaction
+from transfers import pair_transfers, plan_transfers
+from transform import transform_to_ynab_format
+
+"""
+Pairing and planning of transfers between Up accounts (see transfers.py)
+"""
+
+ACCOUNT_MAP = AccountMap([
+    {"name": "Spending", "up": {"id": "up-spending"}, "ynab": {"id": "ynab-spending"}},
+    {"name": "Savings", "up": {"id": "up-savings"}, "ynab": {"id": "ynab-savings"}},
+], default_saver_ynab_id="ynab-default-saver")
+
+TRANSFER_PAYEE_IDS = {
+    "ynab-spending": "payee-spending",
+    "ynab-savings": "payee-savings",
+    "ynab-default-saver": "payee-default-saver",
+}
+
+
+def test_pairs_legs_within_the_window():
+    outgoing = up_transaction("out", "up-spending", -5000, "up-savings")
+    incoming = up_transaction("in", "up-savings", 5000, "up-spending", seconds=30)
+    late = up_transaction("late", "up-savings", 5000, "up-spending", seconds=3600)
+
+    pairs, unpaired = pair_transfers([incoming, late, outgoing])
+
+    assert [(tx.id, partner.id) for tx, partner in pairs] == [("out", "in")]
+    assert [tx.id for tx in unpaired] == ["late"]
+
+
+def test_pairs_only_matching_amounts():
+    outgoing = up_transaction("out", "up-spending", -5000, "up-savings")
+    incoming = up_transaction("in", "up-savings", 3000, "up-spending")
+
+    pairs, unpaired = pair_transfers([outgoing, incoming])
+
+    assert pairs == []
+    assert {tx.id for tx in unpaired} == {"out", "in"}
+
+
+def test_paired_transfer_is_sent_once():
+    outgoing = up_transaction("out", "up-spending", -5000, "up-savings")
+    incoming = up_transaction("in", "up-savings", 5000, "up-spending", seconds=1)
+
+    plan = plan_transfers([outgoing, incoming], ACCOUNT_MAP, TRANSFER_PAYEE_IDS)
+    ynab_transactions = transform_to_ynab_format([outgoing, incoming], account_map=ACCOUNT_MAP,
+                                                 transfer_plan=plan)
+
+    assert plan.payee_ids == {"out": "payee-savings"}
+    assert plan.suppressed == {"in": "out"}
+    assert [(tx.account_id, tx.amount, tx.payee_id) for tx in ynab_transactions] == [
+        ("ynab-spending", -50000, "payee-savings")]
+
+
+def test_unpaired_incoming_leg_from_a_synced_account_is_suppressed():
+    incoming = up_transaction("in", "up-savings", 5000, "up-spending")
+
+    plan = plan_transfers([incoming], ACCOUNT_MAP, TRANSFER_PAYEE_IDS, {"up-spending", "up-savings"})
+
+    assert plan.suppressed == {"in": None}
+    assert plan.payee_ids == {}
+
+
+def test_incoming_leg_from_an_unlisted_saver_is_a_transfer():
+    # The saver isn't listed, so it syncs to the default saver and its outgoing leg is never sent
+    outgoing = up_transaction("out", "up-spending", -50000, "up-holiday")
+    incoming = up_transaction("in", "up-spending", 30000, "up-holiday", seconds=600)
+
+    plan = plan_transfers([outgoing, incoming], ACCOUNT_MAP, TRANSFER_PAYEE_IDS, set(ACCOUNT_MAP.by_up_id))
+    ynab_transactions = transform_to_ynab_format([outgoing, incoming], account_map=ACCOUNT_MAP,
+                                                 transfer_plan=plan)
+
+    assert plan.suppressed == {}
+    assert [(tx.amount, tx.payee_id) for tx in ynab_transactions] == [
+        (-500000, "payee-default-saver"), (300000, "payee-default-saver")]
+
+
+def test_unlisted_transactional_account_is_not_a_saver():
+    account_map = AccountMap([{"name": "Spending", "up": {"id": "up-spending"}, "ynab": {"id": "ynab-spending"}}],
+                             default_saver_ynab_id="ynab-default-saver")
+    account_map.set_up_accounts([{"id": "up-2up", "attributes": {"accountType": "TRANSACTIONAL"}}])
+    outgoing = up_transaction("out", "up-spending", -5000, "up-2up")
+
+    plan = plan_transfers([outgoing], account_map, TRANSFER_PAYEE_IDS)
+
+    assert plan.payee_ids == {}
+    assert account_map.ynab_id_for_up("up-2up") is None
+    assert account_map.ynab_id_for_up("up-holiday") == "ynab-default-saver"
+
+
+def test_legs_within_one_ynab_account_cancel_out():
+    account_map = AccountMap([
+        {"name": "Saver 1", "up": {"id": "up-saver-1"}, "ynab": {"id": "ynab-savings"}},
+        {"name": "Saver 2", "up": {"id": "up-saver-2"}, "ynab": {"id": "ynab-savings"}},
+    ])
+    outgoing = up_transaction("out", "up-saver-1", -5000, "up-saver-2")
+    incoming = up_transaction("in", "up-saver-2", 5000, "up-saver-1")
+
+    plan = plan_transfers([outgoing, incoming], account_map, TRANSFER_PAYEE_IDS)
+
+    assert plan.suppressed == {"out": "in", "in": "out"}
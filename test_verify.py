@@ -0,0 +1,97 @@
+from account_map import AccountMap
+from conftest import up_transaction
+from transfers import plan_transfers
+from transform import transform_to_ynab_format
+from verify import bisect_drift, compare_day, expected_daily_totals
+
+"""
+Finding where YNAB drifted from Up (see verify.py)
+"""
+
+DAY = "2025-03-01"
+
+TRANSFER_PAYEE_IDS = {
+    "ynab-spending": "payee-spending",
+    "ynab-savings": "payee-savings",
+}
+TRANSFER_ACCOUNTS = {payee_id: ynab_id for ynab_id, payee_id in TRANSFER_PAYEE_IDS.items()}
+
+
+def account_map(round_up_ynab_id="ynab-savings"):
+    return AccountMap.from_dict({
+        "accounts": [
+            {"name": "Spending", "up": {"id": "up-spending"}, "ynab": {"id": "ynab-spending"}},
+            {"name": "Savings", "up": {"id": "up-savings"}, "ynab": {"id": "ynab-savings"}},
+        ],
+        "round_up_saver": {"ynab": {"id": round_up_ynab_id}},
+    })
+
+
+def synced(up_transactions, accounts):
+    plan = plan_transfers(up_transactions, accounts, TRANSFER_PAYEE_IDS, set(accounts.by_up_id))
+    return transform_to_ynab_format(up_transactions, account_map=accounts, transfer_plan=plan)
+
+
+def test_bisect_finds_the_day_the_balances_parted():
+    days = ["2025-03-01", "2025-03-02", "2025-03-03", "2025-03-04", "2025-03-05"]
+    up_totals = {day: -10000 for day in days}
+    ynab_totals = dict(up_totals, **{"2025-03-03": -7000})
+
+    index, comparisons = bisect_drift(days, up_totals, ynab_totals, -3000)
+
+    assert days[index] == "2025-03-03"
+    assert comparisons <= 4
+
+
+def test_bisect_reports_a_difference_older_than_the_first_day():
+    days = ["2025-03-01", "2025-03-02"]
+    totals = {day: -10000 for day in days}
+
+    assert bisect_drift(days, totals, totals, -3000) == (None, 1)
+
+
+def test_round_up_into_the_same_account_is_left_out():
+    accounts = account_map(round_up_ynab_id="ynab-spending")
+    expected = synced([up_transaction("coffee", "up-spending", -450, round_up_cents=-50)], accounts)
+
+    assert expected_daily_totals(expected, "ynab-spending", TRANSFER_ACCOUNTS) == {DAY: -4500}
+
+
+def test_round_up_into_a_saver_moves_both_balances():
+    accounts = account_map()
+    expected = synced([up_transaction("coffee", "up-spending", -450, round_up_cents=-50)], accounts)
+
+    assert expected_daily_totals(expected, "ynab-spending", TRANSFER_ACCOUNTS) == {DAY: -5000}
+    assert expected_daily_totals(expected, "ynab-savings", TRANSFER_ACCOUNTS) == {DAY: 500}
+
+
+def test_suppressed_incoming_leg_counts_through_its_outgoing_leg():
+    accounts = account_map()
+    expected = synced([
+        up_transaction("out", "up-spending", -5000, "up-savings"),
+        up_transaction("in", "up-savings", 5000, "up-spending", seconds=30),
+    ], accounts)
+
+    assert expected_daily_totals(expected, "ynab-savings", TRANSFER_ACCOUNTS) == {DAY: 50000}
+
+    savings = [tx for tx in expected if tx.account_id == "ynab-savings"]
+    ynab_counterpart = {"id": "y1", "import_id": None, "amount": 50000, "transfer_account_id": "ynab-spending"}
+    assert compare_day(DAY, savings, [ynab_counterpart]) == {"missing": [], "differ": [], "unmatched": []}
+
+
+def test_compare_day_lists_missing_and_differing_transactions():
+    accounts = account_map()
+    expected = synced([
+        up_transaction("rent", "up-spending", -100000),
+        up_transaction("coffee", "up-spending", -450),
+    ], accounts)
+    ynab = [
+        {"id": "y1", "import_id": "coffee", "amount": -4000},
+        {"id": "y2", "import_id": None, "amount": -2000},
+    ]
+
+    details = compare_day(DAY, expected, ynab)
+
+    assert [tx.import_id for tx in details["missing"]] == ["rent"]
+    assert [(tx.import_id, ynab_tx["id"]) for tx, ynab_tx in details["differ"]] == [("coffee", "y1")]
+    assert [ynab_tx["id"] for ynab_tx in details["unmatched"]] == ["y2"]
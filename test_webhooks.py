@@ -0,0 +1,80 @@
+import pytest
+import up_api
+import ynab_api
+from mock_server import MockServer, MockState, MockWebhookSource
+from sync_state import SyncState
+from webhooks import WebhookProcessor, WebhookServer
+
+"""
+Pushing Up webhook events to YNAB, driven by the simulated event source against the mock APIs (see webhooks.py
+and mock_server.py)
+"""
+
+SECRET_KEY = "webhook-secret"
+UP_ACCOUNT_ID = "up-account-0"
+YNAB_ACCOUNT_ID = f"ynab-{UP_ACCOUNT_ID}"
+
+
+@pytest.fixture
+def mock(monkeypatch, tmp_path):
+    state = MockState(transactions=0)
+    server = MockServer(state).start()
+    monkeypatch.setattr(up_api, "UP_API_URL", server.up_url)
+    monkeypatch.setattr(ynab_api, "YNAB_API_URL", server.ynab_url)
+
+    sync_state = SyncState(str(tmp_path / "state.db"))
+    processor = WebhookProcessor(up_api.create_session("up-key"), ynab_api.create_session("ynab-key"),
+                                 state.budget_id, sync_state, ynab_account_id=YNAB_ACCOUNT_ID)
+    receiver = WebhookServer(processor, SECRET_KEY).start()
+    try:
+        yield state, receiver, sync_state
+    finally:
+        receiver.stop()
+        server.stop()
+        sync_state.close()
+
+
+def ynab_copy(state, tx_id):
+    return state.ynab_transactions[state.ynab_import_ids[tx_id[:36]]]
+
+
+def test_held_settled_and_deleted_events(mock):
+    state, receiver, sync_state = mock
+    source = MockWebhookSource(state, receiver.url, SECRET_KEY)
+
+    tx_id = source.create(UP_ACCOUNT_ID, -1000)
+    receiver.join()
+    assert state.request_counts["ynab_post_transactions"] == 1
+    assert ynab_copy(state, tx_id)["amount"] == -10000
+    assert ynab_copy(state, tx_id)["cleared"] == "uncleared"
+    # Kept until it settles, in case the TRANSACTION_SETTLED event never arrives
+    assert sync_state.get_pending_updates() == [tx_id]
+
+    assert source.settle(tx_id, cents=-1200) == 200
+    receiver.join()
+    assert state.request_counts["ynab_patch_transactions"] == 1
+    assert ynab_copy(state, tx_id)["amount"] == -12000
+    assert ynab_copy(state, tx_id)["cleared"] == "cleared"
+    assert sync_state.get_pending_updates() == []
+
+    assert source.delete(tx_id) == 200
+    receiver.join()
+    assert state.request_counts["ynab_delete_transaction"] == 1
+    assert ynab_copy(state, tx_id)["deleted"]
+    assert sync_state.get_imported(tx_id[:36]) == []
+
+    assert list(receiver.results) == ["created", "updated", "deleted"]
+
+
+def test_events_with_a_bad_signature_are_rejected(mock):
+    state, receiver, sync_state = mock
+    tx_id = MockWebhookSource(state, receiver.url, SECRET_KEY).create(UP_ACCOUNT_ID, -1000)
+    receiver.join()
+
+    forged = MockWebhookSource(state, receiver.url, "not-the-secret")
+    assert forged.settle(tx_id, cents=-5000) == 401
+    receiver.join()
+
+    assert list(receiver.results) == ["created"]
+    assert "ynab_patch_transactions" not in state.request_counts
+    assert ynab_copy(state, tx_id)["amount"] == -10000
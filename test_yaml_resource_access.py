@@ -1,33 +1,24 @@
 import os
-import yaml
+from account_map import AccountMap
 
 """
 Testing how to access resources stored in a yaml
 Will use to link static account information between Up and YNAB
+The yaml is parsed once into an AccountMap, which indexes accounts by Up ID, YNAB ID and name
 """
 
 # Load resources.yaml
-with open("resources.yaml", "r") as file:
-    resources = yaml.safe_load(file)
+account_map = AccountMap.from_yaml("resources.yaml")
 
-accounts = resources['accounts']
-# print(accounts)
-# print(type(accounts))
-
-# print(accounts[0])
-
-for account in accounts:
+for account in account_map.accounts:
     up_name = account['name']
     up_id = account['up']['id']
     ynab_id = account['ynab']['id']
     print(f"Up name: {up_name}; Up ID: {up_id}; YNAB ID: {ynab_id}")
 
 # How can I use it to find a YNAB account id, given an Up account id?
-query = accounts[0]['up']['id']
-for account in accounts:
-    if(account['up']['id'] == query):
-        budget_id = account['ynab']['id']
-        break
+query = account_map.accounts[0]['up']['id']
+budget_id = account_map.ynab_id_for_up(query)
 
 if budget_id:
     print(f"The YNAB id for Up account {query} is: {budget_id}")
@@ -0,0 +1,139 @@
+from datetime import timedelta
+from models import UpTransaction
+
+"""
+Pairing the two legs of transfers between Up accounts, so each transfer reaches YNAB exactly once
+
+A transfer from Spending to a saver shows up in Up twice: -$50 in Spending (transferAccount: the saver) and +$50 in
+the saver (transferAccount: Spending), created within moments of each other. YNAB represents a transfer as one
+transaction whose payee is the other account's transfer payee, and creates the opposite side itself. So:
+ - the outgoing leg is sent as a YNAB transfer, using the target YNAB account's transfer_payee_id
+ - the incoming leg is suppressed, since YNAB creates it from the outgoing one
+Legs are matched by hashing on (account, transfer account, amount) and a time bucket, so pairing is one pass over
+the transactions rather than a search of every leg against every other
+
+An incoming leg whose outgoing leg wasn't fetched is only suppressed if its source account is one being synced
+(its outgoing leg is, or will be, sent from there); otherwise, as for a saver that isn't listed and so syncs to the
+default saver, the incoming leg is sent as the transfer itself, and YNAB creates the other side
+
+Round Ups are transfers too, though Up records them on the purchase rather than as a leg of their own; the plan
+holds the Round Up saver's transfer payee, which the transform uses for each purchase's Round Up line
+"""
+
+DEFAULT_PAIRING_WINDOW = timedelta(minutes=5)
+
+
+def pair_transfers(up_transactions, window=DEFAULT_PAIRING_WINDOW):
+    """
+    Matches the two legs of each inter-account transfer
+
+    Args:
+        up_transactions (iterable): UpTransactions (or raw Up JSON) from any number of accounts
+        window (timedelta): how far apart the two legs' createdAt may be
+
+    Returns:
+        tuple: (list of (outgoing, incoming) UpTransaction pairs, list of unpaired transfer legs)
+    """
+    bucket_seconds = window.total_seconds()
+    waiting = {}
+    pairs = []
+
+    for tx in up_transactions:
+        tx = UpTransaction.coerce(tx)
+        if tx.transfer_account_id is None:
+            continue
+
+        bucket = int(tx.created_at.timestamp() // bucket_seconds)
+        partner_key = (tx.transfer_account_id, tx.account_id, -tx.amount_cents)
+
+        partner = None
+        for nearby in (bucket, bucket - 1, bucket + 1):
+            candidates = waiting.get((partner_key, nearby), [])
+            for position, candidate in enumerate(candidates):
+                if abs(candidate.created_at - tx.created_at) <= window:
+                    partner = candidates.pop(position)
+                    break
+            if partner is not None:
+                break
+
+        if partner is None:
+            waiting.setdefault(((tx.account_id, tx.transfer_account_id, tx.amount_cents), bucket), []).append(tx)
+        elif tx.amount_cents < 0:
+            pairs.append((tx, partner))
+        else:
+            pairs.append((partner, tx))
+
+    unpaired = [tx for candidates in waiting.values() for tx in candidates]
+    return pairs, unpaired
+
+
+class TransferPlan:
+    """
+    How each transfer leg should reach YNAB; consulted by the transform
+
+    Attributes:
+        payee_ids (dict): Up transaction id -> transfer payee id, for legs to send as YNAB transfers
+        suppressed (dict): Up transaction id -> id of the leg that stands in for it (or None), for legs not to send
+        pairs (list): matched (outgoing, incoming) legs
+        round_up (tuple): (YNAB account id, transfer payee id) of the Round Up saver, if it's mapped
+    """
+
+    def __init__(self):
+        self.payee_ids = {}
+        self.suppressed = {}
+        self.pairs = []
+        self.round_up = None
+
+
+def plan_transfers(up_transactions, account_map, transfer_payee_ids, synced_up_account_ids=None,
+                   window=DEFAULT_PAIRING_WINDOW):
+    """
+    Pairs transfer legs and decides which are sent to YNAB as transfers and which are suppressed
+
+    Args:
+        up_transactions (list): UpTransactions (or raw Up JSON) from every account being synced
+        account_map (AccountMap): Up -> YNAB account links
+        transfer_payee_ids (dict): YNAB account id -> that account's transfer_payee_id
+        synced_up_account_ids (set): Up accounts being synced; defaults to those the transactions came from
+        window (timedelta): how far apart the two legs' createdAt may be
+
+    Returns:
+        TransferPlan
+    """
+    up_transactions = [UpTransaction.coerce(tx) for tx in up_transactions]
+    if synced_up_account_ids is None:
+        synced_up_account_ids = {tx.account_id for tx in up_transactions}
+
+    plan = TransferPlan()
+    plan.pairs, unpaired = pair_transfers(up_transactions, window)
+    if transfer_payee_ids.get(account_map.round_up_ynab_id):
+        plan.round_up = (account_map.round_up_ynab_id, transfer_payee_ids[account_map.round_up_ynab_id])
+
+    def transfer_payee(tx):
+        # The payee for sending tx as a YNAB transfer, or None if it should be an ordinary transaction
+        source = account_map.ynab_id_for_up(tx.account_id)
+        target = account_map.ynab_id_for_up(tx.transfer_account_id)
+        if source is None or target is None or source == target:
+            return None
+        return transfer_payee_ids.get(target)
+
+    for outgoing, incoming in plan.pairs:
+        payee_id = transfer_payee(outgoing)
+        if payee_id is not None:
+            plan.payee_ids[outgoing.id] = payee_id
+            plan.suppressed[incoming.id] = outgoing.id
+        elif account_map.ynab_id_for_up(outgoing.account_id) == account_map.ynab_id_for_up(incoming.account_id):
+            # Both legs land in the same YNAB account (eg. two savers sharing one) and cancel out
+            plan.suppressed[outgoing.id] = incoming.id
+            plan.suppressed[incoming.id] = outgoing.id
+
+    for tx in unpaired:
+        payee_id = transfer_payee(tx)
+        if payee_id is None:
+            continue
+        if tx.amount_cents > 0 and tx.transfer_account_id in synced_up_account_ids:
+            plan.suppressed[tx.id] = None
+        else:
+            plan.payee_ids[tx.id] = payee_id
+
+    return plan
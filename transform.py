@@ -0,0 +1,128 @@
+from models import UpTransaction, YnabSubtransaction, YnabTransaction, cents_to_milliunits
+
+"""
+Converting Up Bank transactions into the shape expected by the YNAB transactions endpoint
+Shared by 05-transform_up_to_ynab.py and 06-complete_workflow.py so both produce identical output
+Transactions are parsed into the compact models in models.py; YnabTransaction.to_json() gives the POST body
+
+A purchase with a Round Up or cashback becomes a YNAB split, so the YNAB account's balance moves by as much as
+Up's does: the purchase itself, a Round Up line (a transfer to the Round Up saver, when the transfer plan knows
+it) and a cashback income line. The splits are built in the same pass, and go up in the same batch, as everything
+else. Up also shows each Round Up arriving in the saver, with Spending as its transferAccount; with both accounts
+synced, that leg is suppressed by the transfer plan like any other incoming transfer
+"""
+
+ROUND_UP_PAYEE = "Round Up"
+
+
+def split_lines(tx, ynab_account_id, payee_name, category_id, transfer_plan=None):
+    """
+    Args:
+        tx (UpTransaction)
+        ynab_account_id (str): YNAB account the transaction is going to
+        payee_name (str): payee of the purchase line
+        category_id (str): category of the purchase line
+        transfer_plan (TransferPlan): for the Round Up saver's transfer payee
+
+    Returns:
+        list: YnabSubtransactions, or an empty list if the transaction has no Round Up or cashback
+    """
+    lines = []
+    if tx.round_up_cents:
+        round_up = transfer_plan.round_up if transfer_plan is not None else None
+        round_up_ynab_id, round_up_payee_id = round_up or (None, None)
+        # A Round Up into a saver that shares the YNAB account doesn't change its balance
+        if round_up_ynab_id != ynab_account_id:
+            lines.append(YnabSubtransaction(
+                amount=cents_to_milliunits(tx.round_up_cents),
+                payee_id=round_up_payee_id,
+                payee_name=ROUND_UP_PAYEE if round_up_payee_id is None else None,
+                memo=ROUND_UP_PAYEE))
+    if tx.cashback_cents:
+        lines.append(YnabSubtransaction(
+            amount=cents_to_milliunits(tx.cashback_cents),
+            payee_name=payee_name,
+            memo=f"Cashback: {tx.cashback_description or ''}"))
+
+    if lines:
+        lines.insert(0, YnabSubtransaction(amount=cents_to_milliunits(tx.amount_cents), payee_name=payee_name,
+                                           category_id=category_id))
+    return lines
+
+
+def iter_ynab_transactions(up_transactions, ynab_account_id=None, account_map=None, transfer_plan=None,
+                           include_held=False, rules=None):
+    """
+    Lazily converts Up Bank transactions into YnabTransactions, skipping anything not yet settled
+    Accepts any iterable, so transactions can be transformed as pages stream in from Up
+
+    Args:
+        up_transactions (iterable): UpTransactions, or raw transactions from the 'data' field of an Up response
+        ynab_account_id (str): YNAB account the transactions should be recorded against
+        account_map (AccountMap): if given, each transaction goes to the YNAB account mapped to its Up account,
+            falling back to ynab_account_id; transactions with no YNAB account at all are skipped
+        transfer_plan (TransferPlan): if given, transfer legs are sent as YNAB transfers or suppressed as planned
+        include_held (bool): convert HELD transactions too, as uncleared; used when pushing webhook updates
+        rules (RuleSet): if given, payee names and categories are set by the first matching rule (see rules.py)
+
+    Yields:
+        YnabTransaction: ready to be posted to YNAB
+    """
+    for tx in up_transactions:
+        tx = UpTransaction.coerce(tx)
+
+        # Skip transactions that aren't SETTLED
+        if not tx.is_settled and not include_held:
+            continue
+
+        # Transfers: YNAB creates the incoming side from the outgoing one, so the incoming leg isn't sent
+        transfer_payee_id = None
+        if transfer_plan is not None:
+            if tx.id in transfer_plan.suppressed:
+                continue
+            transfer_payee_id = transfer_plan.payee_ids.get(tx.id)
+
+        # Get the YNAB account for this transaction
+        tx_ynab_account_id = ynab_account_id
+        if account_map is not None:
+            tx_ynab_account_id = account_map.ynab_id_for_up(tx.account_id) or ynab_account_id
+        if tx_ynab_account_id is None:
+            print(f"Skipping transaction {tx.id}: no YNAB account mapped")
+            continue
+
+        # Transfers keep their transfer payee, and YNAB gives them no category
+        payee_name = category_id = None
+        if transfer_payee_id is None:
+            if rules is not None:
+                payee_name, category_id = rules.apply(tx)
+            payee_name = payee_name or tx.description
+
+        # Round Ups and cashback make a split, whose parent takes the total and no category
+        amount = cents_to_milliunits(tx.amount_cents)
+        subtransactions = None
+        if transfer_payee_id is None and (tx.round_up_cents or tx.cashback_cents):
+            subtransactions = split_lines(tx, tx_ynab_account_id, payee_name, category_id, transfer_plan) or None
+        if subtransactions:
+            amount = sum(line.amount for line in subtransactions)
+            category_id = None
+
+        yield YnabTransaction(
+            account_id=tx_ynab_account_id,
+            date=tx.local_date,
+            amount=amount,
+            payee_name=payee_name,
+            payee_id=transfer_payee_id,
+            category_id=category_id,
+            subtransactions=subtransactions,
+            memo=f"Up Bank: {tx.raw_text or ''}",
+            cleared="cleared" if tx.is_settled else "uncleared",
+            # Up transaction ID (important for avoiding duplicates); YNAB import_id must be <= 36 chars
+            import_id=tx.id[:36],
+        )
+
+
+def transform_to_ynab_format(up_transactions, ynab_account_id=None, account_map=None, transfer_plan=None, rules=None):
+    """
+    Converts a list of Up Bank transactions into a list of YnabTransactions; see iter_ynab_transactions()
+    """
+    return list(iter_ynab_transactions(up_transactions, ynab_account_id, account_map, transfer_plan, rules=rules))
@@ -0,0 +1,355 @@
+import os
+import queue
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from requests.adapters import HTTPAdapter
+from http_client import RetryingSession
+from metrics import METRICS
+
+"""
+Helpers for talking to the Up Bank API
+All requests go through one requests.Session, so connections are kept alive and reused between pages and accounts
+rather than paying for a fresh TCP + TLS handshake on every request
+Accounts can be fetched concurrently; the number in flight at once is capped by max_workers. To stream them,
+iter_all_account_pages() hands each account's pages over in turn while the others download, holding only a few
+pages per account
+Transient failures are retried by the session (see http_client.py); if a page still can't be fetched,
+IncompleteFetchError records the page to resume from. get_account_transactions() resumes from there itself, keeping
+the pages it already has; the streaming sync and backfill start again from their cursor or checkpoint instead
+"""
+
+# Can be pointed elsewhere (eg. mock_server.py) by setting UP_API_URL in the environment
+UP_API_URL = os.getenv("UP_API_URL", "https://api.up.com.au/api/v1")
+
+# Number of accounts fetched at the same time; override with UP_MAX_CONCURRENCY in .env
+DEFAULT_MAX_CONCURRENCY = 4
+
+# Largest page size Up allows; fewer, larger pages means fewer round trips
+DEFAULT_PAGE_SIZE = 100
+
+# Pages of each account fetched ahead of the one being consumed, by iter_all_account_pages()
+DEFAULT_PREFETCH_PAGES = 2
+
+# Times get_account_transactions() carries on from a page that failed, after the session's own retries
+DEFAULT_RESUME_ATTEMPTS = 1
+
+
+class IncompleteFetchError(requests.exceptions.RequestException):
+    """
+    Raised when a page of transactions couldn't be fetched even after retrying
+
+    Attributes:
+        resume_url (str): the page that failed; pass as resume_url to carry on from there
+        transactions (list): transactions fetched before the failure, when collected by get_account_transactions()
+        fetched (dict): from get_all_account_transactions(), the transactions of every account fetched in full,
+            keyed by Up account id
+        failed (dict): from get_all_account_transactions(), the IncompleteFetchError of each account that wasn't
+    """
+
+    def __init__(self, message, resume_url, transactions=None, fetched=None, failed=None):
+        super().__init__(message)
+        self.resume_url = resume_url
+        self.transactions = transactions or []
+        self.fetched = fetched or {}
+        self.failed = failed or {}
+
+
+def up_headers(up_api_key):
+    return {
+        "Authorization": f"Bearer {up_api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def create_session(up_api_key, pool_size=DEFAULT_MAX_CONCURRENCY, cache=None):
+    """
+    Creates a keep-alive, retrying session for the Up API, with enough pooled connections for pool_size
+    concurrent requests
+
+    Args:
+        up_api_key (str)
+        pool_size (int): maximum number of connections kept open to Up
+        cache (ReplayCache): optional cache to record responses to, or replay them from when offline
+
+    Returns:
+        RetryingSession
+    """
+    session = RetryingSession(cache=cache, name="up")
+    session.headers.update(up_headers(up_api_key))
+
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def format_since_date(since_date):
+    # Format the date properly for RFC 3339
+    # Convert to UTC and add the 'Z' suffix or proper timezone offset
+    if isinstance(since_date, datetime):
+        return since_date.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    # If it's already a string, make sure it has timezone info
+    return since_date if 'Z' in since_date or '+' in since_date else f"{since_date}Z"
+
+
+def get_accounts(session):
+    """
+    Lists every Up account (TRANSACTIONAL and SAVER) visible to the API key
+
+    Args:
+        session (requests.Session): from create_session()
+
+    Returns:
+        list: accounts as returned in the 'data' field of the Up accounts endpoint
+    """
+    accounts = []
+    page_url = f"{UP_API_URL}/accounts"
+
+    while page_url:
+        response = session.get(page_url)
+        response.raise_for_status()
+
+        data = response.json()
+        accounts.extend(data["data"])
+        page_url = data.get("links", {}).get("next")
+
+    return accounts
+
+
+def get_transaction(session, transaction_id):
+    """
+    Fetches a single Up transaction, eg. the one a webhook event refers to
+
+    Args:
+        session (requests.Session): from create_session()
+        transaction_id (str)
+
+    Returns:
+        dict: the transaction, as found in the 'data' field of the Up response
+    """
+    response = session.get(f"{UP_API_URL}/transactions/{transaction_id}")
+    response.raise_for_status()
+    return response.json()["data"]
+
+
+def register_webhook(session, url, description=None):
+    """
+    Asks Up to send transaction events to url
+
+    Args:
+        session (requests.Session): from create_session()
+        url (str): publicly reachable address of the webhook receiver
+        description (str)
+
+    Returns:
+        dict: the webhook; its attributes.secretKey is only returned here, and is needed to verify events
+    """
+    attributes = {"url": url}
+    if description:
+        attributes["description"] = description
+
+    response = session.post(f"{UP_API_URL}/webhooks", json={"data": {"attributes": attributes}})
+    response.raise_for_status()
+    return response.json()["data"]
+
+
+def iter_transaction_pages(session, up_account_id, since_date, page_size=DEFAULT_PAGE_SIZE, resume_url=None,
+                           until_date=None):
+    """
+    Yields each page of an Up account's transactions as soon as it arrives, following links.next
+    Only one page is held in memory at a time; a failed request raises rather than discarding pages already yielded
+    Pages, transactions, bytes and retries are counted in metrics.METRICS against the account, so concurrent
+    fetches of other accounts aren't mixed in
+
+    Args:
+        session (requests.Session): from create_session()
+        up_account_id (str)
+        since_date (str | datetime)
+        page_size (int): transactions per page; Up allows up to 100
+        resume_url (str): page to start from instead of the first, eg. IncompleteFetchError.resume_url
+        until_date (str | datetime): if given, only transactions created before this are fetched
+
+    Yields:
+        list: the Up transactions on the next page
+
+    Raises:
+        IncompleteFetchError: if a page couldn't be fetched, recording it as the page to resume from
+    """
+    page_url = resume_url or (f"{UP_API_URL}/accounts/{up_account_id}/transactions"
+                              f"?filter[since]={format_since_date(since_date)}&page[size]={page_size}")
+    if until_date is not None and resume_url is None:
+        page_url += f"&filter[until]={format_since_date(until_date)}"
+
+    while page_url:
+        try:
+            print(f"Fetching transactions from: {page_url}")
+            response = session.get(page_url, metric_labels={"account": up_account_id})
+            response.raise_for_status()
+
+        except requests.exceptions.RequestException as e:
+            raise IncompleteFetchError(f"Error fetching transactions: {e}", page_url) from e
+
+        data = response.json()
+        METRICS.inc("up_pages_total", account=up_account_id)
+        METRICS.inc("up_transactions_total", len(data["data"]), account=up_account_id)
+        yield data["data"]
+
+        # Check if there's a next page
+        page_url = data.get("links", {}).get("next")
+
+
+def iter_account_transactions(session, up_account_id, since_date, page_size=DEFAULT_PAGE_SIZE, resume_url=None):
+    """
+    Yields an Up account's transactions one at a time, fetching further pages only as they're needed
+    """
+    for page in iter_transaction_pages(session, up_account_id, since_date, page_size, resume_url):
+        yield from page
+
+
+def get_account_transactions(session, up_account_id, since_date, resume_url=None,
+                             resume_attempts=DEFAULT_RESUME_ATTEMPTS):
+    """
+    Fetches every transaction for one Up account created since since_date into a list
+    If a page fails even after the session's retries, the fetch carries on from that page (up to resume_attempts
+    times), keeping the pages already fetched
+
+    Args:
+        session (requests.Session): from create_session()
+        up_account_id (str)
+        since_date (str | datetime)
+        resume_url (str): page to carry on from after an IncompleteFetchError
+        resume_attempts (int): times to carry on from a page that failed before giving up
+
+    Returns:
+        list: Up transactions
+
+    Raises:
+        IncompleteFetchError: carrying the transactions fetched so far and the page to resume from
+    """
+    transactions = []
+
+    while True:
+        try:
+            for page in iter_transaction_pages(session, up_account_id, since_date, resume_url=resume_url):
+                transactions.extend(page)
+            return transactions
+
+        except IncompleteFetchError as e:
+            print(e)
+            if resume_attempts <= 0:
+                e.transactions = transactions
+                raise
+            print(f"Resuming from {e.resume_url}")
+            resume_url = e.resume_url
+            resume_attempts -= 1
+
+
+def get_all_account_transactions(session, since_date, up_account_ids=None, max_workers=DEFAULT_MAX_CONCURRENCY):
+    """
+    Fetches transactions for several Up accounts concurrently over a shared session
+
+    Args:
+        session (requests.Session): from create_session(), with a pool at least max_workers connections deep
+        since_date (str | datetime | dict): a single since date, or a dict of since dates keyed by Up account id
+        up_account_ids (list): accounts to fetch; defaults to every account returned by get_accounts()
+        max_workers (int): maximum number of accounts fetched at the same time
+
+    Returns:
+        dict: lists of Up transactions keyed by Up account id
+
+    Raises:
+        IncompleteFetchError: if any account couldn't be fetched, once the others have been; its fetched and
+            failed attributes hold each account's transactions or error
+    """
+    if up_account_ids is None:
+        up_account_ids = [account["id"] for account in get_accounts(session)]
+
+    def fetch(up_account_id):
+        account_since_date = since_date[up_account_id] if isinstance(since_date, dict) else since_date
+        try:
+            return get_account_transactions(session, up_account_id, account_since_date)
+        except IncompleteFetchError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(zip(up_account_ids, executor.map(fetch, up_account_ids)))
+
+    failed = {up_id: result for up_id, result in results.items() if isinstance(result, IncompleteFetchError)}
+    if failed:
+        first = next(iter(failed.values()))
+        raise IncompleteFetchError(
+            f"Could not fetch every transaction for {len(failed)} of {len(results)} accounts: {first}",
+            first.resume_url, first.transactions,
+            fetched={up_id: result for up_id, result in results.items() if up_id not in failed}, failed=failed)
+    return results
+
+
+def iter_all_account_pages(session, since_date, up_account_ids, max_workers=DEFAULT_MAX_CONCURRENCY,
+                           prefetch_pages=DEFAULT_PREFETCH_PAGES):
+    """
+    Fetches several Up accounts' pages concurrently over a shared session, handing them over one account at a time
+    While one account's pages are being consumed (eg. streamed into YNAB) the others keep downloading, but each
+    holds at most prefetch_pages pages until its turn, so memory is bounded by the page size rather than by how
+    much history there is
+
+    Args:
+        session (requests.Session): from create_session(), with a pool at least max_workers connections deep
+        since_date (str | datetime | dict): a single since date, or a dict of since dates keyed by Up account id
+        up_account_ids (list): accounts to fetch, in the order they're handed over
+        max_workers (int): maximum number of accounts fetched at the same time
+        prefetch_pages (int): pages of each account held ahead of the one being consumed
+
+    Yields:
+        tuple: (Up account id, generator of its pages), which raises IncompleteFetchError as iter_transaction_pages()
+            does if a page couldn't be fetched; moving on to the next account stops fetching this one
+    """
+    stopped = threading.Event()
+    finished = object()
+
+    def put(pages, closed, item):
+        # Gives up once the pages are no longer wanted, rather than waiting on a full queue forever
+        while not (stopped.is_set() or closed.is_set()):
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch(up_account_id, pages, closed):
+        account_since_date = since_date[up_account_id] if isinstance(since_date, dict) else since_date
+        try:
+            for page in iter_transaction_pages(session, up_account_id, account_since_date):
+                if not put(pages, closed, page):
+                    return
+        except Exception as e:
+            put(pages, closed, e)
+            return
+        put(pages, closed, finished)
+
+    def hand_over(pages):
+        while True:
+            item = pages.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        accounts = [(up_account_id, queue.Queue(maxsize=prefetch_pages), threading.Event())
+                    for up_account_id in up_account_ids]
+        for account in accounts:
+            executor.submit(fetch, *account)
+        for up_account_id, pages, closed in accounts:
+            try:
+                yield up_account_id, hand_over(pages)
+            finally:
+                # Whatever the consumer left of this account's pages isn't wanted; frees its worker for the next
+                closed.set()
+    finally:
+        stopped.set()
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,223 @@
+import argparse
+import os
+import requests
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from archive import DEFAULT_ARCHIVE_DIR, UpArchive
+from metrics import METRICS
+from replay_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DEFAULT_TTL, ReplayCache
+from sync_service import SyncService
+from up_api import DEFAULT_MAX_CONCURRENCY
+from verify import DEFAULT_VERIFY_DAYS
+from tenants import load_tenants, run_tenant_daemons, sync_tenants
+
+"""
+Entry point for syncing Up into YNAB
+
+  python up_to_ynab.py sync      sync every mapped account once, then exit
+  python up_to_ynab.py daemon    keep running, syncing every account every --interval seconds (+/- --jitter)
+  python up_to_ynab.py backfill --since 2021-01-01    upload the history since a date, several months at once
+  python up_to_ynab.py update --days 14    PATCH transactions that changed in Up since they were imported
+  python up_to_ynab.py verify --days 90    check YNAB balances match Up, and find the day any drift started
+  python up_to_ynab.py export --since 2021-01-01    archive the Up history locally for analysis (see archive.py)
+
+Configuration comes from the .env file, as for the numbered scripts (see SyncService.from_env()); in daemon mode
+it's read once, and the HTTP sessions, account map and sync state stay open between syncs
+With --tenants tenants.yaml, every household listed there is synced instead, in parallel (see tenants.py)
+
+Metrics (see metrics.py): --metrics-log appends a JSON line per account sync; --metrics-file writes Prometheus
+metrics after every sync, and in daemon mode --metrics-port serves them at /metrics
+
+Replay cache (see replay_cache.py): with --cache every API response is recorded, and a recent one stands in for a
+request that fails; verify and export, which only read, also take --offline to answer everything from the cache
+"""
+
+DEFAULT_SYNC_INTERVAL = 300
+DEFAULT_SYNC_JITTER = 30
+DEFAULT_UPDATE_DAYS = 14
+
+
+def replay_cache(args):
+    if not (args.cache or args.offline):
+        return None
+    return ReplayCache(os.getenv("REPLAY_CACHE_DIR", DEFAULT_CACHE_DIR),
+                       ttl=float(os.getenv("REPLAY_CACHE_TTL", DEFAULT_TTL)),
+                       max_bytes=int(os.getenv("REPLAY_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+                       offline=args.offline)
+
+
+def sync(args):
+    if args.tenants:
+        sync_tenants(args.tenants, args.workers, args.metrics_log, args.metrics_file)
+        return
+
+    with SyncService.from_env(cache=replay_cache(args)) as service:
+        service.sync_all()
+    if args.metrics_file:
+        METRICS.write_prometheus(args.metrics_file)
+
+
+def backfill(args):
+    with SyncService.from_env(up_pool_size=args.workers, cache=replay_cache(args)) as service:
+        service.backfill(args.since, args.until, args.workers)
+
+
+def update(args):
+    with SyncService.from_env(cache=replay_cache(args)) as service:
+        service.update_changed(datetime.now(timezone.utc) - timedelta(days=args.days))
+    if args.metrics_file:
+        METRICS.write_prometheus(args.metrics_file)
+
+
+def export(args):
+    with SyncService.from_env(up_pool_size=args.workers, cache=replay_cache(args)) as service:
+        fetched = service.export(UpArchive(args.archive), args.since, args.until, args.workers)
+    print(f"Fetched {sum(count or 0 for count in fetched.values())} transactions into {args.archive}")
+
+
+def format_milliunits(milliunits):
+    return f"{milliunits / 1000:,.2f}"
+
+
+def verify(args):
+    with SyncService.from_env(up_pool_size=args.workers, cache=replay_cache(args)) as service:
+        try:
+            reports = service.verify(datetime.now(timezone.utc) - timedelta(days=args.days), args.workers)
+        except requests.exceptions.RequestException as e:
+            # Including IncompleteFetchError, when an Up account's history couldn't be fetched
+            print(f"Verify failed: {e}")
+            exit(1)
+
+    drifted = 0
+    for report in reports:
+        up_balance, ynab_balance = report["up_balance"], report["ynab_balance"]
+        if up_balance == ynab_balance:
+            print(f"{report['name']}: OK ({format_milliunits(ynab_balance)})")
+            continue
+
+        drifted += 1
+        print(f"{report['name']}: Up {format_milliunits(up_balance)} (settled), "
+              f"YNAB {format_milliunits(ynab_balance)}, off by {format_milliunits(up_balance - ynab_balance)}")
+        if report["drift_day"] is None:
+            print(f"  the difference was already there {args.days:g} days ago; try a larger --days")
+            continue
+
+        print(f"  balances first differ on {report['drift_day']} (found in {report['comparisons']} comparisons)")
+        details = report["details"]
+        for tx in details["missing"]:
+            print(f"  missing from YNAB: {tx.payee_name} {format_milliunits(tx.amount)} ({tx.import_id})")
+        for tx, ynab_tx in details["differ"]:
+            print(f"  amount differs: {tx.payee_name} Up {format_milliunits(tx.amount)}, "
+                  f"YNAB {format_milliunits(ynab_tx['amount'])}")
+        for ynab_tx in details["unmatched"]:
+            print(f"  only in YNAB: {ynab_tx.get('payee_name')} {format_milliunits(ynab_tx['amount'])} "
+                  f"({ynab_tx['id']})")
+
+    if drifted:
+        exit(1)
+
+
+def daemon(args):
+    if args.tenants:
+        run_tenant_daemons(args.tenants, args.interval, args.jitter, args.metrics_file, args.metrics_port,
+                           args.metrics_log)
+    else:
+        with SyncService.from_env(cache=replay_cache(args)) as service:
+            service.run_daemon(args.interval, args.jitter, args.metrics_file, args.metrics_port)
+    print("Stopped")
+
+
+def main():
+    # Loaded first so SYNC_INTERVAL and SYNC_JITTER in .env set the option defaults
+    load_dotenv()
+
+    arg_parser = argparse.ArgumentParser(description="Sync Up accounts into YNAB")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = commands.add_parser("sync", help="sync every mapped account once")
+    sync_parser.add_argument("--workers", type=int, help="tenants synced at once; defaults to all of them")
+    sync_parser.set_defaults(run=sync)
+
+    daemon_parser = commands.add_parser("daemon", help="keep syncing on a schedule")
+    daemon_parser.add_argument("--interval", type=float,
+                               default=float(os.getenv("SYNC_INTERVAL", DEFAULT_SYNC_INTERVAL)),
+                               help="seconds between syncs")
+    daemon_parser.add_argument("--jitter", type=float, default=float(os.getenv("SYNC_JITTER", DEFAULT_SYNC_JITTER)),
+                               help="random seconds added to or taken from each interval")
+    daemon_parser.add_argument("--metrics-port", type=int,
+                               default=int(os.environ["METRICS_PORT"]) if os.getenv("METRICS_PORT") else None,
+                               help="serve Prometheus metrics on this port")
+    daemon_parser.set_defaults(run=daemon)
+
+    backfill_parser = commands.add_parser("backfill", help="upload a long history, several months at a time")
+    backfill_parser.add_argument("--since", required=True, help="start of the history, eg. 2021-01-01")
+    backfill_parser.add_argument("--until", help="end of the history; defaults to now")
+    backfill_parser.add_argument("--workers", type=int,
+                                 default=int(os.getenv("UP_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+                                 help="months fetched at the same time")
+    backfill_parser.set_defaults(run=backfill, tenants=None, metrics_log=None)
+
+    update_parser = commands.add_parser("update",
+                                        help="update transactions that changed in Up since they were imported")
+    update_parser.add_argument("--days", type=float, default=DEFAULT_UPDATE_DAYS,
+                               help="how far back to look for changes")
+    update_parser.add_argument("--metrics-file", metavar="PATH", default=os.getenv("METRICS_FILE"),
+                               help="write Prometheus metrics here")
+    update_parser.set_defaults(run=update, tenants=None, metrics_log=None)
+
+    verify_parser = commands.add_parser("verify", help="check YNAB balances match Up, and find where they drifted")
+    verify_parser.add_argument("--days", type=float, default=DEFAULT_VERIFY_DAYS,
+                               help="how far back to look for where balances drifted")
+    verify_parser.add_argument("--workers", type=int,
+                               default=int(os.getenv("UP_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+                               help="Up accounts fetched at the same time")
+    verify_parser.set_defaults(run=verify, tenants=None, metrics_log=None)
+
+    export_parser = commands.add_parser("export", help="archive the Up history locally, several months at a time")
+    export_parser.add_argument("--since", required=True, help="start of the history, eg. 2021-01-01")
+    export_parser.add_argument("--until", help="end of the history; defaults to now")
+    export_parser.add_argument("--archive", metavar="PATH", default=os.getenv("ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR),
+                               help="archive directory")
+    export_parser.add_argument("--workers", type=int,
+                               default=int(os.getenv("UP_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+                               help="months fetched at the same time")
+    export_parser.set_defaults(run=export, tenants=None, metrics_log=None)
+
+    for command_parser in (sync_parser, daemon_parser, backfill_parser, update_parser, verify_parser, export_parser):
+        command_parser.add_argument("--cache", action="store_true",
+                                    help="record API responses to the replay cache, reusing recent ones if a request "
+                                         "fails")
+        command_parser.set_defaults(offline=False)
+    for command_parser in (verify_parser, export_parser):
+        command_parser.add_argument("--offline", action="store_true",
+                                    help="answer every request from the replay cache")
+
+    for command_parser in (sync_parser, daemon_parser):
+        command_parser.add_argument("--tenants", metavar="PATH", default=os.getenv("TENANTS_PATH"),
+                                    help="sync every tenant listed in this file, in parallel")
+        command_parser.add_argument("--metrics-file", metavar="PATH", default=os.getenv("METRICS_FILE"),
+                                    help="write Prometheus metrics here (per tenant with --tenants)")
+        command_parser.add_argument("--metrics-log", metavar="PATH", default=os.getenv("METRICS_LOG"),
+                                    help="append a JSON line per account sync here; '-' for standard output")
+
+    args = arg_parser.parse_args()
+
+    if args.metrics_log:
+        METRICS.configure_log(args.metrics_log)
+
+    if args.tenants and args.cache:
+        print("Error: --cache can't be used with --tenants")
+        exit(1)
+
+    if args.tenants:
+        try:
+            args.tenants = load_tenants(args.tenants)
+        except (OSError, ValueError) as e:
+            print(f"Error loading tenants: {e}")
+            exit(1)
+
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
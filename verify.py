@@ -0,0 +1,225 @@
+from datetime import datetime
+from itertools import accumulate
+from models import UP_TIMEZONE, UpTransaction, amount_in_cents, cents_to_milliunits, local_date
+from sync_state import to_utc_timestamp
+from transfers import plan_transfers
+from transform import iter_ynab_transactions
+from up_api import DEFAULT_MAX_CONCURRENCY, get_accounts, get_all_account_transactions
+from ynab_api import refresh_account_transactions
+
+"""
+Checking that YNAB agrees with Up after syncing
+Each YNAB account's balance is compared with the balance of the Up accounts mapped to it (less anything still HELD
+that the webhook receiver hasn't sent to YNAB as uncleared, since a sync doesn't send it yet). Where they differ,
+the day the drift started is found by bisection: the Up transactions since a start date are fetched (every account
+at once) and put through the same transfer plan and transform as a sync, so both legs of a transfer and each Round
+Up are routed as they were sent. Both sides are then totalled by day: what the sync sent to the YNAB account, plus
+the side YNAB creates itself of each transfer sent to it, against the cached YNAB transactions in the sync state.
+The difference in balance at the start of a day is the current difference less everything after it. With running
+totals that's a subtraction per comparison, so the day is found in O(log n) comparisons; its transactions are then
+matched up by import_id to show which ones are out
+
+If the balances diverged more than once, the day found is one of the divergences (the one bisection lands on);
+once it's fixed, run the check again
+"""
+
+DEFAULT_VERIFY_DAYS = 90
+
+
+def balance_effect(tx):
+    """
+    Args:
+        tx (UpTransaction)
+
+    Returns:
+        int: milliunits the transaction moves the Up account's balance by: the amount, plus any Round Up and
+            cashback
+    """
+    return cents_to_milliunits(tx.amount_cents + (tx.round_up_cents or 0) + (tx.cashback_cents or 0))
+
+
+def bisect_drift(days, up_totals, ynab_totals, difference):
+    """
+    Finds a day on which Up and YNAB balances went from agreeing to not
+
+    Args:
+        days (list): every day (YYYY-MM-DD) with a transaction on either side, in order
+        up_totals (dict): Up milliunits per day
+        ynab_totals (dict): YNAB milliunits per day
+        difference (int): Up balance less YNAB balance now, in milliunits
+
+    Returns:
+        tuple: (index into days of the day the difference appeared, or None if it was already there before the
+            first day; number of comparisons made)
+    """
+    # after[i]: how much more Up moved than YNAB from days[i] on; the difference at the start of days[i] is
+    # difference - after[i]
+    daily = [up_totals.get(day, 0) - ynab_totals.get(day, 0) for day in days]
+    after = list(accumulate(reversed(daily), initial=0))[::-1]
+
+    comparisons = 1
+    if difference - after[0] != 0:
+        return None, comparisons
+
+    # Invariant: balances agree at the start of days[low] and differ at the start of days[high] (or now)
+    low, high = 0, len(days)
+    while high - low > 1:
+        middle = (low + high) // 2
+        comparisons += 1
+        if difference - after[middle] == 0:
+            low = middle
+        else:
+            high = middle
+    return low, comparisons
+
+
+def expected_daily_totals(ynab_transactions, ynab_account_id, transfer_accounts):
+    """
+    What a YNAB account should hold each day, given what the sync sends: the transactions sent to the account,
+    plus the other side of each transfer (or Round Up line) sent to it from another account, which YNAB creates
+
+    Args:
+        ynab_transactions (list): YnabTransactions, transformed from every Up account as the sync does
+        ynab_account_id (str)
+        transfer_accounts (dict): transfer payee id -> the YNAB account it transfers to
+
+    Returns:
+        dict: milliunits per day (YYYY-MM-DD)
+    """
+    totals = {}
+    for tx in ynab_transactions:
+        day = tx.date.isoformat()
+        if tx.account_id == ynab_account_id:
+            totals[day] = totals.get(day, 0) + tx.amount
+        for line in tx.subtransactions or [tx]:
+            if line.payee_id is not None and transfer_accounts.get(line.payee_id) == ynab_account_id:
+                totals[day] = totals.get(day, 0) - line.amount
+    return totals
+
+
+def compare_day(day, expected_transactions, ynab_transactions):
+    """
+    Matches what the sync sends to a YNAB account on one day with what YNAB holds, by import_id
+
+    Args:
+        day (str): YYYY-MM-DD
+        expected_transactions (list): YnabTransactions for the account, as transformed by the sync; transfer legs
+            the sync leaves to YNAB aren't among them
+        ynab_transactions (list): the account's cached YNAB transactions on the day
+
+    Returns:
+        dict: YnabTransactions 'missing' from YNAB, (expected, YNAB) pairs whose amounts 'differ', and YNAB
+            transactions 'unmatched' by any expected (eg. entered by hand); transfers YNAB made itself are left out
+    """
+    ynab_by_import_id = {tx["import_id"]: tx for tx in ynab_transactions if tx.get("import_id")}
+    import_ids = set()
+    missing = []
+    differ = []
+    for tx in expected_transactions:
+        if tx.date.isoformat() != day:
+            continue
+        import_ids.add(tx.import_id)
+        ynab_tx = ynab_by_import_id.get(tx.import_id)
+        if ynab_tx is None:
+            missing.append(tx)
+        elif ynab_tx["amount"] != tx.amount:
+            differ.append((tx, ynab_tx))
+
+    unmatched = [tx for tx in ynab_transactions
+                 if tx.get("import_id") not in import_ids and not tx.get("transfer_account_id")]
+    return {"missing": missing, "differ": differ, "unmatched": unmatched}
+
+
+def verify_accounts(up_session, ynab_session, budget_id, sync_state, metadata, groups, since_date,
+                    max_workers=DEFAULT_MAX_CONCURRENCY, account_map=None, transfer_payee_ids=None):
+    """
+    Compares each YNAB account's balance with its Up accounts', and finds where any that differ went wrong
+
+    Args:
+        up_session (requests.Session): from up_api.create_session()
+        ynab_session (requests.Session): from ynab_api.create_session()
+        budget_id (str)
+        sync_state (SyncState): holds the cached YNAB transactions; brought up to date for accounts that differ
+        metadata (YnabMetadata): YNAB account balances; refreshed first
+        groups (list): (name, YNAB account id, list of the Up account ids synced into it)
+        since_date (str | datetime): how far back to look for the drift
+        max_workers (int): Up accounts fetched at the same time
+        account_map (AccountMap): Up -> YNAB account links, as used by the sync; if given (with
+            transfer_payee_ids), transfers and Round Ups are routed as the sync routes them
+        transfer_payee_ids (dict): YNAB account id -> that account's transfer_payee_id
+
+    Returns:
+        list: a dict per group: 'name', 'ynab_account_id', 'up_balance' and 'ynab_balance' (milliunits), and for
+            those that differ, 'drift_day' (None if it's before since_date), 'comparisons' and the day's 'details'
+            (see compare_day())
+    """
+    up_balances = {account["id"]: amount_in_cents(account["attributes"]["balance"])
+                   for account in get_accounts(up_session)}
+    metadata.refresh(["accounts"])
+
+    reports = []
+    for name, ynab_account_id, up_account_ids in groups:
+        ynab_account = metadata.get("accounts", ynab_account_id) or {}
+        reports.append({
+            "name": name,
+            "ynab_account_id": ynab_account_id,
+            "up_account_ids": up_account_ids,
+            "up_balance": cents_to_milliunits(sum(up_balances.get(up_id, 0) for up_id in up_account_ids)),
+            "ynab_balance": ynab_account.get("balance", 0),
+        })
+
+    # Both sides are compared a whole day at a time, so Up is fetched from the start of since_date's day
+    since_day = local_date(datetime.fromisoformat(to_utc_timestamp(since_date).replace("Z", "+00:00")))
+    since_date = to_utc_timestamp(datetime.combine(since_day, datetime.min.time(), UP_TIMEZONE))
+
+    # Every Up account is fetched at once; HELD transactions count towards Up's balance but aren't synced yet, so
+    # they're needed even where the balances agree
+    up_account_ids = [up_id for report in reports for up_id in report["up_account_ids"]]
+    fetched = get_all_account_transactions(up_session, since_date, up_account_ids, max_workers)
+    up_transactions = {up_id: [UpTransaction.from_json(tx) for tx in transactions]
+                       for up_id, transactions in fetched.items()}
+
+    # What the sync sends, with the same transfer plan and Round Up routing
+    transfer_plan = None
+    transfer_accounts = {}
+    if account_map is not None and transfer_payee_ids is not None:
+        transfer_plan = plan_transfers([tx for transactions in up_transactions.values() for tx in transactions],
+                                       account_map, transfer_payee_ids, set(account_map.by_up_id))
+        transfer_accounts = {payee_id: ynab_id for ynab_id, payee_id in transfer_payee_ids.items() if payee_id}
+    expected = [ynab_tx for report in reports for ynab_tx in iter_ynab_transactions(
+                    [tx for up_id in report["up_account_ids"] for tx in up_transactions[up_id]],
+                    report["ynab_account_id"], account_map, transfer_plan, include_held=True)]
+
+    # HELD transactions already sent by the webhook receiver are in YNAB as uncleared, and so in its balance; the
+    # rest aren't synced yet, so they're left out of both sides
+    held_import_ids = {}
+    for tx in expected:
+        if tx.cleared == "uncleared":
+            held_import_ids.setdefault(tx.account_id, []).append(tx.import_id)
+    sent_held = {ynab_account_id: sync_state.find_imported(ynab_account_id, import_ids)
+                 for ynab_account_id, import_ids in held_import_ids.items()}
+    expected = [tx for tx in expected
+                if tx.cleared != "uncleared" or tx.import_id in sent_held[tx.account_id]]
+
+    for report in reports:
+        transactions = [tx for up_id in report["up_account_ids"] for tx in up_transactions[up_id]]
+        sent = sent_held.get(report["ynab_account_id"], set())
+        held = sum(balance_effect(tx) for tx in transactions if not tx.is_settled and tx.id[:36] not in sent)
+        report["up_balance"] -= held
+        difference = report["up_balance"] - report["ynab_balance"]
+        if difference == 0:
+            continue
+
+        refresh_account_transactions(sync_state, budget_id, report["ynab_account_id"], ynab_session)
+        ynab_totals = sync_state.get_daily_totals(report["ynab_account_id"], since_day.isoformat())
+        up_totals = expected_daily_totals(expected, report["ynab_account_id"], transfer_accounts)
+
+        days = sorted(set(up_totals) | set(ynab_totals))
+        index, report["comparisons"] = bisect_drift(days, up_totals, ynab_totals, difference)
+        report["drift_day"] = days[index] if index is not None else None
+        if index is not None:
+            report["details"] = compare_day(
+                days[index], [tx for tx in expected if tx.account_id == report["ynab_account_id"]],
+                sync_state.get_cached_transactions_on(report["ynab_account_id"], days[index]))
+
+    return reports
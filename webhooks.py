@@ -0,0 +1,349 @@
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import queue
+import threading
+import requests
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from transform import iter_ynab_transactions
+from transfers import plan_transfers
+from up_api import get_transaction
+from ynab_api import delete_transaction, patch_transactions_in_batches, post_transactions_in_batches
+
+"""
+A receiver for Up webhook events, pushing each transaction change to YNAB as it happens rather than waiting for
+the next scan of the account's history
+ - TRANSACTION_CREATED: the transaction is fetched and created in YNAB; still HELD, it goes in as uncleared
+ - TRANSACTION_SETTLED: the transaction is fetched again and its YNAB copy PATCHed with the settled amount and
+   date and marked cleared (or created, if the CREATED event was missed)
+ - TRANSACTION_DELETED: the YNAB copy is deleted, if it's known
+Other events (eg. PING) are acknowledged and ignored
+
+Events are verified against the webhook's secret key (the X-Up-Authenticity-Signature header is an HMAC-SHA256 of
+the body), acknowledged straight away and then processed in order on a worker thread, so a slow or rate-limited
+YNAB never makes Up time out and redeliver. An event that fails (or never arrives) is left to the next scheduled
+sync:
+ - every transaction sent to YNAB while HELD, and every failed TRANSACTION_SETTLED event, is recorded in the sync
+   state until it's settled; the sync skips transactions already imported, so it PATCHes these instead (see
+   SyncService.update_pending())
+ - a transaction whose TRANSACTION_CREATED event failed isn't in YNAB yet, so the sync creates it once it's
+   settled; its cursor never moves past a HELD transaction
+
+Usage: python webhooks.py [--port 8080] [--register https://example.com/webhook]
+"""
+
+SIGNATURE_HEADER = "X-Up-Authenticity-Signature"
+# Outcomes kept in WebhookServer.results; older ones are dropped, so a long-running receiver stays the same size
+RECENT_RESULTS = 1000
+
+TRANSACTION_EVENTS = {"TRANSACTION_CREATED", "TRANSACTION_SETTLED", "TRANSACTION_DELETED"}
+
+
+def sign(body, secret_key):
+    """
+    Args:
+        body (bytes): raw request body
+        secret_key (str): the webhook's secretKey, as returned when it was registered
+
+    Returns:
+        str: the hex signature Up sends in X-Up-Authenticity-Signature
+    """
+    return hmac.new(secret_key.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body, signature, secret_key):
+    return signature is not None and hmac.compare_digest(sign(body, secret_key), signature)
+
+
+class WebhookProcessor:
+    """
+    Applies Up webhook events to YNAB
+
+    Args:
+        up_session (requests.Session): from up_api.create_session()
+        ynab_session (requests.Session): from ynab_api.create_session()
+        budget_id (str)
+        sync_state (SyncState): index of what's already in YNAB, and so whether to create or PATCH
+        account_map (AccountMap): Up -> YNAB account links
+        ynab_account_id (str): YNAB account for Up accounts the map doesn't cover
+        transfer_payee_ids (dict): YNAB account id -> transfer_payee_id; if given, transfers are sent as YNAB
+            transfers (see transfers.py)
+        rules (RuleSet): optional payee and category rules, applied by the transform
+    """
+
+    def __init__(self, up_session, ynab_session, budget_id, sync_state, account_map=None, ynab_account_id=None,
+                 transfer_payee_ids=None, rules=None):
+        self.up_session = up_session
+        self.ynab_session = ynab_session
+        self.budget_id = budget_id
+        self.sync_state = sync_state
+        self.account_map = account_map
+        self.ynab_account_id = ynab_account_id
+        self.transfer_payee_ids = transfer_payee_ids
+        self.rules = rules
+
+    def handle_event(self, event):
+        """
+        Args:
+            event (dict): a webhook event body, as sent by Up
+
+        Returns:
+            str: what was done: 'created', 'updated', 'deleted', 'skipped' or 'ignored'
+        """
+        data = event["data"]
+        event_type = data["attributes"]["eventType"]
+        if event_type not in TRANSACTION_EVENTS:
+            return "ignored"
+
+        transaction_id = data["relationships"]["transaction"]["data"]["id"]
+        print(f"Received {event_type} for {transaction_id}")
+
+        if event_type == "TRANSACTION_DELETED":
+            return self.delete(transaction_id)
+        try:
+            up_transaction = get_transaction(self.up_session, transaction_id)
+            result = self.upsert(up_transaction)
+        except Exception:
+            if event_type == "TRANSACTION_SETTLED":
+                self.sync_state.record_pending_update(transaction_id)
+            raise
+
+        # A HELD copy stays pending until it's settled, in case its TRANSACTION_SETTLED event never arrives (eg. the
+        # receiver was down): the sync skips it as already imported, so update_pending() settles it instead
+        if result in ("created", "updated"):
+            if up_transaction["attributes"]["status"] == "HELD":
+                self.sync_state.record_pending_update(transaction_id)
+            else:
+                self.sync_state.forget_pending_updates([transaction_id])
+        return result
+
+    def upsert(self, up_transaction):
+        """
+        Creates the YNAB copy of an Up transaction, or brings an existing one up to date
+        """
+        transfer_plan = None
+        if self.transfer_payee_ids is not None and self.account_map is not None:
+            transfer_plan = plan_transfers([up_transaction], self.account_map, self.transfer_payee_ids,
+                                           synced_up_account_ids=set(self.account_map.by_up_id))
+
+        ynab_transactions = list(iter_ynab_transactions(
+            [up_transaction], self.ynab_account_id, self.account_map, transfer_plan, include_held=True,
+            rules=self.rules))
+        if not ynab_transactions:
+            return "skipped"
+        tx = ynab_transactions[0]
+
+        known = {row["ynab_account_id"]: row["ynab_transaction_id"]
+                 for row in self.sync_state.get_imported(tx.import_id)}
+        if tx.account_id not in known:
+            results = post_transactions_in_batches([tx], self.budget_id, self.ynab_session, sync_state=self.sync_state)
+            if results["failed"]:
+                raise requests.exceptions.RequestException(f"Could not create {tx.import_id} in YNAB")
+            if results["created"]:
+                return "created"
+            # Otherwise YNAB already had it (reported as a duplicate), so update it instead
+
+        return self.update(tx, known.get(tx.account_id))
+
+    def update(self, tx, ynab_transaction_id=None):
+        # Settling changes the amount (eg. foreign currency), the date and the cleared status; anything else may
+        # have been edited by hand in YNAB since, so it's left alone
+        update = {"amount": tx.amount, "date": tx.date.isoformat(), "cleared": tx.cleared}
+        # YNAB can't change an existing split's lines, and its amount must stay their total (see diff.py)
+        cached = self.sync_state.find_cached_transactions(tx.account_id, [tx.import_id]).get(tx.import_id) or {}
+        if tx.subtransactions or cached.get("subtransactions"):
+            del update["amount"]
+        if ynab_transaction_id:
+            update["id"] = ynab_transaction_id
+        else:
+            update["import_id"] = tx.import_id
+
+        results = patch_transactions_in_batches([update], self.budget_id, self.ynab_session)
+        if results["failed"]:
+            raise requests.exceptions.RequestException(f"Could not update {tx.import_id} in YNAB")
+
+        self.sync_state.record_imported(
+            (updated["account_id"], updated["import_id"], updated["id"])
+            for updated in results["updated"] if updated.get("import_id"))
+        return "updated"
+
+    def delete(self, transaction_id):
+        import_id = transaction_id[:36]
+        deleted = False
+
+        for row in self.sync_state.get_imported(import_id):
+            if row["ynab_transaction_id"] is None:
+                print(f"YNAB id for {import_id} isn't known yet; it will need deleting by hand")
+                continue
+            delete_transaction(self.budget_id, row["ynab_transaction_id"], self.ynab_session)
+            self.sync_state.forget_imported(row["ynab_account_id"], import_id)
+            deleted = True
+
+        return "deleted" if deleted else "skipped"
+
+
+class WebhookServer:
+    """
+    Receives Up webhook events over HTTP and feeds them to a WebhookProcessor on a worker thread
+
+    Args:
+        processor (WebhookProcessor)
+        secret_key (str): the webhook's secretKey; events with a missing or wrong signature are rejected
+        host (str)
+        port (int): 0 picks a free port
+        path (str): where events are POSTed
+    """
+
+    def __init__(self, processor, secret_key, host="127.0.0.1", port=0, path="/webhook"):
+        self.processor = processor
+        self.secret_key = secret_key
+        self.path = path
+        self.events = queue.Queue()
+        # The outcome of each recent event ('created', 'updated', ..., or 'failed'), oldest first
+        self.results = deque(maxlen=RECENT_RESULTS)
+
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.worker_thread = threading.Thread(target=self._work, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{self.path}"
+
+    def _make_handler(self):
+        server = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, status):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.path != server.path:
+                    self.reply(404)
+                    return
+                if not verify_signature(body, self.headers.get(SIGNATURE_HEADER), server.secret_key):
+                    print("Rejected a webhook event with an invalid signature")
+                    self.reply(401)
+                    return
+
+                try:
+                    event = json.loads(body)
+                except ValueError:
+                    self.reply(400)
+                    return
+
+                server.events.put(event)
+                self.reply(200)
+
+        return WebhookHandler
+
+    def _work(self):
+        while True:
+            event = self.events.get()
+            try:
+                if event is None:
+                    return
+                self.results.append(self.processor.handle_event(event))
+            except Exception as e:
+                # Anything an event can raise (eg. a correctly signed but malformed body) must not stop the worker
+                print(f"Error handling webhook event: {e!r}")
+                self.results.append("failed")
+            finally:
+                self.events.task_done()
+
+    def join(self):
+        """
+        Waits until every event received so far has been processed
+        """
+        self.events.join()
+
+    def start(self):
+        self.server_thread.start()
+        self.worker_thread.start()
+        return self
+
+    def serve_forever(self):
+        self.worker_thread.start()
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.events.put(None)
+        self.worker_thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    from dotenv import load_dotenv
+    from account_map import DEFAULT_RESOURCES_PATH, AccountMap
+    from rules import DEFAULT_RULES_PATH, RuleSet
+    from sync_state import DEFAULT_STATE_PATH, SyncState
+    from up_api import create_session as create_up_session, get_accounts, register_webhook
+    from ynab_api import create_session as create_ynab_session
+    from ynab_metadata import YnabMetadata
+
+    arg_parser = argparse.ArgumentParser(description="Push Up transaction events to YNAB as they happen")
+    arg_parser.add_argument("--host", default="0.0.0.0")
+    arg_parser.add_argument("--port", type=int, default=8080)
+    arg_parser.add_argument("--register", metavar="URL",
+                            help="register URL with Up first, and print the secret key to set as UP_WEBHOOK_SECRET")
+    args = arg_parser.parse_args()
+
+    load_dotenv()
+    up_session = create_up_session(os.getenv("UP_API_KEY"))
+
+    if args.register:
+        webhook = register_webhook(up_session, args.register, "up_to_ynab")
+        print(f"Registered webhook {webhook['id']}; add this to .env:")
+        print(f"UP_WEBHOOK_SECRET={webhook['attributes']['secretKey']}")
+        return
+
+    secret_key = os.getenv("UP_WEBHOOK_SECRET")
+    if not secret_key:
+        print("Error: UP_WEBHOOK_SECRET not found in environment variables")
+        print("Register the webhook with --register, then add the secret key it prints to the .env file")
+        exit(1)
+
+    budget_id = os.getenv("YNAB_BUDGET_ID")
+    ynab_session = create_ynab_session(os.getenv("YNAB_API_KEY"))
+
+    resources_path = os.getenv("RESOURCES_PATH", DEFAULT_RESOURCES_PATH)
+    account_map = AccountMap.from_yaml(resources_path) if os.path.exists(resources_path) else AccountMap([])
+    account_map.set_up_accounts(get_accounts(up_session))
+    rules_path = os.getenv("RULES_PATH", DEFAULT_RULES_PATH)
+    rules = RuleSet.from_yaml(rules_path) if os.path.exists(rules_path) else None
+
+    with SyncState(os.getenv("SYNC_STATE_PATH", DEFAULT_STATE_PATH)) as sync_state:
+        transfer_payee_ids = YnabMetadata(budget_id, ynab_session, sync_state).transfer_payee_ids(
+            account_map.by_ynab_id)
+        processor = WebhookProcessor(up_session, ynab_session, budget_id, sync_state, account_map,
+                                     os.getenv("YNAB_ACCOUNT_ID"), transfer_payee_ids, rules)
+        server = WebhookServer(processor, secret_key, args.host, args.port)
+        print(f"Listening for Up webhook events on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
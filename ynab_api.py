@@ -0,0 +1,297 @@
+import os
+import requests
+from itertools import islice
+from http_client import RetryingSession, ynab_rate_limiter
+from metrics import METRICS
+
+"""
+Helpers for talking to the YNAB API
+Transactions are submitted through the bulk endpoint, one request per batch rather than one per transaction,
+which keeps a first sync of thousands of Up transactions well inside YNAB's 200 requests/hour limit
+Account transactions are fetched as deltas using server_knowledge and merged into a local cache (see sync_state.py)
+Requests go through a RetryingSession limited to YNAB's 200 requests/hour (see http_client.py)
+"""
+
+# Can be pointed elsewhere (eg. mock_server.py) by setting YNAB_API_URL in the environment
+YNAB_API_URL = os.getenv("YNAB_API_URL", "https://api.ynab.com/v1")
+
+# Number of transactions sent in each bulk POST; override with YNAB_BATCH_SIZE in .env
+DEFAULT_BATCH_SIZE = 500
+
+
+def ynab_headers(ynab_api_key):
+    return {
+        "Authorization": f"Bearer {ynab_api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def create_session(ynab_api_key, limiter=None, cache=None):
+    """
+    Creates a retrying session for the YNAB API, rate limited to YNAB's 200 requests/hour
+
+    Args:
+        ynab_api_key (str)
+        limiter (TokenBucket): rate limiter to use; defaults to a new one for this session
+        cache (ReplayCache): optional cache to record responses to, or replay them from when offline
+
+    Returns:
+        RetryingSession
+    """
+    session = RetryingSession(limiter or ynab_rate_limiter(), cache=cache, name="ynab")
+    session.headers.update(ynab_headers(ynab_api_key))
+    return session
+
+
+def chunked(items, size):
+    """
+    Yields successive lists of at most `size` items; works for lists and generators alike
+
+    Args:
+        items (iterable)
+        size (int): maximum number of items per chunk
+
+    Yields:
+        list: the next chunk of items
+    """
+    if size < 1:
+        raise ValueError("Chunk size must be at least 1")
+
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def skip_imported(ynab_transactions, sync_state, skipped, lookup_size=DEFAULT_BATCH_SIZE):
+    """
+    Drops transactions whose import_id is already known to be in YNAB, checking the index a chunk at a time
+
+    Args:
+        ynab_transactions (iterable): YnabTransactions
+        sync_state (SyncState): holds the index of imported transactions
+        skipped (list): import_ids of dropped transactions are appended here
+        lookup_size (int): transactions checked per index query
+
+    Yields:
+        YnabTransaction: transactions that still need uploading
+    """
+    for chunk in chunked(ynab_transactions, lookup_size):
+        import_ids_by_account = {}
+        for tx in chunk:
+            if tx.import_id:
+                import_ids_by_account.setdefault(tx.account_id, []).append(tx.import_id)
+
+        imported = {
+            account_id: sync_state.find_imported(account_id, import_ids)
+            for account_id, import_ids in import_ids_by_account.items()
+        }
+
+        for tx in chunk:
+            if tx.import_id and tx.import_id in imported[tx.account_id]:
+                skipped.append(tx.import_id)
+            else:
+                yield tx
+
+
+def post_transactions_in_batches(ynab_transactions, budget_id, session, batch_size=DEFAULT_BATCH_SIZE,
+                                 sync_state=None):
+    """
+    Submits transactions to YNAB's bulk `POST /budgets/{id}/transactions` endpoint, batch_size at a time
+
+    YNAB reports transactions whose import_id it has already seen as duplicates rather than creating them again,
+    so re-sending a batch is safe. A failed batch is reported and skipped; later batches are still sent.
+    Given a sync_state, transactions already in its index of imported transactions aren't sent at all, and
+    everything YNAB reports as created or duplicate is added to the index.
+
+    Args:
+        ynab_transactions (iterable): YnabTransactions, eg. from transform_to_ynab_format()
+        budget_id (str): YNAB budget to post to
+        session (requests.Session): from create_session()
+        batch_size (int): maximum number of transactions per request
+        sync_state (SyncState): optional index of transactions already imported
+
+    Returns:
+        dict: import_ids grouped as 'created', 'duplicates', 'skipped' (never sent) and 'failed',
+            plus the latest 'server_knowledge'
+    """
+    results = {"created": [], "duplicates": [], "skipped": [], "failed": [], "server_knowledge": None}
+
+    if sync_state is not None:
+        ynab_transactions = skip_imported(ynab_transactions, sync_state, results["skipped"])
+
+    for batch_number, batch in enumerate(chunked(ynab_transactions, batch_size), 1):
+        try:
+            print(f"Posting batch {batch_number} ({len(batch)} transactions) to YNAB")
+            response = session.post(
+                f"{YNAB_API_URL}/budgets/{budget_id}/transactions",
+                json={"transactions": [tx.to_json() for tx in batch]})
+            response.raise_for_status()
+
+            data = response.json()["data"]
+            created = [tx for tx in data.get("transactions", []) if tx.get("import_id")]
+            duplicates = data.get("duplicate_import_ids", [])
+            results["created"].extend(tx["import_id"] for tx in created)
+            results["duplicates"].extend(duplicates)
+            results["server_knowledge"] = data.get("server_knowledge", results["server_knowledge"])
+
+            if sync_state is not None:
+                account_ids = {tx.import_id: tx.account_id for tx in batch}
+                sync_state.record_imported(
+                    [(tx["account_id"], tx["import_id"], tx["id"]) for tx in created] +
+                    [(account_ids[import_id], import_id, None) for import_id in duplicates if import_id in account_ids])
+
+        except requests.exceptions.RequestException as e:
+            print(f"Error posting batch {batch_number} to YNAB: {e}")
+            results["failed"].extend(tx.import_id for tx in batch)
+
+    for result, label in (("created", "created"), ("duplicates", "duplicate"), ("skipped", "skipped"),
+                          ("failed", "failed")):
+        METRICS.inc("upload_transactions_total", len(results[result]), result=label)
+    return results
+
+
+def patch_transactions_in_batches(updates, budget_id, session, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Updates existing YNAB transactions through the bulk `PATCH /budgets/{id}/transactions` endpoint, batch_size at
+    a time; only the fields given are changed
+
+    Args:
+        updates (iterable): dicts holding the fields to change, plus the transaction's 'id' or, failing that, its
+            'import_id' to identify it
+        budget_id (str): YNAB budget the transactions are in
+        session (requests.Session): from create_session()
+        batch_size (int): maximum number of transactions per request
+
+    Returns:
+        dict: the updated YNAB transactions as 'updated', the updates that couldn't be sent as 'failed',
+            plus the latest 'server_knowledge'
+    """
+    results = {"updated": [], "failed": [], "server_knowledge": None}
+
+    for batch_number, batch in enumerate(chunked(updates, batch_size), 1):
+        try:
+            print(f"Patching batch {batch_number} ({len(batch)} transactions) in YNAB")
+            response = session.patch(f"{YNAB_API_URL}/budgets/{budget_id}/transactions", json={"transactions": batch})
+            response.raise_for_status()
+
+            data = response.json()["data"]
+            results["updated"].extend(data.get("transactions", []))
+            results["server_knowledge"] = data.get("server_knowledge", results["server_knowledge"])
+
+        except requests.exceptions.RequestException as e:
+            print(f"Error patching batch {batch_number} in YNAB: {e}")
+            results["failed"].extend(batch)
+
+    return results
+
+
+def delete_transaction(budget_id, transaction_id, session):
+    """
+    Deletes one YNAB transaction
+
+    Args:
+        budget_id (str)
+        transaction_id (str): YNAB transaction id
+        session (requests.Session): from create_session()
+    """
+    response = session.delete(f"{YNAB_API_URL}/budgets/{budget_id}/transactions/{transaction_id}")
+    response.raise_for_status()
+
+
+def get_accounts(budget_id, session):
+    """
+    Lists the accounts in a YNAB budget
+
+    Args:
+        budget_id (str)
+        session (requests.Session): from create_session()
+
+    Returns:
+        list: YNAB accounts, including each one's transfer_payee_id
+    """
+    response = session.get(f"{YNAB_API_URL}/budgets/{budget_id}/accounts")
+    response.raise_for_status()
+    return response.json()["data"]["accounts"]
+
+
+def get_budget_metadata(budget_id, kind, session, last_knowledge_of_server=None):
+    """
+    Fetches a budget's accounts, payees or categories; with last_knowledge_of_server, only those changed since then
+
+    Args:
+        budget_id (str)
+        kind (str): 'accounts', 'payees' or 'categories'
+        session (requests.Session): from create_session()
+        last_knowledge_of_server (int): server_knowledge from a previous response, or None for everything
+
+    Returns:
+        tuple: (list of items, including deleted ones when fetching a delta; new server_knowledge)
+            Categories come grouped in YNAB's response; they're returned as one list, each with its group's name
+    """
+    params = {}
+    if last_knowledge_of_server is not None:
+        params["last_knowledge_of_server"] = last_knowledge_of_server
+
+    response = session.get(f"{YNAB_API_URL}/budgets/{budget_id}/{kind}", params=params)
+    response.raise_for_status()
+
+    data = response.json()["data"]
+    if kind != "categories":
+        return data[kind], data["server_knowledge"]
+
+    categories = []
+    for group in data["category_groups"]:
+        for category in group.get("categories", []):
+            # A deleted group takes its categories with it
+            categories.append(dict(category, category_group_name=group["name"],
+                                   deleted=category.get("deleted") or group.get("deleted", False)))
+    return categories, data["server_knowledge"]
+
+
+def get_account_transactions(budget_id, account_id, session, last_knowledge_of_server=None):
+    """
+    Fetches transactions for a YNAB account; with last_knowledge_of_server, only those changed since then
+
+    Args:
+        budget_id (str)
+        account_id (str): YNAB account id
+        session (requests.Session): from create_session()
+        last_knowledge_of_server (int): server_knowledge from a previous response, or None for everything
+
+    Returns:
+        tuple: (list of transactions, including deleted ones when fetching a delta; new server_knowledge)
+    """
+    params = {}
+    if last_knowledge_of_server is not None:
+        params["last_knowledge_of_server"] = last_knowledge_of_server
+
+    response = session.get(
+        f"{YNAB_API_URL}/budgets/{budget_id}/accounts/{account_id}/transactions",
+        params=params)
+    response.raise_for_status()
+
+    data = response.json()["data"]
+    return data["transactions"], data["server_knowledge"]
+
+
+def refresh_account_transactions(sync_state, budget_id, account_id, session):
+    """
+    Brings the locally cached copy of a YNAB account's transactions up to date with a delta request
+    The first call downloads the full list; subsequent calls only transfer what changed
+
+    Args:
+        sync_state (SyncState): store holding the cached transactions and their server_knowledge
+        budget_id (str)
+        account_id (str): YNAB account id
+        session (requests.Session): from create_session()
+
+    Returns:
+        int: number of changed transactions merged into the cache
+    """
+    last_knowledge = sync_state.get_ynab_server_knowledge(account_id)
+    transactions, server_knowledge = get_account_transactions(budget_id, account_id, session, last_knowledge)
+    sync_state.merge_ynab_transactions(account_id, transactions, server_knowledge)
+    return len(transactions)
@@ -0,0 +1,103 @@
+from ynab_api import get_budget_metadata
+
+"""
+A local cache of a YNAB budget's accounts, payees (including each account's transfer payee) and categories
+Lookups are answered in-process from memory, loaded from the sync state database, so printing an account name or
+finding a transfer payee costs no request or rate limit token. The cache is brought up to date with
+last_knowledge_of_server delta requests: when it's empty, when refresh() is called, and once when a lookup misses
+(eg. an account added in YNAB since the last refresh)
+"""
+
+KINDS = ("accounts", "payees", "categories")
+
+
+class YnabMetadata:
+    """
+    Args:
+        budget_id (str)
+        session (requests.Session): from ynab_api.create_session()
+        sync_state (SyncState): where the cache is kept between runs
+    """
+
+    def __init__(self, budget_id, session, sync_state):
+        self.budget_id = budget_id
+        self.session = session
+        self.sync_state = sync_state
+
+        self.items = {}
+        self.by_name = {}
+        # Kinds refreshed (or found missing) by this instance, so a lookup miss costs at most one request per kind
+        self.refreshed = set()
+        for kind in KINDS:
+            self._load(kind)
+
+    def _load(self, kind):
+        items = self.sync_state.get_metadata(self.budget_id, kind)
+        self.items[kind] = {item["id"]: item for item in items}
+        self.by_name[kind] = {item["name"]: item for item in items}
+
+    def refresh(self, kinds=KINDS):
+        """
+        Brings the cache up to date with a delta request per kind; the first ever call downloads everything
+
+        Returns:
+            int: number of new, changed or deleted items
+        """
+        changed = 0
+        for kind in kinds:
+            last_knowledge = self.sync_state.get_metadata_knowledge(self.budget_id, kind)
+            items, server_knowledge = get_budget_metadata(self.budget_id, kind, self.session, last_knowledge)
+            self.sync_state.merge_metadata(self.budget_id, kind, items, server_knowledge)
+            self._load(kind)
+            self.refreshed.add(kind)
+            changed += len(items)
+        return changed
+
+    def get(self, kind, item_id):
+        """
+        Args:
+            kind (str): 'accounts', 'payees' or 'categories'
+            item_id (str)
+
+        Returns:
+            dict: the cached item, or None if YNAB doesn't have it
+        """
+        if item_id not in self.items[kind] and kind not in self.refreshed:
+            self.refresh([kind])
+        return self.items[kind].get(item_id)
+
+    def find(self, kind, name):
+        """
+        Returns:
+            dict: the cached item with this exact name, or None
+        """
+        if name not in self.by_name[kind] and kind not in self.refreshed:
+            self.refresh([kind])
+        return self.by_name[kind].get(name)
+
+    def all(self, kind):
+        """
+        Returns:
+            list: every cached item of a kind, refreshing first if nothing is cached yet
+        """
+        if not self.items[kind] and kind not in self.refreshed:
+            self.refresh([kind])
+        return list(self.items[kind].values())
+
+    def account_name(self, account_id):
+        account = self.get("accounts", account_id)
+        return account["name"] if account else None
+
+    def transfer_payee_ids(self, account_ids=()):
+        """
+        Args:
+            account_ids (iterable): YNAB accounts that must be included; refreshes once if any are missing
+
+        Returns:
+            dict: YNAB account id -> that account's transfer_payee_id
+        """
+        if any(account_id not in self.items["accounts"] for account_id in account_ids):
+            if "accounts" not in self.refreshed:
+                self.refresh(["accounts"])
+        return {account["id"]: account["transfer_payee_id"] for account in self.all("accounts")}
+